@@ -2,31 +2,126 @@ from flask import Flask, render_template, send_from_directory, jsonify, request,
 from werkzeug.utils import secure_filename
 import os
 import process
+import jobs
+import realtime
+import references
+import storage
+import metrics
 import cv2
-from ultralytics import YOLO
 import numpy as np
 import json
 from flask_cors import CORS
+try:
+    from flask_sock import Sock
+except ImportError:  # 未安装 flask-sock 时只提供 HTTP 二进制接口
+    Sock = None
 import base64
+import contextlib
+import hashlib
+import re
+import shutil
+import threading
+import time
+import uuid
 
 app = Flask(__name__)
 CORS(app)  # 允许跨域请求
 
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['ALLOWED_EXTENSIONS'] = {'mp4', 'webm', 'avi'}
+app.config['MAX_UPLOAD_BYTES'] = int(os.environ.get('MAX_UPLOAD_BYTES', 512 * 1024 * 1024))  # 单个上传文件的大小上限
+app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_BYTES'] + 1024 * 1024  # 表单上传超限时直接返回413
+app.config['UPLOAD_CHUNK_SIZE'] = 1024 * 1024
+app.config['ANALYSIS_WIDTH'] = int(os.environ.get('ANALYSIS_WIDTH', process.ANALYSIS_WIDTH))  # 上传视频转码后的宽度
+app.config['ANALYSIS_MAX_FPS'] = float(os.environ.get('ANALYSIS_MAX_FPS', process.ANALYSIS_MAX_FPS))  # 转码后的帧率上限
+app.config['ANALYSIS_FPS'] = float(os.environ.get('ANALYSIS_FPS', 10))  # 对齐和评分使用的统一帧率，不高于两段视频中较低的帧率
+app.config['DTW_MODE'] = os.environ.get('DTW_MODE', process.ALIGN_MODE)  # 对齐方式：multiscale / band / exact（exact 内存随长度平方增长）
+app.config['DTW_RADIUS'] = int(os.environ.get('DTW_RADIUS', process.ALIGN_RADIUS))  # multiscale 每层的搜索半径（帧）
+app.config['DTW_BAND'] = int(os.environ['DTW_BAND']) if os.environ.get('DTW_BAND') else None  # band 的带宽半径（帧），默认较长序列的10%
+app.config['REFERENCE_DIR'] = os.environ.get('REFERENCE_DIR', references.REFERENCE_DIR)  # 参考动作库目录
+app.config['DEFAULT_REFERENCE'] = os.environ.get('DEFAULT_REFERENCE', 'default')  # 实时模式使用的参考动作
+app.config['ANALYZE_WORKERS'] = int(os.environ.get('ANALYZE_WORKERS', 1))  # 同时运行的分析任务数
+app.config['ANALYZE_MAX_PENDING'] = int(os.environ.get('ANALYZE_MAX_PENDING', 16))
+app.config['EXTRACT_WORKERS'] = int(os.environ.get('EXTRACT_WORKERS', 1))  # 大于1时多进程分段提取关键点（适合长视频）
+app.config['ADAPTIVE_EXTRACTION'] = os.environ.get('ADAPTIVE_EXTRACTION') == '1'  # 只在关键帧上推理、其余帧插值（优先于 EXTRACT_WORKERS）
+app.config['ROI_TRACKING'] = os.environ.get('ROI_TRACKING') == '1'  # 分析和实时模式都只在跟踪的人物区域上推理
+app.config['KEEP_ANNOTATED_VIDEOS'] = os.environ.get('KEEP_ANNOTATED_VIDEOS') == '1'  # 是否额外输出中间标注视频
+app.config['WORK_FOLDER'] = os.environ.get('WORK_FOLDER', 'work')  # 每个分析任务的工作目录所在位置
+app.config['STORAGE_MAX_BYTES'] = int(os.environ.get('STORAGE_MAX_BYTES', 10 * 1024 ** 3))  # 上传文件和任务目录的总配额
+app.config['STORAGE_TTL'] = int(os.environ.get('STORAGE_TTL', 7 * 24 * 3600))  # 上传文件和任务目录的保留时间（秒）
+app.config['JANITOR_INTERVAL'] = int(os.environ.get('JANITOR_INTERVAL', 600))  # 后台清理间隔（秒）
+app.config['METRICS_TRACE_DIR'] = os.environ.get('METRICS_TRACE_DIR')  # 设置后每个分析任务的阶段耗时写入该目录
+app.config['REALTIME_SESSION_TIMEOUT'] = int(os.environ.get('REALTIME_SESSION_TIMEOUT', 60))  # 实时会话空闲超时（秒）
+app.config['REALTIME_ALIGN_MODE'] = os.environ.get('REALTIME_ALIGN_MODE', 'dtw')  # dtw 或 time
+app.config['REALTIME_MAX_BATCH'] = int(os.environ.get('REALTIME_MAX_BATCH', 8))  # 并发实时请求合并推理的最大帧数，1 即不合并
+app.config['REALTIME_MAX_WAIT_MS'] = float(os.environ.get('REALTIME_MAX_WAIT_MS', 5))  # 合并推理时最早一帧的最长等待（毫秒）
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+PARTIAL_FOLDER = os.path.join(app.config['UPLOAD_FOLDER'], '.partial')  # 未完成的分块上传
+os.makedirs(PARTIAL_FOLDER, exist_ok=True)
+os.makedirs(app.config['WORK_FOLDER'], exist_ok=True)
 os.environ["WERKZEUG_RUN_MAIN"] = "false"  # 禁用部分重载逻辑
 
-STANDARD_KP_PATH = "keypoints/aligned1.json"
-with open(STANDARD_KP_PATH, 'r') as f:
-    STANDARD_KEYPOINTS = json.load(f)
+# 参考动作库（只读；分析任务的中间关键点写在各自的文件中）
+reference_library = references.ReferenceLibrary(app.config['REFERENCE_DIR'])
+if app.config['DEFAULT_REFERENCE'] not in reference_library:
+    # 首次启动时把原有的标准动作导入为默认参考动作
+    reference_library.add(
+        app.config['DEFAULT_REFERENCE'],
+        process.load_keypoints("keypoints/aligned1.json"),
+        process.effective_fps(process.get_video_info("movies/1.mp4")[1]),
+        video="movies/1.mp4",
+        title="标准动作",
+    )
+STANDARD_REFERENCE = reference_library.get(app.config['DEFAULT_REFERENCE'])
+STANDARD_KEYPOINTS = STANDARD_REFERENCE.keypoints
 
-model = YOLO(os.path.join("models", "yolo11n-pose.pt"))
+# 模型由 process.MODEL_POOL 统一加载，/analyze 与 /process_frame 共用同一实例
+model = process.MODEL_POOL.model(process.DEFAULT_MODEL_PATH)
+# 后台预加载并预热，避免第一个请求承担加载耗时
+# （多进程提取的 spawn 子进程会以 __mp_main__ 重新导入本模块，子进程不需要预加载）
+if __name__ != '__mp_main__':
+    threading.Thread(target=process.MODEL_POOL.preload, name='preload', daemon=True).start()
+
+analysis_jobs = jobs.JobManager(
+    max_workers=app.config['ANALYZE_WORKERS'],
+    max_pending=app.config['ANALYZE_MAX_PENDING'],
+)
+# 上传后的后台转码，与分析任务分开排队
+transcode_jobs = jobs.JobManager(max_workers=1, max_pending=app.config['ANALYZE_MAX_PENDING'])
+
+def files_in_use():
+    """正在排队、转码或分析的上传文件，清理时跳过"""
+    names = [key[0] for key in analysis_jobs.active_keys()]
+    names += [key[1] for key in transcode_jobs.active_keys()]
+    return [os.path.join(app.config['UPLOAD_FOLDER'], name) for name in names]
+
+# 上传文件、未完成的分块上传和任务工作目录按保留期限和配额清理
+janitor = storage.Janitor(
+    [app.config['UPLOAD_FOLDER'], PARTIAL_FOLDER, app.config['WORK_FOLDER']],
+    max_bytes=app.config['STORAGE_MAX_BYTES'],
+    ttl=app.config['STORAGE_TTL'],
+    interval=app.config['JANITOR_INTERVAL'],
+    protect=files_in_use,
+    ttl_only=[PARTIAL_FOLDER],
+)
+if __name__ != '__mp_main__':
+    janitor.start()
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
+def upload_filename(filename):
+    """
+    上传文件的保存名（调用前已用 allowed_file 检查过原始文件名）
+
+    secure_filename 会去掉所有非ASCII字符，中文文件名（如 视频.mp4）只剩扩展名或
+    为空，此时用原主干的哈希作为ASCII主干，扩展名保持原样。
+    """
+    stem, ext = filename.rsplit('.', 1)
+    stem = secure_filename(stem) or hashlib.sha256(stem.encode('utf-8')).hexdigest()[:12]
+    return f"{stem}.{ext.lower()}"
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -37,12 +132,65 @@ def list_uploads():
         files = []
         for filename in os.listdir(app.config['UPLOAD_FOLDER']):
             path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.isfile(path):
+            # 以 . 开头的是分块上传和转码的临时文件
+            if os.path.isfile(path) and not filename.startswith('.'):
                 files.append({'name': filename})
         return jsonify(files)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'error': '文件过大'}), 413
+
+def run_transcode(filename, progress=None):
+    """
+    把上传的视频转为分析用的统一格式（在后台任务线程中执行）
+
+    输出为同主干的 .mp4 并删除原文件（原文件是 .mp4 时原地替换；与其他已有文件
+    重名时加序号，不覆盖）；已满足要求的视频不做处理。
+
+    :return: 结果字典，filename 为转码后的文件名
+    """
+    src_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    base_name, ext = os.path.splitext(filename)
+    width = app.config['ANALYSIS_WIDTH']
+    max_fps = app.config['ANALYSIS_MAX_FPS']
+
+    if not process.needs_transcode(src_path, width, max_fps):
+        return {'filename': filename, 'transcoded': False}
+
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'.{filename}.transcode.mp4')
+    info = process.transcode_for_analysis(src_path, tmp_path, width, max_fps, progress=progress)
+    if ext == '.mp4':
+        dst_name = filename
+        os.replace(tmp_path, src_path)
+    else:
+        dst_name = storage.move_unique(tmp_path, app.config['UPLOAD_FOLDER'], base_name + '.mp4')
+        os.remove(src_path)
+    return {'filename': dst_name, 'transcoded': True, 'fps': info['fps'], 'size': list(info['size'])}
+
+def start_transcode(filename):
+    """提交后台转码任务，返回任务ID"""
+    job, _ = transcode_jobs.submit(('transcode', filename), run_transcode, filename)
+    return job.id
+
+def transcoding_job(filename):
+    """该上传文件（或转码后的同名 .mp4）正在转码的任务"""
+    base_name = os.path.splitext(filename)[0]
+    for ext in app.config['ALLOWED_EXTENSIONS']:
+        job = transcode_jobs.find_active(('transcode', f'{base_name}.{ext}'))
+        if job is not None:
+            return job
+    return None
+
+def upload_response(filename):
+    try:
+        job_id = start_transcode(filename)
+    except jobs.QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'status': 'success', 'filename': filename, 'transcode_job': job_id}), 200
+
 @app.route('/upload', methods=['POST'])
 def handle_upload():
     if 'video' not in request.files:
@@ -53,78 +201,323 @@ def handle_upload():
         return jsonify({'error': '无效文件名'}), 400
         
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-        return jsonify({'status': 'success', 'filename': filename}), 200
+        filename = upload_filename(file.filename)
+        # 先写到未完成目录，再移到不与已有文件重名的位置
+        tmp_path = os.path.join(PARTIAL_FOLDER, f'{uuid.uuid4().hex}.{filename}')
+        file.save(tmp_path)
+        filename = storage.move_unique(tmp_path, app.config['UPLOAD_FOLDER'], filename)
+        return upload_response(filename)
         
     return jsonify({'error': '文件类型不允许'}), 400
 
+@app.route('/upload_stream', methods=['POST', 'PUT'])
+def handle_upload_stream():
+    """
+    流式/分块上传：请求体为原始视频字节，边接收边写盘
+
+    查询参数：
+        filename: 文件名
+        offset: 本块在文件中的起始位置（分块上传时使用，默认0即整文件上传）
+        final: 为1时表示最后一块，完成后开始后台转码
+        upload_id: 上传ID，第一块（offset 为0）时不传，由服务端分配并在响应中返回，
+            后续各块必须带上
+
+    未完成的上传按上传ID保存，同名文件的并发上传互不影响。offset 与服务端已接收的
+    长度不一致时返回409和当前长度，客户端可据此续传。
+    """
+    filename = request.args.get('filename', '')
+    if not allowed_file(filename):
+        return jsonify({'error': '文件类型不允许'}), 400
+    filename = upload_filename(filename)
+    offset = request.args.get('offset', 0, type=int)
+    final = request.args.get('final', '1') == '1'
+    limit = app.config['MAX_UPLOAD_BYTES']
+
+    # 声明的长度已超限时不读取请求体
+    if request.content_length is not None and offset + request.content_length > limit:
+        return jsonify({'error': '文件过大'}), 413
+
+    upload_id = request.args.get('upload_id')
+    if upload_id is None:
+        if offset != 0:
+            return jsonify({'error': '缺少上传ID'}), 400
+        upload_id = uuid.uuid4().hex
+    elif not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+        return jsonify({'error': '无效的上传ID'}), 400
+
+    partial_path = os.path.join(PARTIAL_FOLDER, upload_id)
+    received = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    if offset == 0:
+        received = 0
+    elif offset != received:
+        return jsonify({'error': '分块位置不一致', 'received': received, 'upload_id': upload_id}), 409
+
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    with open(partial_path, 'r+b' if offset else 'wb') as f:
+        f.seek(offset)
+        f.truncate()
+        while True:
+            chunk = request.stream.read(chunk_size)
+            if not chunk:
+                break
+            received += len(chunk)
+            if received > limit:
+                f.close()
+                os.remove(partial_path)
+                return jsonify({'error': '文件过大'}), 413
+            f.write(chunk)
+
+    if not final:
+        return jsonify({
+            'status': 'partial', 'filename': filename, 'received': received, 'upload_id': upload_id,
+        }), 200
+    if received == 0:
+        os.remove(partial_path)
+        return jsonify({'error': '空文件'}), 400
+
+    filename = storage.move_unique(partial_path, app.config['UPLOAD_FOLDER'], filename)
+    return upload_response(filename)
+
+def choose_reference(user_video, reference_name=None, progress=None):
+    """
+    确定与用户视频比较的参考动作
+
+    指定名称时直接使用；库中只有一个参考动作时用它；否则先提取用户视频的
+    关键点（写入关键点缓存，后续提取直接命中），用窗口嵌入索引找出最接近的参考动作。
+
+    :return: (Reference, 候选列表或 None)
+    """
+    if reference_name:
+        return reference_library.get(reference_name), None
+    names = reference_library.names()
+    if len(names) == 1:
+        return reference_library.get(names[0]), None
+
+    raw = process.extract_video_keypoints(
+        user_video, progress=progress, workers=app.config['EXTRACT_WORKERS'],
+        adaptive=app.config['ADAPTIVE_EXTRACTION'], roi=app.config['ROI_TRACKING'],
+    )
+    if progress is not None:
+        progress("match")
+    _, fps, _ = process.get_video_info(user_video)
+    with metrics.stage("match", frames=len(raw)):
+        candidates = reference_library.match(process.normalize_keypoint_sequence(raw), fps)
+    return reference_library.get(candidates[0]["name"]), candidates
+
+
+def analysis_work_key(user_video, reference_name=None):
+    """
+    分析任务工作目录的键：由用户视频内容、模型、参考动作（自动匹配时为库中的全部
+    参考动作）和分析参数决定，相同输入的重复分析复用同一目录
+    """
+    if reference_name:
+        reference_part = process.KEYPOINT_CACHE.key(reference_library.get(reference_name).video, process.DEFAULT_MODEL_PATH)
+    else:
+        reference_part = "auto:" + ",".join(reference_library.names())
+    parts = [
+        process.KEYPOINT_CACHE.key(user_video, process.DEFAULT_MODEL_PATH),
+        reference_part,
+        str(app.config['ANALYSIS_FPS']),
+        f"{app.config['DTW_MODE']}:{app.config['DTW_BAND']}:{app.config['DTW_RADIUS']}",
+        str(app.config['KEEP_ANNOTATED_VIDEOS']),
+        process.extraction_variant(app.config['ADAPTIVE_EXTRACTION'], app.config['ROI_TRACKING']) or '',
+    ]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:24]
+
+
+def publish_overlay(work_dir, result, base_name):
+    """把工作目录中的叠加视频发布到 uploads（供文件列表和下载），返回发布的文件名"""
+    suffix = '' if result['reference'] == app.config['DEFAULT_REFERENCE'] else f"_{result['reference']}"
+    filename = f"{base_name}{suffix}_叠加.mp4"
+    storage.publish(
+        os.path.join(work_dir, 'overlay.mp4'),
+        os.path.join(app.config['UPLOAD_FOLDER'], filename),
+    )
+    return filename
+
+
+def run_analysis(user_filename, reference_name=None, progress=None):
+    """
+    完整的视频分析流程（在后台任务线程中执行）
+
+    所有产物先写入本任务的临时工作目录，完成后整体重命名为按输入内容寻址的
+    工作目录，同一输入再次分析时直接复用。
+
+    :param user_filename: uploads 目录下的用户视频文件名
+    :param reference_name: 参考动作名称，为 None 时自动匹配
+    :param progress: 进度回调 progress(阶段, 已完成帧数, 总帧数)
+    :return: 结果字典
+    """
+    user_video = os.path.join(app.config['UPLOAD_FOLDER'], user_filename)
+    base_name = os.path.splitext(user_filename)[0]
+
+    work_dir = os.path.join(app.config['WORK_FOLDER'], analysis_work_key(user_video, reference_name))
+    result_path = os.path.join(work_dir, 'result.json')
+    if os.path.exists(result_path):
+        # 相同输入已分析过：复用全部中间结果
+        with open(result_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        storage.touch(work_dir)
+        result['overlay'] = publish_overlay(work_dir, result, base_name)
+        result['reused'] = True
+        return result
+
+    staging_dir = os.path.join(
+        app.config['WORK_FOLDER'], f".{os.path.basename(work_dir)}.{uuid.uuid4().hex}"
+    )
+    os.makedirs(staging_dir)
+    try:
+        # 设置了追踪目录时记录本任务各阶段的耗时
+        trace_dir = app.config['METRICS_TRACE_DIR']
+        with metrics.trace(user_filename) if trace_dir else contextlib.nullcontext() as trace:
+            reference, candidates = choose_reference(user_video, reference_name, progress)
+            if not reference.video:
+                raise ValueError(f"参考动作 {reference.name} 没有对应的视频")
+
+            # 所有中间文件都在本任务的工作目录中，并发任务互不影响，也不改动参考动作库
+            keep_annotated = app.config['KEEP_ANNOTATED_VIDEOS']
+            paths = {
+                "video1_path": reference.video,
+                "video2_path": user_video,
+                # 中间标注视频默认不生成，叠加视频直接由原视频和关键点渲染
+                "output_vid1_path": os.path.join(staging_dir, "reference_process.mp4") if keep_annotated else None,
+                "output_vid2_path": os.path.join(staging_dir, "user_process.mp4") if keep_annotated else None,
+                "keypoints1_path": os.path.join(staging_dir, "reference_kp.npy"),
+                "keypoints2_path": os.path.join(staging_dir, "user_kp.npy"),
+                "aligned1_path": os.path.join(staging_dir, "reference_aligned.npy"),
+                "aligned2_path": os.path.join(staging_dir, "user_aligned.npy"),
+                "overlay_path": os.path.join(staging_dir, "overlay.mp4"),
+            }
+            result = run_analysis_stages(paths, progress)
+        del result['overlay']  # 工作目录中固定为 overlay.mp4，发布后的文件名见下
+        result['work_id'] = os.path.basename(work_dir)
+        result['reference'] = reference.name
+        if candidates is not None:
+            result['candidates'] = candidates
+        with open(os.path.join(staging_dir, 'result.json'), 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+        storage.finalize_dir(staging_dir, work_dir)
+    finally:
+        if os.path.isdir(staging_dir):
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    result['overlay'] = publish_overlay(work_dir, result, base_name)
+    if trace is not None:
+        # 按工作目录命名，不使用客户端提供的文件名
+        trace.dump(os.path.join(trace_dir, f"{result['work_id']}-{int(time.time())}.json"))
+        result['timings'] = trace.to_dict()
+    return result
+
+
+def run_analysis_stages(paths, progress=None):
+    """依次执行关键点提取、对齐、评分和叠加视频渲染"""
+    # 执行处理流程
+    raw_keypoints1, raw_keypoints2 = process.process_pose_videos(
+        paths["video1_path"],
+        paths["video2_path"],
+        paths["output_vid1_path"],
+        paths["output_vid2_path"],
+        paths["keypoints1_path"],
+        paths["keypoints2_path"],
+        progress=progress,
+        workers=app.config['EXTRACT_WORKERS'],
+        analysis_fps=app.config['ANALYSIS_FPS'],
+        adaptive=app.config['ADAPTIVE_EXTRACTION'],
+        roi=app.config['ROI_TRACKING'],
+    )
+
+    if progress is not None:
+        progress("align")
+    path_i, path_j = process.align_keypoints(
+        paths["keypoints1_path"],
+        paths["keypoints2_path"],
+        paths["aligned1_path"],
+        paths["aligned2_path"],
+        mode=app.config['DTW_MODE'],
+        band=app.config['DTW_BAND'],
+        radius=app.config['DTW_RADIUS'],
+    )
+
+    # 计算相似度
+    if progress is not None:
+        progress("score")
+    resolution = (640, 360)
+    weights = [0.2,0.5,0.5,0.7,0.7,0.6,0.6,0.7,0.7,0.6,0.6,0,0,0,0,0,0]
+
+    similarity_scores, _ = process.calculate_similarity_and_low_similarity_frames(
+        paths["aligned1_path"],
+        paths["aligned2_path"],
+        resolution,
+        weights
+    )
+
+    # 把分析帧率上的路径映射回原帧率，沿路径生成叠加视频
+    _, fps1, _ = process.get_video_info(paths["video1_path"])
+    _, fps2, _ = process.get_video_info(paths["video2_path"])
+    analysis_fps = process.common_analysis_fps(fps1, fps2, app.config['ANALYSIS_FPS'])
+    frames_i, frames_j, frame_scores = process.expand_alignment(
+        path_i, path_j, similarity_scores, analysis_fps,
+        fps1, fps2, len(raw_keypoints1), len(raw_keypoints2)
+    )
+    process.render_overlay_video(
+        paths["video1_path"],
+        paths["video2_path"],
+        raw_keypoints1,
+        raw_keypoints2,
+        frames_i,
+        frames_j,
+        frame_scores,
+        paths["overlay_path"],
+        progress=progress,
+    )
+
+    return {'overlay': os.path.basename(paths["overlay_path"])}
+
+
 @app.route('/analyze', methods=['POST'])
 def handle_analysis():
     if not request.json or 'filename' not in request.json:
         return jsonify({'error': '未选择文件'}), 400
-    
+
+    user_filename = request.json['filename']
+    # 上传的文件都以 secure_filename 保存，其他名称（如含路径）不会指向上传文件
+    if not isinstance(user_filename, str) or secure_filename(user_filename) != user_filename:
+        return jsonify({'error': '文件名无效'}), 400
+    transcoding = transcoding_job(user_filename)
+    if transcoding is not None:
+        return jsonify({'error': '视频正在转码，请稍后再试', 'transcode_job': transcoding.id}), 409
+
+    user_video = os.path.join(app.config['UPLOAD_FOLDER'], user_filename)
+    if not os.path.isfile(user_video):
+        return jsonify({'error': '文件不存在'}), 404
+
+    # 不指定参考动作时自动匹配
+    reference_name = request.json.get('reference') or None
+    if reference_name is not None and not isinstance(reference_name, str):
+        return jsonify({'error': '参考动作名称无效'}), 400
+    if reference_name is not None and reference_name not in reference_library:
+        return jsonify({'error': '参考动作不存在'}), 404
+
     try:
-        # 路径配置
-        user_filename = request.json['filename']
-        user_video = os.path.join(app.config['UPLOAD_FOLDER'], user_filename)
-        
-        # 定义处理路径（直接使用原文件名+后缀）
-        base_name = os.path.splitext(user_filename)[0]
-        # app.py中分析视频的路径配置
-        paths = {
-            "video1_path": "movies/1.mp4",
-            "video2_path": user_video,
-            "output_vid1_path": "uploads/1_process.mp4",  # 标准视频处理结果
-            "output_vid2_path": f"uploads/{base_name}_处理.mp4",
-            "keypoints1_path": "keypoints/aligned1.json",     # 标准关键点固定路径
-            "keypoints2_path": f"keypoints/{base_name}_kp.json",
-            "overlay_path": f"uploads/{base_name}_叠加.mp4"
-        }
-        
-        # 执行处理流程
-        process.process_pose_videos(
-            paths["video1_path"], 
-            paths["video2_path"],
-            paths["output_vid1_path"],
-            paths["output_vid2_path"],
-            paths["keypoints1_path"],
-            paths["keypoints2_path"]
-        )
-        
-        process.align_keypoints(
-            paths["keypoints1_path"],
-            paths["keypoints2_path"],
-            paths["keypoints1_path"],  # 覆盖原关键点文件
-            paths["keypoints2_path"]
-        )
-        
-        # 计算相似度
-        resolution = (640, 360)
-        weights = [0.2,0.5,0.5,0.7,0.7,0.6,0.6,0.7,0.7,0.6,0.6,0,0,0,0,0,0]
-        
-        similarity_scores, _ = process.calculate_similarity_and_low_similarity_frames(
-            paths["keypoints1_path"],
-            paths["keypoints2_path"],
-            resolution,
-            weights
-        )
-        
-        # 生成叠加视频
-        process.generate_overlay_video(
-            paths["output_vid1_path"],
-            paths["output_vid2_path"],
-            similarity_scores,
-            paths["overlay_path"]
-        )
-        
-        return jsonify({
-            'status': 'success',
-            'overlay': f"{base_name}_overlay.mp4"  # 直接返回文件名
-        }), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        # 同一文件（内容未变）与同一参考动作的分析正在进行时直接返回已有任务
+        stat = os.stat(user_video)
+        key = (user_filename, stat.st_size, stat.st_mtime_ns, reference_name)
+        job, _ = analysis_jobs.submit(key, run_analysis, user_filename, reference_name)
+    except jobs.QueueFullError as e:
+        return jsonify({'error': str(e)}), 503
+
+    return jsonify({'status': job.status, 'job_id': job.id}), 202
+
+@app.route('/references', methods=['GET'])
+def list_references():
+    return jsonify([ref.to_dict() for ref in reference_library.references()])
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = analysis_jobs.get(job_id) or transcode_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在'}), 404
+    return jsonify(job.to_dict())
 
 @app.route('/process_frame', methods=['POST'])
 def process_frame():
@@ -135,15 +528,11 @@ def process_frame():
         nparr = np.frombuffer(image_data, np.uint8)
         frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
-        # 处理帧（使用process.py中的逻辑）
-        processed_frame = process.process_single_frame(
-            frame=frame,
-            standard_kp_json=STANDARD_KEYPOINTS,
-            model=model,
-            frame_index=0,  # 实时模式不需要帧索引
-            weights=[0.2,0.5,0.5,0.7,0.7,0.6,0.6,0.7,0.7,0.6,0.6,0,0,0,0,0,0],
-            resolution=(640, 480)
-        )
+        if frame is None:
+            raise ValueError('无法解码图像')
+
+        # 处理帧：解码出的帧只用这一次，直接在上面绘制（实时模式不需要帧索引）
+        _, processed_frame = REALTIME_COMPARATOR.process(frame, realtime_model, 0, in_place=True)
         
         # 编码返回图片
         _, buffer = cv2.imencode('.jpg', processed_frame)
@@ -154,6 +543,155 @@ def process_frame():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+REALTIME_WEIGHTS = [0.2,0.5,0.5,0.7,0.7,0.6,0.6,0.7,0.7,0.6,0.6,0,0,0,0,0,0]
+REALTIME_RESOLUTION = (640, 480)
+REALTIME_REF_FPS = STANDARD_REFERENCE.fps
+# 标准序列、权重等常数只准备一次；比较器的绘制缓冲区按线程分开，可被多个请求线程共用
+REALTIME_COMPARATOR = process.PoseComparator(STANDARD_KEYPOINTS, REALTIME_WEIGHTS, REALTIME_RESOLUTION)
+# 所有实时请求（/process_frame、/process_frame_bin、WebSocket）的推理经过同一个批处理器
+realtime_model = realtime.InferenceBatcher(
+    model,
+    max_batch=app.config['REALTIME_MAX_BATCH'],
+    max_wait=app.config['REALTIME_MAX_WAIT_MS'] / 1000,
+)
+
+# 每个实时客户端一个会话，维护标准序列上的当前帧游标
+realtime_sessions = realtime.SessionStore(
+    lambda: realtime.RealtimeSession(
+        STANDARD_KEYPOINTS,
+        ref_fps=REALTIME_REF_FPS,
+        mode=app.config['REALTIME_ALIGN_MODE'],
+        weights=REALTIME_WEIGHTS,
+    ),
+    idle_timeout=app.config['REALTIME_SESSION_TIMEOUT'],
+)
+
+def realtime_result(jpeg_bytes, session=None):
+    """
+    实时分析单帧：只返回关键点和相似度，骨骼由客户端绘制
+
+    :param jpeg_bytes: 原始JPEG字节
+    :param session: 实时会话；为 None 时总与标准序列第一帧比较
+    :return: 可直接序列化为JSON的结果字典
+    """
+    frame = cv2.imdecode(np.frombuffer(jpeg_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError('无法解码图像')
+
+    with metrics.stage("realtime_frame", frames=1):
+        if session is not None:
+            keypoints, ref_index = session.detect(frame, realtime_model, app.config['ROI_TRACKING'])
+        else:
+            keypoints, ref_index = process.detect_single_pose(frame, realtime_model), 0
+    if keypoints is not None:
+        similarity, valid = REALTIME_COMPARATOR.score(keypoints, ref_index)
+    else:
+        similarity, valid = 0.0, False
+    return {
+        # 每个关键点 [x, y, 置信度]，保留1位小数即可
+        'kp': np.round(np.nan_to_num(keypoints), 1).tolist() if keypoints is not None else None,
+        'score': round(similarity, 2),
+        'valid': valid,
+        'ref_index': ref_index,
+        'session': session.id if session is not None else None,
+        'w': frame.shape[1],
+        'h': frame.shape[0],
+    }
+
+@app.route('/process_frame_bin', methods=['POST'])
+def process_frame_binary():
+    """
+    请求体为原始JPEG（无base64），WebSocket 不可用时的回退接口
+
+    会话ID通过 X-Session-Id 请求头或 session 查询参数传递，缺省时新建会话，
+    新会话ID在返回结果的 session 字段中。
+    """
+    try:
+        session_id = request.headers.get('X-Session-Id') or request.args.get('session')
+        session = realtime_sessions.get_or_create(session_id)
+        return jsonify(realtime_result(request.get_data(), session))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route('/ws/realtime')
+    def realtime_socket(ws):
+        """
+        持久连接的实时分析：客户端发送二进制JPEG帧，服务端回送JSON结果
+
+        接收线程只保留最新一帧，处理跟不上时旧帧直接丢弃。每个连接一个会话，
+        连接关闭时删除。
+        """
+        session = realtime_sessions.get_or_create()
+        cond = threading.Condition()
+        state = {'frame': None, 'closed': False, 'dropped': 0}
+
+        def receive_frames():
+            try:
+                while True:
+                    data = ws.receive()
+                    if data is None:
+                        break
+                    if isinstance(data, str):  # 只接受二进制帧
+                        continue
+                    with cond:
+                        if state['frame'] is not None:
+                            state['dropped'] += 1
+                        state['frame'] = data
+                        cond.notify()
+            except Exception:
+                pass
+            finally:
+                with cond:
+                    state['closed'] = True
+                    cond.notify()
+
+        threading.Thread(target=receive_frames, daemon=True).start()
+
+        seq = 0
+        try:
+            while True:
+                with cond:
+                    while state['frame'] is None and not state['closed']:
+                        cond.wait()
+                    if state['closed']:
+                        break
+                    data, state['frame'] = state['frame'], None
+                    dropped = state['dropped']
+
+                seq += 1
+                try:
+                    result = realtime_result(data, session)
+                except Exception as e:
+                    result = {'error': str(e)}
+                result.update({'seq': seq, 'dropped': dropped})
+                try:
+                    ws.send(json.dumps(result))
+                except Exception:
+                    break
+        finally:
+            realtime_sessions.remove(session.id)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus 文本格式的流水线指标（需设置 POSE_METRICS=1 才会采集阶段耗时）"""
+    for status, count in analysis_jobs.counts().items():
+        metrics.REGISTRY.set_gauge('pose_analysis_jobs', count, status=status)
+    metrics.REGISTRY.set_gauge('pose_realtime_sessions', len(realtime_sessions))
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/results/<path:filename>')
+def result_video(filename):
+    """
+    结果视频在线播放
+
+    支持 Range 分段请求（返回 206，可边下边播、拖动进度条）和 ETag/Last-Modified
+    条件请求（未变化时返回 304）；文件名不变而内容被重新生成时 ETag 随之改变。
+    """
+    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, conditional=True, etag=True, max_age=0)
+
 @app.route('/download/<path:filename>')  # 使用path转换器支持斜杠和特殊字符
 def download_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
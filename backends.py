@@ -0,0 +1,336 @@
+"""
+姿态模型的推理后端
+
+CPU 节点上 PyTorch 即时执行不是最快的选择。这里把 .pt 权重按固定输入尺寸导出为
+ONNX（ONNX Runtime 执行）或 OpenVINO IR，可选用参考视频中的帧做 INT8 训练后量化
+校准。导出结果按权重内容、后端、输入尺寸、量化参数缓存在磁盘上，只导出一次；
+加载后仍是 ultralytics 的 YOLO 对象，推理结果的用法与 PyTorch 完全相同。
+
+后端通过环境变量选择（所有加载模型的地方一致生效，包括并行提取的工作进程）：
+    POSE_BACKEND=torch|onnx|openvino   默认 torch
+    POSE_IMGSZ=640                      导出的输入尺寸（torch 后端不使用）
+    POSE_INT8=1                         启用 INT8 量化
+
+onnx 后端需要安装 onnx、onnxslim、onnxruntime，openvino 后端需要安装 openvino，
+openvino 的 INT8 量化另需 nncf；未安装时加载直接报错（不让 ultralytics 在服务进程里
+自动 pip 安装）。
+
+用法：
+    python backends.py export --backend openvino --int8
+    python backends.py check --backend onnx --int8 --frames 60
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+import ultralytics
+
+import process
+import storage
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+EXPORT_DIR = os.path.join("cache", "models")
+EXPORT_IMGSZ = 640
+CALIBRATION_VIDEO = os.path.join("movies", "1.mp4")
+CALIBRATION_FRAMES = 300    # 校准用的帧数上限，从视频中均匀抽取
+
+# 精度检查的通过条件
+MAX_MEAN_DELTA = 0.01       # 关键点平均偏差（相对画面对角线）
+MAX_SCORE_DRIFT = 2.0       # 相似度漂移（百分点）
+MAX_DETECTION_MISMATCH = 0.02   # 只有一边检测到人的帧所占比例
+
+# 精度检查的评分参数，与 app.py 的分析流程一致
+CHECK_RESOLUTION = (640, 360)
+CHECK_WEIGHTS = [0.2, 0.5, 0.5, 0.7, 0.7, 0.6, 0.6, 0.7, 0.7, 0.6, 0.6, 0, 0, 0, 0, 0, 0]
+
+# COCO 17 点的左右对称关系（校准数据集配置需要）
+_FLIP_IDX = [0, 2, 1, 4, 3, 6, 5, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15]
+
+# 各后端推理和导出需要的模块
+_RUNTIME_MODULES = {"onnx": ("onnxruntime",), "openvino": ("openvino",)}
+_EXPORT_MODULES = {"onnx": ("onnx", "onnxslim"), "openvino": ()}
+_INT8_MODULES = {"onnx": (), "openvino": ("nncf",)}
+
+_export_lock = threading.Lock()
+
+
+def configured():
+    """
+    从环境变量读取当前进程使用的后端配置
+
+    :return: {"backend", "imgsz", "int8"}
+    """
+    backend = os.environ.get("POSE_BACKEND", "torch").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的推理后端: {backend}（可选 {', '.join(BACKENDS)}）")
+    return {
+        "backend": backend,
+        "imgsz": int(os.environ.get("POSE_IMGSZ", EXPORT_IMGSZ)),
+        "int8": os.environ.get("POSE_INT8", "0") not in ("", "0", "false", "False"),
+    }
+
+
+def describe(backend="torch", imgsz=EXPORT_IMGSZ, int8=False):
+    """后端配置的简短标识，如 openvino-640-int8；torch 后端为 torch"""
+    if backend == "torch":
+        return "torch"
+    return f"{backend}-{imgsz}-{'int8' if int8 else 'fp32'}"
+
+
+def require_modules(backend, export=False, int8=False):
+    """
+    检查后端需要的模块都已安装
+
+    缺少时 ultralytics 会在当前进程中尝试 pip 安装，这里提前报错。
+
+    :param export: 是否还要检查导出需要的模块
+    :param int8: 是否还要检查 INT8 量化需要的模块
+    :raises ImportError: 缺少模块时，消息中列出需要安装的包
+    """
+    names = list(_RUNTIME_MODULES.get(backend, ()))
+    if export:
+        names += _EXPORT_MODULES.get(backend, ())
+        if int8:
+            names += _INT8_MODULES.get(backend, ())
+    missing = [name for name in names if importlib.util.find_spec(name) is None]
+    if missing:
+        raise ImportError(f"{backend} 后端缺少依赖，请先安装: pip install {' '.join(missing)}")
+
+
+def export_key(weights, backend, imgsz, int8, calibration_video=CALIBRATION_VIDEO,
+               calibration_frames=CALIBRATION_FRAMES):
+    """导出缓存键：权重内容、后端、输入尺寸、量化及校准数据、ultralytics 版本"""
+    parts = [process.file_digest(weights), describe(backend, imgsz, int8), ultralytics.__version__]
+    if int8:
+        parts += [process.file_digest(calibration_video), str(calibration_frames)]
+    return hashlib.sha256(":".join(parts).encode("utf-8")).hexdigest()[:24]
+
+
+def write_calibration_dataset(video_path, output_dir, max_frames=CALIBRATION_FRAMES):
+    """
+    从视频中均匀抽帧，写成 ultralytics 可读的无标注数据集（只用于量化校准）
+
+    :return: 数据集配置文件路径
+    """
+    total, _, _ = process.get_video_info(video_path)
+    wanted = set(np.linspace(0, max(total - 1, 0), min(max_frames, total)).round().astype(int).tolist())
+    image_dir = os.path.join(output_dir, "images", "val")
+    os.makedirs(image_dir, exist_ok=True)
+    written = 0
+    for idx, frame in enumerate(process.iter_video_frames(video_path)):
+        if idx in wanted:
+            cv2.imwrite(os.path.join(image_dir, f"{idx:06d}.jpg"), frame)
+            written += 1
+    if not written:
+        raise ValueError(f"无法从校准视频读取帧: {video_path}")
+
+    # YAML 兼容 JSON，直接按 JSON 写出
+    config = {
+        "path": os.path.abspath(output_dir),
+        "train": "images/val",
+        "val": "images/val",
+        "names": {0: "person"},
+        "kpt_shape": [process.NUM_KEYPOINTS, 3],
+        "flip_idx": _FLIP_IDX,
+    }
+    config_path = os.path.join(output_dir, "calibration.yaml")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=2)
+    return config_path
+
+
+def export_model(weights=None, backend="onnx", imgsz=EXPORT_IMGSZ, int8=False,
+                 calibration_video=CALIBRATION_VIDEO, calibration_frames=CALIBRATION_FRAMES,
+                 export_dir=EXPORT_DIR):
+    """
+    导出固定输入尺寸的 ONNX / OpenVINO 模型（已导出时直接返回缓存）
+
+    导出在临时目录中进行，完成后整体重命名为 <export_dir>/<缓存键>，多个进程
+    同时导出时只保留先完成的一份。批大小固定为1，更大的批次由 ultralytics 拆分执行。
+
+    :param weights: .pt 权重路径，默认 process.DEFAULT_MODEL_PATH
+    :param backend: onnx 或 openvino
+    :param imgsz: 输入尺寸（正方形）
+    :param int8: 是否做 INT8 训练后量化
+    :param calibration_video: INT8 校准用的视频
+    :param calibration_frames: 校准帧数上限
+    :return: 导出模型路径（.onnx 文件或 OpenVINO 模型目录）
+    """
+    weights = weights or process.DEFAULT_MODEL_PATH
+    if backend not in BACKENDS or backend == "torch":
+        raise ValueError(f"不支持导出的后端: {backend}")
+    key = export_key(weights, backend, imgsz, int8, calibration_video, calibration_frames)
+    final_dir = os.path.join(export_dir, key)
+    manifest_path = os.path.join(final_dir, "manifest.json")
+
+    with _export_lock:
+        if not os.path.exists(manifest_path):
+            require_modules(backend, export=True, int8=int8)
+            os.makedirs(export_dir, exist_ok=True)
+            staging_dir = os.path.join(export_dir, f".{key}.{uuid.uuid4().hex}")
+            os.makedirs(staging_dir)
+            try:
+                # 导出结果写在权重文件旁边，先把权重复制到临时目录
+                local_weights = os.path.join(staging_dir, os.path.basename(weights))
+                shutil.copyfile(weights, local_weights)
+                export_args = {"format": backend, "imgsz": imgsz, "batch": 1, "dynamic": False}
+                if int8:
+                    export_args["quantize"] = 8
+                    export_args["data"] = write_calibration_dataset(
+                        calibration_video, os.path.join(staging_dir, "calibration"), calibration_frames)
+                start = time.perf_counter()
+                artifact = YOLO(local_weights).export(**export_args)
+                manifest = {
+                    "artifact": os.path.relpath(str(artifact).rstrip("/\\"), staging_dir),
+                    "weights": weights,
+                    "backend": backend,
+                    "imgsz": imgsz,
+                    "int8": int8,
+                    "ultralytics": ultralytics.__version__,
+                    "export_seconds": round(time.perf_counter() - start, 2),
+                }
+                os.remove(local_weights)
+                shutil.rmtree(os.path.join(staging_dir, "calibration"), ignore_errors=True)
+                with open(os.path.join(staging_dir, "manifest.json"), "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+            except BaseException:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+            storage.finalize_dir(staging_dir, final_dir)
+
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    return os.path.join(final_dir, manifest["artifact"])
+
+
+def load_model(weights=None, backend=None, imgsz=None, int8=None):
+    """
+    按后端加载姿态模型，未指定的参数取环境变量配置
+
+    :return: YOLO 模型（torch 后端直接加载 .pt，其余加载导出模型）
+    """
+    weights = weights or process.DEFAULT_MODEL_PATH
+    config = configured()
+    backend = backend or config["backend"]
+    imgsz = imgsz or config["imgsz"]
+    int8 = config["int8"] if int8 is None else int8
+    if backend == "torch":
+        return YOLO(weights)
+    require_modules(backend)
+    return YOLO(export_model(weights, backend, imgsz, int8), task="pose")
+
+
+def _run_models(models, video_path, frames=None):
+    """
+    多个模型逐帧推理同一视频（边解码边推理，不缓存整段视频）
+
+    :return: 每个模型的 (绝对坐标关键点 (帧数, 17, 3), 每帧耗时（秒）)
+    """
+    for model in models:
+        # 预热，首次推理的初始化开销不计入耗时
+        model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+    selectors = [process.PersonSelector() for _ in models]
+    keypoints = [[] for _ in models]
+    seconds = [[] for _ in models]
+    for frame in process.iter_video_frames(video_path, stop=frames):
+        for idx, model in enumerate(models):
+            start = time.perf_counter()
+            result = model(frame, verbose=False)[0]
+            seconds[idx].append(time.perf_counter() - start)
+            keypoints[idx].append(process.extract_keypoints(result, selectors[idx]))
+    if not keypoints[0]:
+        raise ValueError(f"无法读取视频帧: {video_path}")
+    return [(np.stack(kp), np.array(sec)) for kp, sec in zip(keypoints, seconds)]
+
+
+def check_accuracy(candidate, baseline=None, video_path=CALIBRATION_VIDEO, frames=None):
+    """
+    对比候选后端与 PyTorch 基线在参考视频上的结果
+
+    关键点偏差只统计两边都可信（未被置信度屏蔽）的关节，以画面对角线归一化；
+    相似度漂移把候选结果当作用户动作、基线结果当作标准动作，按分析流程的
+    评分方式逐帧打分，100 减去平均分即为漂移（相同结果为0）。
+
+    :param candidate: 候选模型（YOLO）
+    :param baseline: 基线模型，默认加载 PyTorch 权重
+    :param video_path: 参考视频
+    :param frames: 只使用前若干帧，默认全部
+    :return: 检查报告 dict，passed 表示是否在阈值内
+    """
+    baseline = baseline or YOLO(process.DEFAULT_MODEL_PATH)
+    _, _, (width, height) = process.get_video_info(video_path)
+    (base_kp, base_seconds), (cand_kp, cand_seconds) = _run_models([baseline, candidate], video_path, frames)
+
+    base_found = np.isfinite(base_kp[..., :2]).any(axis=(1, 2))
+    cand_found = np.isfinite(cand_kp[..., :2]).any(axis=(1, 2))
+    deltas = np.linalg.norm(cand_kp[..., :2] - base_kp[..., :2], axis=-1)
+    deltas = deltas[np.isfinite(deltas)] / float(np.hypot(width, height))
+
+    report = {
+        "frames": len(base_kp),
+        "detected": {"baseline": int(base_found.sum()), "candidate": int(cand_found.sum())},
+        "detection_mismatch": int((base_found != cand_found).sum()),
+        "joints_compared": int(len(deltas)),
+        "delta_mean": float(deltas.mean()) if len(deltas) else None,
+        "delta_p95": float(np.percentile(deltas, 95)) if len(deltas) else None,
+        "delta_max": float(deltas.max()) if len(deltas) else None,
+        "ms_per_frame": {
+            "baseline": float(base_seconds.mean() * 1000),
+            "candidate": float(cand_seconds.mean() * 1000),
+        },
+    }
+
+    both = base_found & cand_found
+    if both.any():
+        scores, _ = process.score_keypoint_sequences(
+            process.normalize_keypoint_sequence(base_kp[both]),
+            process.normalize_keypoint_sequence(cand_kp[both]),
+            CHECK_RESOLUTION, CHECK_WEIGHTS,
+        )
+        report["similarity_mean"] = float(scores.mean())
+        report["similarity_min"] = float(scores.min())
+        report["score_drift"] = float(100.0 - scores.mean())
+    else:
+        report["similarity_mean"] = report["similarity_min"] = report["score_drift"] = None
+
+    report["passed"] = (
+        report["detection_mismatch"] <= MAX_DETECTION_MISMATCH * report["frames"]
+        and (report["delta_mean"] is None or report["delta_mean"] <= MAX_MEAN_DELTA)
+        and (report["score_drift"] is None or report["score_drift"] <= MAX_SCORE_DRIFT)
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="姿态模型推理后端的导出与精度检查")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("export", "导出并缓存模型"), ("check", "与 PyTorch 基线对比精度")):
+        sub = subparsers.add_parser(name, help=help_text)
+        sub.add_argument("--weights", default=process.DEFAULT_MODEL_PATH)
+        sub.add_argument("--backend", choices=BACKENDS[1:], default="onnx")
+        sub.add_argument("--imgsz", type=int, default=EXPORT_IMGSZ)
+        sub.add_argument("--int8", action="store_true")
+        if name == "check":
+            sub.add_argument("--video", default=CALIBRATION_VIDEO)
+            sub.add_argument("--frames", type=int, default=None)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        print(export_model(args.weights, args.backend, args.imgsz, args.int8))
+    else:
+        model = load_model(args.weights, args.backend, args.imgsz, args.int8)
+        report = check_accuracy(model, YOLO(args.weights), args.video, args.frames)
+        report["backend"] = describe(args.backend, args.imgsz, args.int8)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        sys.exit(0 if report["passed"] else 1)
@@ -0,0 +1,828 @@
+"""
+性能基准脚本
+
+用法：
+    python benchmark.py batch --batch-sizes 1 2 4 8 16
+    python benchmark.py similarity --frames 10000
+    python benchmark.py parallel --workers 1 2 4
+    python benchmark.py adaptive --max-gaps 2 4 6 8
+    python benchmark.py realtime --frames 500 --model-mode stub
+    python benchmark.py suite --frames 300 --model-mode stub --output base.json
+    python benchmark.py compare base.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+from ultralytics import YOLO
+
+import backends
+import process
+
+DEFAULT_MODEL = os.path.join("models", "yolo11n-pose.pt")
+DEFAULT_VIDEO = os.path.join("movies", "1.mp4")
+DEFAULT_KEYPOINTS = os.path.join("keypoints", "aligned1.json")
+WEIGHTS = [0.2, 0.5, 0.5, 0.7, 0.7, 0.6, 0.6, 0.7, 0.7, 0.6, 0.6, 0, 0, 0, 0, 0, 0]
+ANALYSIS_FPS = 10.0  # 与 app.py 默认的对齐/评分帧率一致
+
+
+def bench_batch(model_path, video_path, batch_sizes, prefetch=32):
+    """
+    测试不同批大小下的姿态推理吞吐量
+
+    参考视频与“用户视频”使用同一文件，两路解码线程混合凑批，
+    并与逐帧推理（批大小1）的关键点逐一比较。
+
+    :param model_path: 模型权重路径
+    :param video_path: 测试视频路径
+    :param batch_sizes: 待测试的批大小列表
+    :param prefetch: 预取队列容量（帧）
+    :return: 每个批大小的结果字典列表
+    """
+    model = YOLO(model_path)
+    # 预热，避免首次调用的初始化开销计入结果
+    for _, _, _ in process.iter_pose_batches(model, {0: video_path}, batch_size=1):
+        break
+
+    baseline = None
+    rows = []
+    for batch_size in [1] + [b for b in batch_sizes if b != 1]:
+        keypoints = {0: [], 1: []}
+        start = time.perf_counter()
+        for source_id, _, result in process.iter_pose_batches(
+            model,
+            {0: video_path, 1: video_path},
+            batch_size=batch_size,
+            prefetch=prefetch,
+        ):
+            keypoints[source_id].append(process.normalize_keypoints(result))
+        elapsed = time.perf_counter() - start
+
+        kps = np.array(keypoints[0] + keypoints[1], dtype=float)
+        if baseline is None:
+            baseline = kps
+        same_nan = bool((np.isnan(kps) == np.isnan(baseline)).all())
+        diff = np.abs(kps - baseline)
+        max_delta = float(np.nanmax(diff)) if not np.isnan(diff).all() else 0.0
+
+        frames = len(kps)
+        row = {
+            "batch_size": batch_size,
+            "frames": frames,
+            "seconds": elapsed,
+            "fps": frames / elapsed,
+            "max_keypoint_delta": max_delta,
+            "nan_pattern_equal": same_nan,
+        }
+        rows.append(row)
+        print(
+            f"batch={batch_size:<3d} frames={frames:<5d} {row['fps']:8.2f} frames/s  "
+            f"max|Δkp|={max_delta:.2e}px  nan一致={same_nan}"
+        )
+    return rows
+
+
+def replay_keypoints(keypoints_path, frames, noise=5.0, nan_ratio=0.01, seed=0):
+    """
+    由真实关键点循环回放出指定长度的两段序列（第二段叠加噪声并随机置NaN）
+
+    :return: 两个 (frames, 17, 3) float32 数组
+    """
+    rng = np.random.default_rng(seed)
+    source = np.asarray(process.load_keypoints(keypoints_path), dtype=np.float32)
+    seq1 = source[np.arange(frames) % len(source)]
+    seq2 = seq1.copy()
+    seq2[..., :2] += rng.normal(0, noise, seq2[..., :2].shape).astype(np.float32)
+    seq2[rng.random(frames) < nan_ratio, :, :2] = np.nan
+    return seq1, seq2
+
+
+def _legacy_similarity(keypoints1, keypoints2, resolution, weights, max_distance_threshold=1250):
+    """逐帧循环的旧实现，作为正确性与速度的对照"""
+    max_distance = np.sqrt(resolution[0] ** 2 + resolution[1] ** 2)
+    similarity_scores = []
+    low_similarity_frames = []
+    for frame_idx, (frame1, frame2) in enumerate(zip(keypoints1, keypoints2)):
+        if any(np.isnan(kp).any() for kp in frame1) or any(
+            np.isnan(kp).any() for kp in frame2
+        ):
+            similarity_scores.append(0)
+            low_similarity_frames.append(frame_idx)
+            continue
+        distances = [
+            weights[i] * np.linalg.norm(np.array(kp1) - np.array(kp2))
+            for i, (kp1, kp2) in enumerate(zip(frame1, frame2))
+        ]
+        total_distance = sum(distances)
+        similarity = max(0, (1 - total_distance / (max_distance * sum(weights))) * 100)
+        similarity_scores.append(similarity)
+        if total_distance > max_distance_threshold:
+            low_similarity_frames.append(frame_idx)
+    return similarity_scores, low_similarity_frames
+
+
+def bench_similarity(keypoints_path, frames, repeat=5):
+    """
+    相似度计算微基准：逐帧循环 vs 向量化，并校验结果逐位一致
+
+    :param keypoints_path: 用于回放的关键点文件
+    :param frames: 序列长度
+    :param repeat: 向量化实现的重复次数（取最快一次）
+    """
+    seq1, seq2 = replay_keypoints(keypoints_path, frames)
+    resolution = (640, 360)
+    # 旧实现的输入是JSON解析出的float64
+    xy1 = seq1[..., :2].astype(np.float64)
+    xy2 = seq2[..., :2].astype(np.float64)
+
+    start = time.perf_counter()
+    legacy_scores, legacy_low = _legacy_similarity(xy1, xy2, resolution, WEIGHTS)
+    legacy_seconds = time.perf_counter() - start
+
+    vector_seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        scores, low = process.score_keypoint_sequences(seq1, seq2, resolution, WEIGHTS)
+        vector_seconds = min(vector_seconds, time.perf_counter() - start)
+
+    identical = scores.tolist() == legacy_scores and low.tolist() == legacy_low
+    print(f"frames={frames}")
+    print(f"逐帧循环: {legacy_seconds * 1000:10.2f} ms")
+    print(f"向量化  : {vector_seconds * 1000:10.2f} ms  ({legacy_seconds / vector_seconds:.0f}x)")
+    print(f"结果逐位一致: {identical}")
+    return {
+        "frames": frames,
+        "legacy_seconds": legacy_seconds,
+        "vectorized_seconds": vector_seconds,
+        "identical": identical,
+    }
+
+
+def bench_parallel(model_path, video_path, worker_counts, threads_per_worker=1,
+                   chunks_per_worker=2, batch_size=8):
+    """
+    多进程分段提取的扩展性：墙钟时间随进程数的变化
+
+    以单进程顺序提取（模型池实例、不限线程）为基准，校验拼接后的关键点
+    与基准一致。进程池启动和模型加载的耗时计入墙钟时间。
+
+    :param model_path: 模型权重路径
+    :param video_path: 测试视频路径
+    :param worker_counts: 待测试的进程数列表
+    :param threads_per_worker: 每个进程的计算线程数
+    :param chunks_per_worker: 每个进程平均分到的区间数
+    :param batch_size: 进程内每次推理的帧数
+    :return: 每个进程数的结果字典列表
+    """
+    model = process.MODEL_POOL.model(model_path)
+    process.MODEL_POOL.preload(model_path)
+
+    start = time.perf_counter()
+    baseline = []
+    selector = process.PersonSelector()
+    for _, _, result in process.iter_pose_batches(model, {0: video_path}, batch_size=batch_size):
+        baseline.append(process.extract_keypoints(result, selector))
+    baseline = np.stack(baseline)
+    sequential_seconds = time.perf_counter() - start
+    frames = len(baseline)
+    print(f"顺序提取   frames={frames:<5d} {sequential_seconds:8.2f} s  {frames / sequential_seconds:7.2f} frames/s")
+
+    rows = []
+    for workers in worker_counts:
+        start = time.perf_counter()
+        keypoints = process.extract_keypoints_parallel(
+            video_path,
+            model_path,
+            workers=workers,
+            threads_per_worker=threads_per_worker,
+            chunks_per_worker=chunks_per_worker,
+            batch_size=batch_size,
+        )
+        elapsed = time.perf_counter() - start
+
+        same_shape = keypoints.shape == baseline.shape
+        if same_shape:
+            same_nan = bool((np.isnan(keypoints) == np.isnan(baseline)).all())
+            diff = np.abs(keypoints - baseline)
+            max_delta = float(np.nanmax(diff)) if not np.isnan(diff).all() else 0.0
+        else:
+            same_nan, max_delta = False, float("nan")
+
+        row = {
+            "workers": workers,
+            "threads_per_worker": threads_per_worker,
+            "frames": len(keypoints),
+            "seconds": elapsed,
+            "fps": len(keypoints) / elapsed,
+            "speedup": sequential_seconds / elapsed,
+            "max_keypoint_delta": max_delta,
+            "nan_pattern_equal": same_nan,
+        }
+        rows.append(row)
+        print(
+            f"workers={workers:<3d} frames={row['frames']:<5d} {elapsed:8.2f} s  "
+            f"{row['fps']:7.2f} frames/s  x{row['speedup']:.2f}  "
+            f"max|Δkp|={max_delta:.2e}px  nan一致={same_nan}"
+        )
+    return rows
+
+
+def bench_adaptive(model_path, video_path, max_gaps, motion_threshold=process.KEYFRAME_MOTION,
+                   error_budget=process.KEYFRAME_ERROR_BUDGET):
+    """
+    自适应（关键帧）提取：推理帧数、耗时和插值误差随最大间隔的变化
+
+    以逐帧推理为基准，误差为两边都有效的关节的像素偏差（相对画面对角线），
+    以及换算到分析流程评分方式下的相似度（逐帧推理为100）。
+
+    :param model_path: 模型权重路径
+    :param video_path: 测试视频路径
+    :param max_gaps: 待测试的最大关键帧间隔列表
+    :return: 每个间隔的结果字典列表
+    """
+    model = process.MODEL_POOL.model(model_path)
+    process.MODEL_POOL.preload(model_path)
+    _, _, (width, height) = process.get_video_info(video_path)
+    diagonal = float(np.hypot(width, height))
+
+    start = time.perf_counter()
+    baseline, _ = process.extract_keypoints_adaptive(video_path, model, max_gap=1)
+    dense_seconds = time.perf_counter() - start
+    frames = len(baseline)
+    print(f"逐帧推理   frames={frames:<5d} {dense_seconds:8.2f} s")
+
+    rows = []
+    for max_gap in max_gaps:
+        start = time.perf_counter()
+        keypoints, inferred = process.extract_keypoints_adaptive(
+            video_path, model, max_gap=max_gap, motion_threshold=motion_threshold, error_budget=error_budget)
+        elapsed = time.perf_counter() - start
+
+        deltas = np.linalg.norm(keypoints[..., :2] - baseline[..., :2], axis=-1) / diagonal
+        deltas = deltas[np.isfinite(deltas)]
+        found = np.isfinite(baseline[..., :2]).any(axis=(1, 2)) & np.isfinite(keypoints[..., :2]).any(axis=(1, 2))
+        similarity = None
+        if found.any():
+            scores, _ = process.score_keypoint_sequences(
+                process.normalize_keypoint_sequence(baseline[found]),
+                process.normalize_keypoint_sequence(keypoints[found]),
+                (640, 360), WEIGHTS,
+            )
+            similarity = float(scores.mean())
+
+        row = {
+            "max_gap": max_gap,
+            "frames": frames,
+            "inferred": inferred,
+            "inference_ratio": inferred / frames,
+            "seconds": elapsed,
+            "speedup": dense_seconds / elapsed,
+            "delta_mean": float(deltas.mean()) if len(deltas) else None,
+            "delta_max": float(deltas.max()) if len(deltas) else None,
+            "similarity": similarity,
+        }
+        rows.append(row)
+        delta_text = f"{row['delta_mean']:.4f}/{row['delta_max']:.4f}" if len(deltas) else "-"
+        similarity_text = f"{similarity:.2f}" if similarity is not None else "-"
+        print(
+            f"max_gap={max_gap:<3d} 推理 {inferred:<5d}/{frames} ({row['inference_ratio']:.0%})  "
+            f"{elapsed:8.2f} s  x{row['speedup']:.2f}  Δkp(均值/最大)={delta_text}  相似度={similarity_text}"
+        )
+    return rows
+
+
+class _StubArray:
+    """模仿 torch 张量的 .cpu().numpy() 接口"""
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        return _StubArray(self.array[index])
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class _StubKeypoints:
+    def __init__(self, keypoints):
+        self.xy = _StubArray(keypoints[None, :, :2])
+        self.conf = _StubArray(keypoints[None, :, 2])
+
+
+class _StubResult:
+    def __init__(self, frame, keypoints):
+        self.orig_img = frame
+        self.keypoints = _StubKeypoints(keypoints)
+
+    def plot(self):
+        return process.draw_skeleton(self.orig_img.copy(), self.keypoints.xy.array[0])
+
+
+class StubPoseModel:
+    """
+    替代YOLO的桩模型：不做推理，按调用顺序回放真实关键点
+
+    关键点由归一化的标准关键点平移到画面中心得到，用于隔离推理以外的开销。
+    """
+
+    def __init__(self, keypoints_path=DEFAULT_KEYPOINTS):
+        source = np.asarray(process.load_keypoints(keypoints_path), dtype=np.float32)
+        self.source = np.nan_to_num(source[..., :2])
+        self.calls = 0
+
+    def __call__(self, frames, verbose=False, **kwargs):
+        if isinstance(frames, np.ndarray):
+            frames = [frames]
+        results = []
+        for frame in frames:
+            height, width = frame.shape[:2]
+            keypoints = np.ones((process.NUM_KEYPOINTS, 3), dtype=np.float32)
+            keypoints[:, :2] = self.source[self.calls % len(self.source)] + (width / 2, height / 3)
+            results.append(_StubResult(frame, keypoints))
+            self.calls += 1
+        return results
+
+
+class StubModelPool:
+    """与 process.ModelPool 接口相同的桩模型池"""
+
+    def __init__(self, keypoints_path=DEFAULT_KEYPOINTS):
+        self.stub = StubPoseModel(keypoints_path)
+
+    def model(self, weights=None):
+        return self.stub
+
+    def preload(self, weights=None):
+        pass
+
+
+def bench_realtime(frames=500, model_mode="stub", model_path=DEFAULT_MODEL, video_path=DEFAULT_VIDEO,
+                   keypoints_path=DEFAULT_KEYPOINTS, resolution=(640, 480), warmup=20):
+    """
+    实时单帧路径的逐帧延迟分布：旧接口 process_single_frame vs 复用的 PoseComparator
+
+    :param frames: 每个用例的调用次数
+    :param model_mode: "stub" 只测推理以外的开销；"real" 使用真实模型
+    :param resolution: 摄像头帧尺寸 (宽, 高)
+    :param warmup: 不计入统计的预热调用次数
+    :return: 每个用例的结果字典列表（延迟单位毫秒）
+    """
+    if model_mode == "stub":
+        model = StubPoseModel(keypoints_path)
+    else:
+        model = backends.load_model(model_path)
+    standard_kp = process.load_keypoints(keypoints_path, mmap=False)
+    source = [cv2.resize(frame, resolution) for frame in process.iter_video_frames(video_path)]
+    comparator = process.PoseComparator(standard_kp, WEIGHTS, resolution)
+    selector = process.PersonSelector()
+    tracker = process.RoiTracker()
+    current_kp = process.detect_single_pose(source[0], model)
+
+    cases = [
+        ("process_single_frame", lambda frame, idx: process.process_single_frame(
+            frame, standard_kp, model, idx, WEIGHTS, resolution)),
+        ("PoseComparator.process", lambda frame, idx: comparator.process(
+            frame, model, idx, selector)),
+        ("PoseComparator(in_place)", lambda frame, idx: comparator.process(
+            frame, model, idx, selector, in_place=True)),
+        ("PoseComparator(draw=False)", lambda frame, idx: comparator.process(
+            frame, model, idx, selector, draw=False)),
+        ("PoseComparator(roi)", lambda frame, idx: comparator.process(
+            frame, model, idx, draw=False, tracker=tracker)),
+        ("score_single_pose", lambda frame, idx: process.score_single_pose(
+            current_kp, standard_kp, idx, WEIGHTS, resolution)),
+        ("PoseComparator.score", lambda frame, idx: comparator.score(current_kp, idx)),
+    ]
+
+    rows = []
+    print(f"model={model_mode} frames={frames} resolution={resolution[0]}x{resolution[1]}")
+    for name, func in cases:
+        for idx in range(warmup):
+            func(source[idx % len(source)], idx)
+        latencies = np.empty(frames)
+        for idx in range(frames):
+            frame = source[idx % len(source)]
+            start = time.perf_counter()
+            func(frame, idx)
+            latencies[idx] = (time.perf_counter() - start) * 1000
+        row = {
+            "name": name,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "mean_ms": float(latencies.mean()),
+        }
+        rows.append(row)
+        print(f"{name:<28s} p50 {row['p50_ms']:8.3f} ms  p99 {row['p99_ms']:8.3f} ms  "
+              f"平均 {row['mean_ms']:8.3f} ms")
+    return rows
+
+
+def make_video_workload(video_path, frames, output_path, width=640):
+    """
+    由样例视频循环生成指定帧数的测试视频（按宽度等比缩放）
+
+    :return: 输出路径
+    """
+    _, fps, (src_width, src_height) = process.get_video_info(video_path)
+    height = int(round(src_height * width / src_width / 2)) * 2
+    source = [cv2.resize(frame, (width, height)) for frame in process.iter_video_frames(video_path)]
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        for idx in range(frames):
+            writer.write(source[idx % len(source)])
+    finally:
+        writer.release()
+    return output_path
+
+
+class _RssSampler:
+    """后台线程定时采样常驻内存，得到某段代码执行期间的峰值（仅Linux /proc 可用）"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self.baseline = self.peak = self.read()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def read(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, ValueError, IndexError):
+            import resource
+
+            # 退化为进程生命周期内的峰值（Linux为KB，macOS为字节）
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.read())
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.read())
+        return False
+
+
+def run_case(name, func, frames, repeat=1, track_allocations=True):
+    """
+    计时一个基准用例：取 repeat 次中最快的一次，另跑一次统计Python/NumPy分配峰值
+
+    :param func: 无参函数
+    :param frames: 用例处理的帧数，用于计算吞吐量
+    :return: 结果字典
+    """
+    seconds = float("inf")
+    with _RssSampler() as rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            seconds = min(seconds, time.perf_counter() - start)
+
+    alloc_peak = None
+    if track_allocations:
+        tracemalloc.start()
+        try:
+            func()
+            _, alloc_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    row = {
+        "name": name,
+        "frames": frames,
+        "seconds": seconds,
+        "fps": frames / seconds if seconds > 0 else None,
+        "peak_rss_mb": rss.peak / 1024 ** 2,
+        "rss_growth_mb": (rss.peak - rss.baseline) / 1024 ** 2,
+        "alloc_peak_mb": alloc_peak / 1024 ** 2 if alloc_peak is not None else None,
+    }
+    alloc_text = f"{row['alloc_peak_mb']:9.1f}" if alloc_peak is not None else "        -"
+    print(
+        f"{name:<34s} {seconds * 1000:10.1f} ms {row['fps'] or 0:10.1f} frames/s "
+        f"RSS峰值 {row['peak_rss_mb']:8.1f} MB (+{row['rss_growth_mb']:.1f})  分配峰值 {alloc_text} MB"
+    )
+    return row
+
+
+def _environment():
+    """记录运行环境，便于比较不同机器或版本的结果"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "commit": commit,
+    }
+
+
+def bench_suite(frames=300, model_mode="stub", model_path=DEFAULT_MODEL, video_path=DEFAULT_VIDEO,
+                keypoints_path=DEFAULT_KEYPOINTS, width=640, batch_size=8, repeat=1,
+                track_allocations=True, dtw_frames=None):
+    """
+    完整分析流水线的基准套件：逐个计时 process.py 的公开函数，再计时端到端流程
+
+    工作负载：由样例视频循环生成 frames 帧的测试视频；关键点由标准关键点
+    回放（叠加噪声）得到。model_mode 为 "stub" 时用桩模型替代推理。
+
+    :param frames: 工作负载长度（帧）
+    :param model_mode: "stub" 或 "real"
+    :param dtw_frames: DTW/评分用例的序列长度，默认与 frames 相同
+    :return: 可写入JSON的结果字典
+    """
+    dtw_frames = dtw_frames or frames
+    if model_mode == "stub":
+        pool = StubModelPool(keypoints_path)
+    else:
+        pool = process.MODEL_POOL
+        pool.preload(model_path)
+    model = pool.model(model_path)
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="pose-bench-") as tmp:
+        def tmp_path(name):
+            return os.path.join(tmp, name)
+
+        print(f"生成测试视频: {frames} 帧, 宽 {width}")
+        user_video = make_video_workload(video_path, frames, tmp_path("user.mp4"), width)
+        ref_video = make_video_workload(video_path, frames, tmp_path("ref.mp4"), width)
+        seq1, seq2 = replay_keypoints(keypoints_path, dtw_frames)
+        frame = next(process.iter_video_frames(user_video))
+
+        def case(name, func, case_frames):
+            rows.append(run_case(name, func, case_frames, repeat, track_allocations))
+
+        case("get_video_info", lambda: process.get_video_info(user_video), frames)
+        case("iter_video_frames", lambda: sum(1 for _ in process.iter_video_frames(user_video)), frames)
+
+        def extract():
+            return [
+                process.extract_keypoints(result)
+                for _, _, result in process.iter_pose_batches(model, {0: user_video}, batch_size=batch_size)
+            ]
+        case("iter_pose_batches+extract_keypoints", extract, frames)
+        raw = np.stack(extract())
+        case("normalize_keypoint_sequence", lambda: process.normalize_keypoint_sequence(raw), frames)
+        case("save_keypoints(.npy)", lambda: process.save_keypoints(tmp_path("kp.npy"), seq1), dtw_frames)
+        case("load_keypoints(.npy)", lambda: np.asarray(process.load_keypoints(tmp_path("kp.npy"))), dtw_frames)
+        case("save_keypoints(.json)", lambda: process.save_keypoints(tmp_path("kp.json"), seq1), dtw_frames)
+        case("load_keypoints(.json)", lambda: process.load_keypoints(tmp_path("kp.json")), dtw_frames)
+
+        for mode in process.DTW_MODES:
+            case(
+                f"dtw_align({mode})",
+                lambda mode=mode: process.dtw_align(seq1, seq2, mode=mode, radius=process.ALIGN_RADIUS),
+                2 * dtw_frames,
+            )
+        process.save_keypoints(tmp_path("kp1.npy"), seq1)
+        process.save_keypoints(tmp_path("kp2.npy"), seq2)
+        case(
+            "align_keypoints",
+            lambda: process.align_keypoints(
+                tmp_path("kp1.npy"), tmp_path("kp2.npy"), tmp_path("al1.npy"), tmp_path("al2.npy"),
+                mode=process.ALIGN_MODE, radius=process.ALIGN_RADIUS,
+            ),
+            2 * dtw_frames,
+        )
+        case(
+            "resample_keypoints(30->10)",
+            lambda: process.resample_keypoints(seq1, 30.0, 10.0),
+            dtw_frames,
+        )
+        case(
+            "score_keypoint_sequences",
+            lambda: process.score_keypoint_sequences(seq1, seq2, (640, 360), WEIGHTS),
+            dtw_frames,
+        )
+        case(
+            "calculate_similarity...",
+            lambda: process.calculate_similarity_and_low_similarity_frames(
+                tmp_path("kp1.npy"), tmp_path("kp2.npy"), (640, 360), WEIGHTS
+            ),
+            dtw_frames,
+        )
+
+        case(
+            "render_pose_video",
+            lambda: process.render_pose_video(user_video, raw, tmp_path("pose.mp4")),
+            frames,
+        )
+        path = np.arange(frames)
+        scores = np.full(frames, 80.0)
+        case(
+            "render_overlay_video",
+            lambda: process.render_overlay_video(
+                ref_video, user_video, raw, raw, path, path, scores, tmp_path("overlay.mp4")
+            ),
+            frames,
+        )
+        case("detect_single_pose", lambda: process.detect_single_pose(frame, model), 1)
+        case(
+            "compare_single_frame",
+            lambda: process.compare_single_frame(frame, seq1, model, 0, WEIGHTS, (640, 480)),
+            1,
+        )
+
+        def end_to_end():
+            raw1, raw2 = process.process_pose_videos(
+                ref_video, user_video, None, None, tmp_path("e1.npy"), tmp_path("e2.npy"),
+                batch_size=batch_size, cache=None, model_path=model_path, pool=pool,
+                analysis_fps=ANALYSIS_FPS,
+            )
+            path_i, path_j = process.align_keypoints(
+                tmp_path("e1.npy"), tmp_path("e2.npy"), tmp_path("e1.npy"), tmp_path("e2.npy"),
+                mode=process.ALIGN_MODE, radius=process.ALIGN_RADIUS,
+            )
+            similarity, _ = process.calculate_similarity_and_low_similarity_frames(
+                tmp_path("e1.npy"), tmp_path("e2.npy"), (640, 360), WEIGHTS
+            )
+            _, fps1, _ = process.get_video_info(ref_video)
+            _, fps2, _ = process.get_video_info(user_video)
+            frames_i, frames_j, frame_scores = process.expand_alignment(
+                path_i, path_j, similarity, process.common_analysis_fps(fps1, fps2, ANALYSIS_FPS),
+                fps1, fps2, len(raw1), len(raw2),
+            )
+            process.render_overlay_video(
+                ref_video, user_video, raw1, raw2, frames_i, frames_j, frame_scores, tmp_path("e.mp4")
+            )
+        case("process_pose_videos", lambda: process.process_pose_videos(
+            ref_video, user_video, None, None, tmp_path("p1.npy"), tmp_path("p2.npy"),
+            batch_size=batch_size, cache=None, model_path=model_path, pool=pool,
+        ), 2 * frames)
+        case("end_to_end(analyze)", end_to_end, 2 * frames)
+
+    return {
+        "config": {
+            "frames": frames,
+            "dtw_frames": dtw_frames,
+            "model_mode": model_mode,
+            "model": model_path if model_mode == "real" else None,
+            "backend": backends.describe(**backends.configured()) if model_mode == "real" else None,
+            "video": video_path,
+            "keypoints": keypoints_path,
+            "width": width,
+            "batch_size": batch_size,
+            "repeat": repeat,
+        },
+        "environment": _environment(),
+        "results": rows,
+    }
+
+
+def compare_results(baseline_path, current_path, threshold=0.10):
+    """
+    比较两次套件结果，耗时增加超过 threshold（比例）的用例记为回退
+
+    :return: 回退用例名列表
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {row["name"]: row for row in json.load(f)["results"]}
+    with open(current_path, encoding="utf-8") as f:
+        current = {row["name"]: row for row in json.load(f)["results"]}
+
+    regressions = []
+    for name, row in current.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<34s} (新增)")
+            continue
+        ratio = row["seconds"] / base["seconds"] if base["seconds"] else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  <-- 回退"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  (加速)"
+        print(
+            f"{name:<34s} {base['seconds'] * 1000:10.1f} ms -> {row['seconds'] * 1000:10.1f} ms "
+            f"x{ratio:5.2f}{flag}"
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="姿态分析流水线性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    batch_parser = subparsers.add_parser("batch", help="批量推理吞吐量 vs 批大小")
+    batch_parser.add_argument("--model", default=DEFAULT_MODEL)
+    batch_parser.add_argument("--video", default=DEFAULT_VIDEO)
+    batch_parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16]
+    )
+    batch_parser.add_argument("--prefetch", type=int, default=32)
+
+    similarity_parser = subparsers.add_parser("similarity", help="相似度计算微基准")
+    similarity_parser.add_argument("--keypoints", default=DEFAULT_KEYPOINTS)
+    similarity_parser.add_argument("--frames", type=int, default=10000)
+
+    parallel_parser = subparsers.add_parser("parallel", help="多进程分段提取 vs 进程数")
+    parallel_parser.add_argument("--model", default=DEFAULT_MODEL)
+    parallel_parser.add_argument("--video", default=DEFAULT_VIDEO)
+    parallel_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parallel_parser.add_argument("--threads-per-worker", type=int, default=1)
+    parallel_parser.add_argument("--chunks-per-worker", type=int, default=2)
+    parallel_parser.add_argument("--batch-size", type=int, default=8)
+
+    adaptive_parser = subparsers.add_parser("adaptive", help="关键帧提取的推理帧数与误差 vs 最大间隔")
+    adaptive_parser.add_argument("--model", default=DEFAULT_MODEL)
+    adaptive_parser.add_argument("--video", default=DEFAULT_VIDEO)
+    adaptive_parser.add_argument("--max-gaps", type=int, nargs="+", default=[2, 4, 6, 8, 12])
+    adaptive_parser.add_argument("--motion", type=float, default=process.KEYFRAME_MOTION)
+    adaptive_parser.add_argument("--error-budget", type=float, default=process.KEYFRAME_ERROR_BUDGET)
+
+    realtime_parser = subparsers.add_parser("realtime", help="实时单帧路径的 p50/p99 延迟")
+    realtime_parser.add_argument("--frames", type=int, default=500)
+    realtime_parser.add_argument("--model-mode", choices=["stub", "real"], default="stub")
+    realtime_parser.add_argument("--model", default=DEFAULT_MODEL)
+    realtime_parser.add_argument("--video", default=DEFAULT_VIDEO)
+    realtime_parser.add_argument("--keypoints", default=DEFAULT_KEYPOINTS)
+
+    suite_parser = subparsers.add_parser("suite", help="逐函数及端到端的完整基准套件")
+    suite_parser.add_argument("--frames", type=int, default=300, help="工作负载长度（帧）")
+    suite_parser.add_argument("--dtw-frames", type=int, default=None, help="DTW/评分用例的序列长度")
+    suite_parser.add_argument("--model-mode", choices=["stub", "real"], default="stub")
+    suite_parser.add_argument("--model", default=DEFAULT_MODEL)
+    suite_parser.add_argument("--video", default=DEFAULT_VIDEO)
+    suite_parser.add_argument("--keypoints", default=DEFAULT_KEYPOINTS)
+    suite_parser.add_argument("--width", type=int, default=640)
+    suite_parser.add_argument("--batch-size", type=int, default=8)
+    suite_parser.add_argument("--repeat", type=int, default=1)
+    suite_parser.add_argument("--no-alloc", action="store_true", help="不统计内存分配（省一次运行）")
+    suite_parser.add_argument("--output", help="结果JSON输出路径")
+
+    compare_parser = subparsers.add_parser("compare", help="比较两次 suite 结果")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.10)
+
+    args = parser.parse_args()
+    if args.command == "batch":
+        bench_batch(args.model, args.video, args.batch_sizes, args.prefetch)
+    elif args.command == "similarity":
+        bench_similarity(args.keypoints, args.frames)
+    elif args.command == "parallel":
+        bench_parallel(
+            args.model,
+            args.video,
+            args.workers,
+            args.threads_per_worker,
+            args.chunks_per_worker,
+            args.batch_size,
+        )
+    elif args.command == "adaptive":
+        bench_adaptive(args.model, args.video, args.max_gaps, args.motion, args.error_budget)
+    elif args.command == "realtime":
+        bench_realtime(args.frames, args.model_mode, args.model, args.video, args.keypoints)
+    elif args.command == "suite":
+        report = bench_suite(
+            frames=args.frames,
+            model_mode=args.model_mode,
+            model_path=args.model,
+            video_path=args.video,
+            keypoints_path=args.keypoints,
+            width=args.width,
+            batch_size=args.batch_size,
+            repeat=args.repeat,
+            track_allocations=not args.no_alloc,
+            dtw_frames=args.dtw_frames,
+        )
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"结果已保存: {args.output}")
+    elif args.command == "compare":
+        if compare_results(args.baseline, args.current, args.threshold):
+            sys.exit(1)
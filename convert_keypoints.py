@@ -0,0 +1,28 @@
+"""
+关键点文件格式转换
+
+用法：
+    python convert_keypoints.py                   # 把 keypoints/*.json 转换为 .npy
+    python convert_keypoints.py a.json b.json     # 转换指定文件
+    python convert_keypoints.py --to-json a.npy   # 导出为旧的JSON格式
+"""
+import argparse
+import glob
+import os
+
+import process
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="关键点 JSON <-> .npy 转换")
+    parser.add_argument("paths", nargs="*", help="待转换的文件，默认 keypoints/*.json")
+    parser.add_argument("--to-json", action="store_true", help="把 .npy/.npz 导出为 JSON")
+    args = parser.parse_args()
+
+    paths = args.paths or sorted(glob.glob(os.path.join("keypoints", "*.json")))
+    for path in paths:
+        if args.to_json:
+            output_path = os.path.splitext(path)[0] + ".json"
+            process.save_keypoints(output_path, process.load_keypoints(path))
+        else:
+            output_path = process.convert_keypoints_json(path)
+        print(f"{path} -> {output_path}")
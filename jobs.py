@@ -0,0 +1,159 @@
+"""
+后台分析任务队列
+
+/analyze 只负责提交任务并立即返回任务ID，真正的处理在有界线程池中执行，
+客户端通过 /jobs/<id> 轮询阶段、进度和预计剩余时间。
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """等待中的任务过多"""
+
+
+class Job:
+    """单个后台任务的状态"""
+
+    def __init__(self, key):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"  # queued / running / done / error
+        self.stage = None
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._stage_started = None
+        self._lock = threading.Lock()
+
+    def update_progress(self, stage, done=0, total=None):
+        """进度回调：由处理流程在每个阶段、每帧调用"""
+        with self._lock:
+            if stage != self.stage:
+                self.stage = stage
+                self._stage_started = time.time()
+            self.done = done
+            self.total = total
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def eta(self):
+        """按当前阶段的平均速度估算该阶段剩余秒数"""
+        with self._lock:
+            if not self.total or not self.done or self._stage_started is None:
+                return None
+            elapsed = time.time() - self._stage_started
+            return elapsed / self.done * (self.total - self.done)
+
+    def to_dict(self):
+        eta = self.eta()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "done": self.done,
+            "total": self.total,
+            "eta": round(eta, 1) if eta is not None else None,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    有界线程池 + 任务表
+
+    :param max_workers: 同时执行的任务数（即同时占用模型的任务数）
+    :param max_pending: 排队+执行中的任务上限，超过时拒绝新任务
+    :param ttl: 已结束任务的保留时间（秒）
+    """
+
+    def __init__(self, max_workers=1, max_pending=16, ttl=3600):
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analyze")
+        self._jobs = {}
+        self._active_by_key = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, func, *args, **kwargs):
+        """
+        提交任务；相同 key 的任务正在排队或执行时直接复用
+
+        func 以关键字参数 progress 接收进度回调，返回值作为任务结果。
+
+        :return: (任务, 是否新建)
+        """
+        with self._lock:
+            self._prune()
+            existing = self._active_by_key.get(key)
+            if existing is not None and existing.active:
+                return existing, False
+
+            pending = sum(1 for job in self._jobs.values() if job.active)
+            if pending >= self.max_pending:
+                raise QueueFullError("分析任务过多，请稍后再试")
+
+            job = Job(key)
+            self._jobs[job.id] = job
+            self._active_by_key[key] = job
+
+        self._executor.submit(self._run, job, func, args, kwargs)
+        return job, True
+
+    def get(self, job_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get(job_id)
+
+    def find_active(self, key):
+        """相同 key 正在排队或执行的任务，没有时为 None"""
+        with self._lock:
+            job = self._active_by_key.get(key)
+            return job if job is not None and job.active else None
+
+    def active_keys(self):
+        """正在排队或执行的任务的 key 列表"""
+        with self._lock:
+            return [key for key, job in self._active_by_key.items() if job.active]
+
+    def counts(self):
+        """各状态的任务数"""
+        with self._lock:
+            self._prune()
+            counts = {"queued": 0, "running": 0, "done": 0, "error": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def _run(self, job, func, args, kwargs):
+        job.status = "running"
+        try:
+            job.result = func(*args, progress=job.update_progress, **kwargs)
+            job.status = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.status = "error"
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                if self._active_by_key.get(job.key) is job:
+                    del self._active_by_key[job.key]
+
+    def _prune(self):
+        """清理超过保留时间的已结束任务（调用方持有锁）"""
+        now = time.time()
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished is not None and now - job.finished > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
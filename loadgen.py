@@ -0,0 +1,142 @@
+"""
+实时分析接口的负载生成器
+
+模拟 N 个同时进行实时分析的客户端：每个客户端各自持有一个会话，按目标帧率
+向 /process_frame_bin 发送JPEG帧；与浏览器端一致，上一帧的响应没回来之前不发
+下一帧（处理跟不上时实际帧率会低于目标帧率）。结束后统计吞吐量和延迟分布。
+
+用法（先启动 python app.py）：
+    python loadgen.py --clients 4 --fps 17 --duration 20
+    python loadgen.py --clients 1 2 4 8 --output load.json
+"""
+import argparse
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import cv2
+import numpy as np
+
+import process
+
+DEFAULT_URL = "http://127.0.0.1:5000"
+DEFAULT_VIDEO = "movies/1.mp4"
+
+
+def load_frames(video_path, resolution=(640, 480), limit=120, quality=80):
+    """把测试视频的前 limit 帧缩放到摄像头分辨率并编码为JPEG"""
+    frames = []
+    for frame in process.iter_video_frames(video_path, stop=limit):
+        ok, buffer = cv2.imencode(".jpg", cv2.resize(frame, resolution), [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if ok:
+            frames.append(buffer.tobytes())
+    if not frames:
+        raise ValueError(f"无法读取测试视频: {video_path}")
+    return frames
+
+
+def run_client(url, frames, fps, stop_at, offset, stats, timeout=30):
+    """单个客户端：按帧率发送直到 stop_at，记录每个请求的延迟（秒）和错误数"""
+    session_id = None
+    interval = 1.0 / fps
+    index = offset
+    next_send = time.monotonic()
+    while True:
+        now = time.monotonic()
+        if now >= stop_at:
+            break
+        if now < next_send:
+            time.sleep(min(next_send - now, stop_at - now))
+            continue
+        next_send = max(next_send + interval, now)
+
+        headers = {"Content-Type": "image/jpeg"}
+        if session_id:
+            headers["X-Session-Id"] = session_id
+        req = urllib.request.Request(
+            f"{url}/process_frame_bin", data=frames[index % len(frames)], headers=headers, method="POST")
+        index += 1
+        start = time.monotonic()
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                body = json.loads(response.read())
+            stats["latencies"].append(time.monotonic() - start)
+            session_id = body.get("session") or session_id
+        except (urllib.error.URLError, OSError, ValueError):
+            stats["errors"] += 1
+
+
+def run_load(url, clients, fps, duration, frames, warmup=2.0):
+    """
+    运行一轮负载
+
+    :param clients: 并发客户端数
+    :param fps: 每个客户端的目标帧率
+    :param duration: 统计时长（秒），之前另有 warmup 秒预热不计入
+    :return: 结果字典（延迟单位毫秒）
+    """
+    if warmup > 0:
+        run_client(url, frames, fps, time.monotonic() + warmup, 0, {"latencies": [], "errors": 0})
+
+    stats = [{"latencies": [], "errors": 0} for _ in range(clients)]
+    stop_at = time.monotonic() + duration
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(url, frames, fps, stop_at, i * len(frames) // clients, stats[i]),
+            daemon=True,
+        )
+        for i in range(clients)
+    ]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - start
+
+    latencies = np.array([x for s in stats for x in s["latencies"]]) * 1000
+    errors = sum(s["errors"] for s in stats)
+    row = {
+        "clients": clients,
+        "target_fps": fps,
+        "seconds": elapsed,
+        "responses": int(len(latencies)),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed,
+        "per_client_fps": len(latencies) / elapsed / clients,
+        "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+        "p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        "mean_ms": float(latencies.mean()) if len(latencies) else None,
+    }
+    if len(latencies):
+        print(
+            f"clients={clients:<3d} {row['throughput']:7.2f} 帧/s（每客户端 {row['per_client_fps']:5.2f}）  "
+            f"p50 {row['p50_ms']:8.1f} ms  p95 {row['p95_ms']:8.1f} ms  p99 {row['p99_ms']:8.1f} ms  "
+            f"错误 {errors}"
+        )
+    else:
+        print(f"clients={clients:<3d} 没有成功的请求，错误 {errors}")
+    return row
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="实时分析接口的负载生成器")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--fps", type=float, default=17.0, help="每个客户端的目标帧率")
+    parser.add_argument("--duration", type=float, default=20.0, help="每轮统计时长（秒）")
+    parser.add_argument("--warmup", type=float, default=2.0, help="每轮开始前的预热时长（秒）")
+    parser.add_argument("--video", default=DEFAULT_VIDEO)
+    parser.add_argument("--output", help="结果JSON输出路径")
+    args = parser.parse_args()
+
+    frames = load_frames(args.video)
+    rows = [run_load(args.url, clients, args.fps, args.duration, frames, args.warmup) for clients in args.clients]
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"url": args.url, "results": rows}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
@@ -0,0 +1,239 @@
+"""
+流水线性能指标
+
+按阶段（解码、推理、关键点后处理、DTW、评分、绘制、编码……）记录耗时
+直方图和帧计数，另有队列深度等瞬时值，可通过 /metrics 以 Prometheus 文本格式
+导出。单个任务还可以开启计时追踪，结束后导出为 JSON。
+
+未开启（环境变量 POSE_METRICS 不为 1）且当前线程没有追踪时，stage() 直接
+返回共享的空上下文，几乎没有额外开销。
+"""
+import bisect
+import contextlib
+import json
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("POSE_METRICS") == "1"
+
+# 耗时直方图的桶上界（秒）
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NULL = contextlib.nullcontext()
+_local = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    body = ",".join(f'{name}="{value}"' for name, value in items)
+    return "{" + body + "}"
+
+
+class Registry:
+    """进程内的计数器、瞬时值和直方图"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._help = {}
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        # 落在最后一个桶之外的值只计入 +Inf
+        slot = bisect.bisect_left(BUCKETS, value)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * (len(BUCKETS) + 1), 0, 0.0]
+            hist[0][slot] += 1
+            hist[1] += 1
+            hist[2] += value
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def render(self):
+        """导出 Prometheus 文本格式"""
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self._histograms.items()}
+
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for (name, key), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        for (name, key), (buckets, count, total) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS, buckets):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{name}_count{_format_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REGISTRY.describe("pose_stage_seconds", "各流水线阶段单次调用耗时")
+REGISTRY.describe("pose_stage_frames_total", "各流水线阶段处理的帧数")
+REGISTRY.describe("pose_prefetch_queue_depth", "解码预取队列中的帧数")
+REGISTRY.describe("pose_keypoint_cache_total", "关键点缓存查询次数")
+REGISTRY.describe("pose_analysis_jobs", "各状态的分析任务数")
+REGISTRY.describe("pose_realtime_sessions", "活动的实时分析会话数")
+REGISTRY.describe("pose_storage_evictions_total", "存储清理删除的条目数")
+REGISTRY.describe("pose_storage_bytes", "上传文件和任务目录的总大小")
+REGISTRY.describe("pose_adaptive_frames_total", "自适应提取中推理和插值的帧数")
+REGISTRY.describe("pose_roi_frames_total", "区域跟踪推理中区域推理、整帧检测和回退整帧的次数")
+REGISTRY.describe("pose_realtime_batches_total", "实时推理合并后的模型调用次数")
+REGISTRY.describe("pose_realtime_batched_frames_total", "实时推理合并调用中的帧数")
+
+
+class Trace:
+    """单个任务的计时追踪：按阶段累计耗时、调用次数和帧数"""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.wall_seconds = None
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, frames):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0, "frames": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += 1
+            entry["frames"] += frames
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._start
+
+    def to_dict(self):
+        with self._lock:
+            stages = {name: dict(entry) for name, entry in self.stages.items()}
+        return {
+            "name": self.name,
+            "started": self.started,
+            "wall_seconds": self.wall_seconds,
+            # 各阶段可能在不同线程中并行执行，累计耗时之和可以超过墙钟时间
+            "stages": stages,
+        }
+
+    def dump(self, path):
+        """把追踪写入 JSON 文件"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+def current_trace():
+    """当前线程绑定的追踪，没有时为 None"""
+    return getattr(_local, "trace", None)
+
+
+@contextlib.contextmanager
+def use_trace(trace):
+    """把追踪绑定到当前线程（用于把任务追踪传递给解码等辅助线程）"""
+    previous = current_trace()
+    _local.trace = trace
+    try:
+        yield trace
+    finally:
+        _local.trace = previous
+
+
+@contextlib.contextmanager
+def trace(name=None):
+    """开启一次任务追踪并绑定到当前线程，退出时记录墙钟时间"""
+    job_trace = Trace(name)
+    with use_trace(job_trace):
+        try:
+            yield job_trace
+        finally:
+            job_trace.finish()
+
+
+class _StageTimer:
+    __slots__ = ("stage", "frames", "trace", "start")
+
+    def __init__(self, stage, frames, job_trace):
+        self.stage = stage
+        self.frames = frames
+        self.trace = job_trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        if ENABLED:
+            REGISTRY.observe("pose_stage_seconds", seconds, stage=self.stage)
+            if self.frames:
+                REGISTRY.inc("pose_stage_frames_total", self.frames, stage=self.stage)
+        if self.trace is not None:
+            self.trace.add(self.stage, seconds, self.frames)
+        return False
+
+
+def stage(name, frames=0):
+    """
+    阶段计时上下文
+
+    :param name: 阶段名
+    :param frames: 本次调用处理的帧数
+    """
+    job_trace = getattr(_local, "trace", None)
+    if not ENABLED and job_trace is None:
+        return _NULL
+    return _StageTimer(name, frames, job_trace)
+
+
+def inc(name, value=1, **labels):
+    if ENABLED:
+        REGISTRY.inc(name, value, **labels)
+
+
+def set_gauge(name, value, **labels):
+    if ENABLED:
+        REGISTRY.set_gauge(name, value, **labels)
@@ -0,0 +1,139 @@
+"""
+MP4 快速启动（faststart）
+
+OpenCV 写出的 mp4 把索引（moov）放在文件末尾，浏览器必须下载完整个文件才能
+开始播放。faststart 把 moov 移到媒体数据（mdat）之前并修正其中的块偏移表
+（stco/co64），不重新编码；之后配合 HTTP Range 请求即可边下边播、任意拖动。
+"""
+import os
+import shutil
+import struct
+import threading
+
+# 块偏移表所在的容器层级：moov/trak/mdia/minf/stbl
+_CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+_COPY_CHUNK = 1024 * 1024
+
+
+def _read_boxes(f, start, end):
+    """
+    读取 [start, end) 范围内的同级 box
+
+    :return: [(类型, 起始偏移, 总大小, 头部大小)]
+    """
+    boxes = []
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError(f"MP4 box 结构损坏: {box_type!r} @ {offset}")
+        boxes.append((box_type, offset, size, header))
+        offset += size
+    return boxes
+
+
+def _patch_offsets(moov, shift, moved_from, moved_to):
+    """
+    原地修正 moov 数据中的 stco/co64 块偏移：位于 [moved_to, moved_from) 的数据
+    在 moov 前移后整体后移 shift 字节
+
+    :param moov: moov box 的 bytearray
+    """
+
+    def walk(start, end):
+        offset = start
+        while offset + 8 <= end:
+            size, box_type = struct.unpack_from(">I4s", moov, offset)
+            header = 8
+            if size == 1:
+                size = struct.unpack_from(">Q", moov, offset + 8)[0]
+                header = 16
+            elif size == 0:
+                size = end - offset
+            if size < header:
+                raise ValueError("MP4 moov 结构损坏")
+            body = offset + header
+            if box_type in _CONTAINERS:
+                walk(body, offset + size)
+            elif box_type in (b"stco", b"co64"):
+                # version/flags(4) + entry_count(4) + 偏移表
+                count = struct.unpack_from(">I", moov, body + 4)[0]
+                fmt = ">I" if box_type == b"stco" else ">Q"
+                width = struct.calcsize(fmt)
+                limit = 0xFFFFFFFF if box_type == b"stco" else 0xFFFFFFFFFFFFFFFF
+                for i in range(count):
+                    pos = body + 8 + i * width
+                    value = struct.unpack_from(fmt, moov, pos)[0]
+                    if moved_to <= value < moved_from:
+                        value += shift
+                        if value > limit:
+                            raise OverflowError("块偏移超出 stco 范围")
+                        struct.pack_into(fmt, moov, pos, value)
+            offset += size
+
+    walk(0, len(moov))
+
+
+def faststart(path):
+    """
+    原地把 moov 移到第一个 mdat 之前（先写临时文件再原子替换）
+
+    :param path: mp4 文件路径
+    :return: 是否做了改动；已是快速启动格式、没有 moov/mdat 或偏移无法修正时返回 False
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        boxes = _read_boxes(f, 0, file_size)
+        types = [box[0] for box in boxes]
+        if b"moov" not in types or b"mdat" not in types:
+            return False
+        moov_index = types.index(b"moov")
+        mdat_index = types.index(b"mdat")
+        if moov_index < mdat_index:
+            return False
+
+        _, moov_offset, moov_size, _ = boxes[moov_index]
+        insert_at = boxes[mdat_index][1]
+        f.seek(moov_offset)
+        moov = bytearray(f.read(moov_size))
+        try:
+            _patch_offsets(moov, moov_size, moov_offset, insert_at)
+        except OverflowError:
+            return False
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.faststart"
+        try:
+            with open(tmp_path, "wb") as out:
+                for index, (_, offset, size, _) in enumerate(boxes):
+                    if index == mdat_index:
+                        out.write(moov)
+                    if index == moov_index:
+                        continue
+                    f.seek(offset)
+                    remaining = size
+                    while remaining:
+                        chunk = f.read(min(_COPY_CHUNK, remaining))
+                        if not chunk:
+                            raise ValueError("MP4 文件被截断")
+                        out.write(chunk)
+                        remaining -= len(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    # 源文件关闭后再替换（Windows 不能替换打开中的文件）
+    try:
+        shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
@@ -1,11 +1,944 @@
 import cv2
+import contextlib
 import json
 import numpy as np
 from ultralytics import YOLO
+import hashlib
+import math
+import multiprocessing
 import os
-from fastdtw import fastdtw
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm import tqdm
 
+import metrics
+import mp4
+
+
+DEFAULT_MODEL_PATH = os.path.join("models", "yolo11n-pose.pt")
+
+
+class ModelPool:
+    """
+    进程内共享的模型池
+
+    每个权重文件按需加载并预热一次，之后在线程间复用。每个权重最多创建
+    size 个实例，借出的实例同一时刻只被一个线程使用；size 为1时相当于
+    所有线程对同一个模型加锁串行。
+
+    :param size: 每个权重文件的实例数上限
+    """
+
+    def __init__(self, size=1):
+        self.size = size
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._count = {}
+        self._stats = {}
+
+    def _load(self, weights):
+        """加载（按 POSE_BACKEND 选择推理后端）并预热一个模型实例，记录耗时"""
+        # backends 在模块级导入 process，这里延迟导入避免循环导入
+        import backends
+
+        start = time.perf_counter()
+        model = backends.load_model(weights)
+        loaded = time.perf_counter()
+        # 预热：首次推理会触发算子初始化和内存分配
+        model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+        warmed = time.perf_counter()
+
+        stats = {"load_seconds": loaded - start, "warmup_seconds": warmed - loaded}
+        with self._cond:
+            self._stats.setdefault(weights, []).append(stats)
+        print(
+            f"模型加载完成 {weights}: 加载 {stats['load_seconds']:.2f}s, "
+            f"预热 {stats['warmup_seconds']:.2f}s"
+        )
+        return model
+
+    @contextlib.contextmanager
+    def acquire(self, weights=DEFAULT_MODEL_PATH):
+        """借出一个模型实例，with 块结束时归还"""
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(weights, [])
+                if idle:
+                    model = idle.pop()
+                    break
+                if self._count.get(weights, 0) < self.size:
+                    # 占一个名额，在锁外加载
+                    self._count[weights] = self._count.get(weights, 0) + 1
+                    model = None
+                    break
+                self._cond.wait()
+
+        if model is None:
+            try:
+                model = self._load(weights)
+            except Exception:
+                with self._cond:
+                    self._count[weights] -= 1
+                    self._cond.notify()
+                raise
+
+        try:
+            yield model
+        finally:
+            with self._cond:
+                self._idle[weights].append(model)
+                self._cond.notify()
+
+    def model(self, weights=DEFAULT_MODEL_PATH):
+        """返回可直接调用的模型代理，每次调用时才借出实例"""
+        return PooledModel(self, weights)
+
+    def preload(self, weights=DEFAULT_MODEL_PATH):
+        """提前加载并预热一个实例"""
+        with self.acquire(weights):
+            pass
+
+    def stats(self):
+        """各权重文件的实例数及加载、预热耗时"""
+        with self._cond:
+            return {
+                weights: {"instances": self._count.get(weights, 0), "loads": list(loads)}
+                for weights, loads in self._stats.items()
+            }
+
+
+class PooledModel:
+    """模型池的调用代理：与 YOLO 实例用法相同，每次推理借出、用完即还"""
+
+    def __init__(self, pool, weights):
+        self.pool = pool
+        self.weights = weights
+
+    def __call__(self, *args, **kwargs):
+        with self.pool.acquire(self.weights) as model:
+            return model(*args, **kwargs)
+
+
+MODEL_POOL = ModelPool(size=int(os.environ.get("POSE_MODEL_INSTANCES", 1)))
+
+
+def get_video_info(vid_path):
+    """
+    获取视频基本信息
+
+    帧数优先读取容器元数据；元数据缺失时（如浏览器录制的视频）
+    退化为只 grab 不解码的快速扫描。
+
+    :param vid_path: 视频路径
+    :return: (总帧数, 帧率, (宽, 高))
+    """
+    cap = cv2.VideoCapture(vid_path)
+    if not cap.isOpened():
+        raise ValueError(f"无法打开视频 {vid_path}")
+
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if total <= 0:
+        # grab只做解复用，不解码像素数据
+        total = 0
+        while cap.grab():
+            total += 1
+    cap.release()
+    return total, fps, (width, height)
+
+
+def iter_video_frames(vid_path, start=0, stop=None):
+    """
+    按顺序逐帧解码视频，每帧只解码一次
+
+    :param vid_path: 视频路径
+    :param start: 起始帧序号（定位后开始解码）
+    :param stop: 结束帧序号（不含），None 表示到视频结尾
+    :return: 帧生成器
+    """
+    cap = cv2.VideoCapture(vid_path)
+    if not cap.isOpened():
+        raise ValueError(f"无法打开视频 {vid_path}")
+    try:
+        if start > 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        frame_idx = start
+        while stop is None or frame_idx < stop:
+            with metrics.stage("decode", frames=1):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+            frame_idx += 1
+    finally:
+        cap.release()
+
+
+ANALYSIS_WIDTH = 640
+ANALYSIS_MAX_FPS = 30.0
+
+
+def needs_transcode(vid_path, width=ANALYSIS_WIDTH, max_fps=ANALYSIS_MAX_FPS):
+    """视频是否需要转码：非mp4、宽度超过 width 或帧率超过 max_fps（含无效帧率）"""
+    if os.path.splitext(vid_path)[1].lower() != ".mp4":
+        return True
+    _, fps, (src_width, _) = get_video_info(vid_path)
+    return src_width > width or not 0 < fps <= max_fps
+
+
+def transcode_for_analysis(src_path, dst_path, width=ANALYSIS_WIDTH, max_fps=ANALYSIS_MAX_FPS,
+                           progress=None):
+    """
+    把上传的视频转为分析用的统一格式：等比缩放到 width 宽、帧率不超过 max_fps 的mp4
+
+    按帧时间戳抽帧，浏览器录制的可变帧率视频（元数据帧率常为无效值）也能得到
+    均匀的输出帧率；帧率本来就不超过 max_fps 的视频保持原帧率。输出先写入
+    临时文件再原子替换。
+
+    :param src_path: 源视频路径
+    :param dst_path: 输出路径（.mp4）
+    :param width: 输出宽度，源视频更窄时不放大
+    :param max_fps: 输出帧率上限
+    :param progress: 进度回调 progress(阶段, 已完成帧数, 总帧数)，可选
+    :return: {"frames": 输出帧数, "fps": 输出帧率, "size": (宽, 高)}
+    """
+    total, src_fps, (src_width, src_height) = get_video_info(src_path)
+    fps_valid = effective_fps(src_fps, None) is not None
+    out_fps = min(src_fps, max_fps) if fps_valid else max_fps
+    if src_width > width:
+        out_size = (width, int(round(src_height * width / src_width / 2)) * 2)
+    else:
+        out_size = (src_width - src_width % 2, src_height - src_height % 2)
+
+    tmp_path = f"{dst_path}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+    cap = cv2.VideoCapture(src_path)
+    if not cap.isOpened():
+        raise ValueError(f"无法打开视频 {src_path}")
+    writer = cv2.VideoWriter(tmp_path, cv2.VideoWriter_fourcc(*'mp4v'), out_fps, out_size)
+    written = 0
+    frame_idx = 0
+    next_time = 0.0
+    try:
+        while True:
+            with metrics.stage("decode", frames=1):
+                ret, frame = cap.read()
+            if not ret:
+                break
+            # 优先用容器时间戳，缺失时按源帧率推算
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if timestamp <= 0 and frame_idx > 0:
+                timestamp = frame_idx / (src_fps if fps_valid else max_fps)
+            frame_idx += 1
+            if timestamp + 1e-6 < next_time:
+                continue
+            next_time += 1.0 / out_fps
+            # 跳过的时间段较长时（如录制卡顿）不补帧
+            next_time = max(next_time, timestamp)
+
+            if (frame.shape[1], frame.shape[0]) != out_size:
+                with metrics.stage("resize", frames=1):
+                    frame = cv2.resize(frame, out_size, interpolation=cv2.INTER_AREA)
+            with metrics.stage("encode", frames=1):
+                writer.write(frame)
+            written += 1
+            if progress is not None:
+                progress("transcode", frame_idx, total or None)
+    except BaseException:
+        writer.release()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    finally:
+        cap.release()
+    writer.release()
+
+    if written == 0:
+        os.remove(tmp_path)
+        raise ValueError(f"视频中没有可读取的帧 {src_path}")
+    os.replace(tmp_path, dst_path)
+    return {"frames": written, "fps": out_fps, "size": out_size}
+
+
+NUM_KEYPOINTS = 17
+
+# COCO 17点骨骼连线
+SKELETON = [
+    (0, 1), (0, 2), (1, 3), (2, 4),        # 头部
+    (5, 6), (5, 7), (7, 9), (6, 8),        # 躯干和手臂
+    (8, 10), (11, 12), (5, 11), (6, 12),   # 髋部连接
+    (11, 13), (13, 15), (12, 14), (14, 16) # 腿部
+]
+
+
+# 置信度低于该值的关节视为缺失（坐标置为NaN），不参与对齐和评分
+KEYPOINT_MIN_CONF = 0.3
+
+# 与上一帧目标框的IoU低于该值时认为目标已丢失，改选画面中最大的人
+PERSON_MIN_IOU = 0.3
+
+
+def _box_iou(box, boxes):
+    """一个框与一组框的IoU，框格式为 (x1, y1, x2, y2)"""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-6)
+
+
+class PersonSelector:
+    """
+    在一段视频（或一个实时会话）的连续帧中持续选中同一个人
+
+    有跟踪ID时沿用上一帧的ID；否则选与上一帧目标框IoU最大的人；
+    首帧或目标丢失时选检测框面积最大的人。
+
+    :param min_iou: 认为是同一个人的最小IoU
+    """
+
+    def __init__(self, min_iou=PERSON_MIN_IOU):
+        self.min_iou = min_iou
+        self.box = None
+        self.track_id = None
+
+    def select(self, result):
+        """
+        :param result: YOLO单帧推理结果
+        :return: 选中的人在结果中的序号，未检测到人时为 None
+        """
+        if result.keypoints is None or result.keypoints.xy.shape[0] == 0:
+            return None
+        boxes = getattr(result, "boxes", None)
+        if boxes is None or len(boxes) == 0:
+            return 0
+        xyxy = boxes.xyxy.cpu().numpy()
+        ids = boxes.id.cpu().numpy() if getattr(boxes, "id", None) is not None else None
+        return self.select_boxes(xyxy, ids)
+
+    def select_boxes(self, xyxy, ids=None):
+        """
+        :param xyxy: (人数, 4) 检测框
+        :param ids: (人数,) 跟踪ID，没有跟踪时为 None
+        :return: 选中的人的序号
+        """
+        index = None
+        if ids is not None and self.track_id is not None:
+            matches = np.flatnonzero(ids == self.track_id)
+            if len(matches):
+                index = int(matches[0])
+        if index is None and self.box is not None:
+            iou = _box_iou(self.box, xyxy)
+            if iou.max() >= self.min_iou:
+                index = int(np.argmax(iou))
+        if index is None:
+            areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+            index = int(np.argmax(areas))
+
+        self.box = xyxy[index]
+        self.track_id = ids[index] if ids is not None else None
+        return index
+
+    def snapshot(self):
+        """当前的跨帧状态（上一帧的目标框和跟踪ID），可用 restore 恢复"""
+        return self.box, self.track_id
+
+    def restore(self, state):
+        self.box, self.track_id = state
+
+
+def extract_keypoints(result, selector=None, min_conf=KEYPOINT_MIN_CONF):
+    """
+    取单帧推理结果中目标人物的关键点（图像绝对坐标）
+
+    :param result: YOLO单帧推理结果
+    :param selector: 跨帧选人的 PersonSelector，为 None 时选检测框最大的人
+    :param min_conf: 置信度低于该值的关节坐标置为NaN（置信度保留）
+    :return: (17, 3) float32 数组，每行为 (x, y, 置信度)；未检测到人时坐标为NaN、置信度为0
+    """
+    frame_kps = np.zeros((NUM_KEYPOINTS, 3), dtype=np.float32)
+    index = (selector or PersonSelector()).select(result)
+    if index is None:
+        frame_kps[:, :2] = np.nan
+        return frame_kps
+
+    frame_kps[:, :2] = result.keypoints.xy[index].cpu().numpy()
+    if result.keypoints.conf is not None:
+        frame_kps[:, 2] = result.keypoints.conf[index].cpu().numpy()
+    else:
+        frame_kps[:, 2] = 1.0
+    # 未检出的关节模型输出 (0, 0)，置信度也很低
+    frame_kps[frame_kps[:, 2] < min_conf, :2] = np.nan
+    return frame_kps
+
+
+def frame_people(result):
+    """
+    单帧推理结果中所有人的关键点和检测框（numpy 数组，可跨进程传递）
+
+    :return: ((人数, 17, 3) 关键点+置信度, (人数, 4) 检测框，结果中没有检测框时为 None)
+    """
+    if result.keypoints is None or result.keypoints.xy.shape[0] == 0:
+        return np.zeros((0, NUM_KEYPOINTS, 3), dtype=np.float32), None
+    xy = result.keypoints.xy.cpu().numpy()
+    conf = result.keypoints.conf.cpu().numpy() if result.keypoints.conf is not None else np.ones(xy.shape[:2])
+    kps = np.concatenate([xy, conf[..., None]], axis=-1).astype(np.float32)
+    boxes = getattr(result, "boxes", None)
+    xyxy = boxes.xyxy.cpu().numpy() if boxes is not None and len(boxes) > 0 else None
+    return kps, xyxy
+
+
+def select_people(people, selector=None, min_conf=KEYPOINT_MIN_CONF):
+    """
+    按帧顺序从 frame_people 的结果中选人，与逐帧调用 extract_keypoints 的结果相同
+
+    :param people: 每帧 frame_people 的返回值
+    :param selector: 跨帧选人的 PersonSelector，默认新建
+    :return: (帧数, 17, 3) float32 关键点
+    """
+    selector = selector or PersonSelector()
+    keypoints = np.zeros((len(people), NUM_KEYPOINTS, 3), dtype=np.float32)
+    for i, (kps, xyxy) in enumerate(people):
+        if not len(kps):
+            keypoints[i, :, :2] = np.nan
+            continue
+        keypoints[i] = kps[selector.select_boxes(xyxy) if xyxy is not None else 0]
+    keypoints[keypoints[..., 2] < min_conf, :2] = np.nan
+    return keypoints
+
+
+def fill_missing_joints(keypoints):
+    """
+    按时间线性插值补全缺失（NaN）的关节坐标，用于对齐这类需要稠密输入的计算
+
+    序列首尾的缺失取最近的有效值；整段都缺失的关节补0。
+
+    :param keypoints: (帧数, 17, C) 关键点
+    :return: 新的 (帧数, 17, C) float32 数组
+    """
+    filled = np.array(keypoints, dtype=np.float32)
+    if not np.isnan(filled[..., :2]).any():
+        return filled
+    frames = np.arange(len(filled))
+    for joint in range(filled.shape[1]):
+        for axis in range(2):
+            values = filled[:, joint, axis]
+            valid = ~np.isnan(values)
+            if valid.all():
+                continue
+            if valid.any():
+                values[~valid] = np.interp(frames[~valid], frames[valid], values[valid])
+            else:
+                values[:] = 0
+    return filled
+
+
+def normalize_keypoint_sequence(keypoints):
+    """
+    把绝对坐标关键点序列按每帧的肩膀中点归一化
+
+    任一侧肩膀缺失的帧整帧为NaN。
+
+    :param keypoints: (帧数, 17, 3) 绝对坐标关键点
+    :return: 新的 (帧数, 17, 3) float32 数组，置信度不变
+    """
+    normalized = np.array(keypoints, dtype=np.float32)
+    mid = (normalized[:, 5, :2] + normalized[:, 6, :2]) / 2
+    normalized[..., :2] -= mid[:, None, :]
+    return normalized
+
+
+def resample_keypoints(keypoints, src_fps, dst_fps):
+    """
+    按时间把关键点序列重采样到 dst_fps（相邻两帧线性插值）
+
+    插值涉及缺失帧（NaN）时取时间上最近的一帧。dst_fps 与 src_fps 相同时
+    原样返回数值。
+
+    :param keypoints: (帧数, 17, C) 关键点
+    :param src_fps: 原帧率
+    :param dst_fps: 目标帧率
+    :return: (round(帧数 * dst_fps / src_fps), 17, C) float32 数组，至少1帧
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    n = len(keypoints)
+    if n == 0:
+        raise ValueError("关键点序列为空")
+    m = max(1, int(round(n * dst_fps / src_fps)))
+    # 目标帧对应的源帧位置（可为小数）
+    position = np.minimum(np.arange(m) * (src_fps / dst_fps), n - 1)
+    lo = np.floor(position).astype(np.int64)
+    hi = np.minimum(lo + 1, n - 1)
+    weight = (position - lo).astype(np.float32)[:, None, None]
+
+    resampled = keypoints[lo] * (1 - weight) + keypoints[hi] * weight
+    nearest = keypoints[np.where(weight[:, 0, 0] < 0.5, lo, hi)]
+    return np.where(np.isnan(resampled), nearest, resampled)
+
+
+def effective_fps(fps, default=30.0):
+    """元数据帧率无效（缺失或浏览器录制视频常见的异常值）时按 default 处理"""
+    return fps if 0 < fps <= 240 else default
+
+
+def common_analysis_fps(fps1, fps2, analysis_fps=None):
+    """
+    两个视频共同的分析帧率：指定 analysis_fps 时取它与两者中较低帧率的较小值
+    （不插值升帧），否则取较低的帧率
+    """
+    fps = min(effective_fps(fps1), effective_fps(fps2))
+    if analysis_fps:
+        fps = min(fps, analysis_fps)
+    return fps
+
+
+def normalize_keypoints(result):
+    """
+    取单帧推理结果中第一个人的关键点，并基于肩膀中点归一化
+
+    :param result: YOLO单帧推理结果
+    :return: (17, 3) float32 数组，每行为 (x, y, 置信度)；未检测到人时坐标为NaN、置信度为0
+    """
+    return normalize_keypoint_sequence(extract_keypoints(result)[None])[0]
+
+
+def save_keypoints(path, keypoints):
+    """
+    原子地保存关键点序列
+
+    按扩展名选择格式：.npy（默认，可内存映射）、.npz（压缩归档）、
+    .json（兼容旧格式的 [[x, y], ...] 嵌套列表，不含置信度）。
+    先写入同目录临时文件再 os.replace，读者不会看到写了一半的文件。
+
+    :param path: 输出路径
+    :param keypoints: (帧数, 17, 3) 或 (帧数, 17, 2) 数组
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float32)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        with open(tmp_path, "wb") as f:
+            if ext == ".json":
+                f.write(json.dumps(keypoints[..., :2].tolist()).encode("utf-8"))
+            elif ext == ".npz":
+                np.savez_compressed(f, keypoints=keypoints)
+            else:
+                np.save(f, np.ascontiguousarray(keypoints))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _keypoints_from_json(frames):
+    """
+    把旧JSON格式的嵌套列表转为 (帧数, 17, 3) 数组，有效坐标的置信度记为1
+
+    旧版提取把未检出的关节记为 (0, 0) 再减去肩膀中点，这些关节在归一化后
+    恰好落在该帧所有关节的左上角极值处（如 aligned1.json 中反复出现的
+    (-537.74, -1262.65)），按缺失处理。只有重复出现的极值才算：同一帧中有多个
+    关节在该点，或其他帧的极值也是完全相同的坐标；单独一个恰好在左上角的关节
+    （如画面左侧举起的手）保留。
+    """
+    keypoints = np.zeros((len(frames), NUM_KEYPOINTS, 3), dtype=np.float32)
+    for t, frame in enumerate(frames):
+        # 截断或填充到17个关键点，无效关键点补0
+        for i in range(NUM_KEYPOINTS):
+            kp = frame[i] if i < len(frame) else None
+            if isinstance(kp, list) and len(kp) >= 2:
+                keypoints[t, i, 0] = float(kp[0])
+                keypoints[t, i, 1] = float(kp[1])
+    xy = keypoints[..., :2]
+    corner = xy.min(axis=1, keepdims=True)
+    at_corner = (xy == corner).all(axis=-1) & (corner < 0).all(axis=-1)
+    repeated = at_corner.sum(axis=1) >= 2
+    frames_with_corner = np.flatnonzero(at_corner.any(axis=1))
+    _, inverse, counts = np.unique(
+        corner[frames_with_corner, 0], axis=0, return_inverse=True, return_counts=True)
+    repeated[frames_with_corner] |= counts[inverse.reshape(-1)] >= 2
+    xy[at_corner & repeated[:, None]] = np.nan
+    keypoints[..., 2] = np.isfinite(xy).all(axis=-1)
+    return keypoints
+
+
+def load_keypoints(path, mmap=True):
+    """
+    读取关键点序列
+
+    :param path: .npy / .npz / .json 文件路径
+    :param mmap: .npy 文件是否以只读内存映射方式打开
+    :return: (帧数, 17, 3) float32 数组
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        with open(path, "r") as f:
+            return _keypoints_from_json(json.load(f))
+    if ext == ".npz":
+        with np.load(path) as data:
+            return data["keypoints"]
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def convert_keypoints_json(json_path, output_path=None):
+    """
+    把旧的JSON关键点文件转换为 .npy
+
+    :param json_path: JSON文件路径
+    :param output_path: 输出路径，默认与JSON同名的 .npy
+    :return: 输出路径
+    """
+    if output_path is None:
+        output_path = os.path.splitext(json_path)[0] + ".npy"
+    save_keypoints(output_path, load_keypoints(json_path))
+    return output_path
+
+
+def _decode_into_queue(source_id, vid_path, frame_queue, stop_event, job_trace=None):
+    """解码线程：顺序解码视频放入有界预取队列，结束时放入 None 标记"""
+    with metrics.use_trace(job_trace):
+        _decode_frames(source_id, vid_path, frame_queue, stop_event)
+
+
+def _decode_frames(source_id, vid_path, frame_queue, stop_event):
+
+    def put(item):
+        # 队列满时阻塞，直到推理线程取走或整体停止
+        while not stop_event.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        for frame in iter_video_frames(vid_path):
+            if not put((source_id, frame)):
+                return
+    except Exception as e:  # 异常交给推理线程抛出
+        put((source_id, e))
+        return
+    put((source_id, None))
+
+
+def infer_pose_batch(model, frames):
+    """
+    一次调用对多帧做姿态估计
+
+    尺寸不同的帧分组推理，保证每帧的letterbox预处理与逐帧推理一致。
+
+    :param model: YOLO姿态模型
+    :param frames: BGR帧列表
+    :return: 与 frames 一一对应的推理结果列表
+    """
+    results = [None] * len(frames)
+    groups = {}
+    for idx, frame in enumerate(frames):
+        groups.setdefault(frame.shape, []).append(idx)
+    for indices in groups.values():
+        with metrics.stage("inference", frames=len(indices)):
+            batch_results = model([frames[i] for i in indices], verbose=False)
+        for i, result in zip(indices, batch_results):
+            results[i] = result
+    return results
+
+
+def iter_pose_batches(model, sources, batch_size=8, prefetch=32):
+    """
+    多个视频共享的批量推理流水线
+
+    每个视频一个解码线程，帧先进入有界预取队列；推理线程从队列中凑满
+    batch_size 帧（可来自任意视频）后一次送入模型。
+
+    :param model: YOLO姿态模型
+    :param sources: {视频标识: 视频路径}
+    :param batch_size: 每次模型调用的帧数
+    :param prefetch: 预取队列容量（帧）
+    :return: 生成器，按各视频内部帧序产出 (视频标识, 帧, 推理结果)
+    """
+    frame_queue = queue.Queue(maxsize=max(prefetch, batch_size))
+    stop_event = threading.Event()
+    threads = [
+        threading.Thread(
+            target=_decode_into_queue,
+            args=(source_id, vid_path, frame_queue, stop_event, metrics.current_trace()),
+            daemon=True,
+        )
+        for source_id, vid_path in sources.items()
+    ]
+    for t in threads:
+        t.start()
+
+    remaining = len(threads)
+    try:
+        while remaining:
+            batch = []
+            metrics.set_gauge("pose_prefetch_queue_depth", frame_queue.qsize())
+            # 等待凑批的时间长说明瓶颈在解码
+            with metrics.stage("prefetch_wait"):
+                while remaining and len(batch) < batch_size:
+                    source_id, item = frame_queue.get()
+                    if item is None:
+                        remaining -= 1
+                        continue
+                    if isinstance(item, Exception):
+                        raise item
+                    batch.append((source_id, item))
+            if not batch:
+                break
+
+            results = infer_pose_batch(model, [frame for _, frame in batch])
+            for (source_id, frame), result in zip(batch, results):
+                yield source_id, frame, result
+    finally:
+        stop_event.set()
+        for t in threads:
+            t.join()
+
+
+# 并行提取的工作进程内模型（每个进程一个，由初始化函数加载）
+_worker_model = None
+
+
+def _init_extract_worker(model_path, threads):
+    """进程池初始化：限制本进程的计算线程数并加载一个模型实例"""
+    global _worker_model
+    import backends
+    import torch
+
+    torch.set_num_threads(threads)
+    cv2.setNumThreads(1)
+    _worker_model = backends.load_model(model_path)
+
+
+def _extract_chunk(vid_path, start, stop, batch_size):
+    """
+    工作进程：定位到 [start, stop) 帧区间，批量推理并返回每帧所有人的检测结果
+
+    选人依赖上一帧的目标，由主进程按帧顺序跨区间进行（见 select_people）。
+
+    :return: (start, 每帧 frame_people 的返回值列表)
+    """
+    people = []
+    batch = []
+    for frame in iter_video_frames(vid_path, start, stop):
+        batch.append(frame)
+        if len(batch) == batch_size:
+            people.extend(frame_people(r) for r in infer_pose_batch(_worker_model, batch))
+            batch = []
+    if batch:
+        people.extend(frame_people(r) for r in infer_pose_batch(_worker_model, batch))
+    return start, people
+
+
+def split_frame_ranges(total, chunks):
+    """把 [0, total) 均分为至多 chunks 个连续区间，最后一个区间读到视频结尾"""
+    chunks = max(1, min(chunks, total))
+    size = math.ceil(total / chunks)
+    ranges = [(start, start + size) for start in range(0, total, size)]
+    ranges[-1] = (ranges[-1][0], None)
+    return ranges
+
+
+def extract_keypoints_parallel(
+    vid_path,
+    model_path=DEFAULT_MODEL_PATH,
+    workers=None,
+    threads_per_worker=1,
+    chunks_per_worker=2,
+    batch_size=8,
+    progress=None,
+):
+    """
+    多进程分段提取长视频的关键点
+
+    按帧序号把视频切成若干区间，各工作进程定位到区间起点独立解码和推理
+    （每个进程一个模型、计算线程数受限），主进程按区间顺序拼接检测结果后
+    用同一个选人器逐帧选人，区间边界处不会换人。
+
+    :param vid_path: 视频路径
+    :param model_path: 模型权重路径
+    :param workers: 进程数，默认 CPU核数 // threads_per_worker
+    :param threads_per_worker: 每个进程的计算线程数
+    :param chunks_per_worker: 每个进程平均分到的区间数，大于1时负载更均衡
+    :param batch_size: 进程内每次推理的帧数
+    :param progress: 进度回调 progress(阶段, 已完成帧数, 总帧数)，可选
+    :return: (帧数, 17, 3) 绝对坐标关键点
+    """
+    total, _, _ = get_video_info(vid_path)
+    if total <= 0:
+        raise ValueError(f"视频中没有可读取的帧 {vid_path}")
+    if workers is None:
+        workers = max(1, (os.cpu_count() or 1) // threads_per_worker)
+    ranges = split_frame_ranges(total, workers * chunks_per_worker)
+
+    # spawn 启动，避免 fork 继承父进程中 torch/OpenCV 的线程状态
+    context = multiprocessing.get_context("spawn")
+    parts = {}
+    done = 0
+    with metrics.stage("extract_parallel", frames=total), ProcessPoolExecutor(
+        max_workers=min(workers, len(ranges)),
+        mp_context=context,
+        initializer=_init_extract_worker,
+        initargs=(model_path, threads_per_worker),
+    ) as executor:
+        futures = [
+            executor.submit(_extract_chunk, vid_path, start, stop, batch_size)
+            for start, stop in ranges
+        ]
+        for future in as_completed(futures):
+            start, people = future.result()
+            parts[start] = people
+            done += len(people)
+            if progress is not None:
+                progress("extract", min(done, total), total)
+
+    keypoints = select_people([frame for start, _ in ranges for frame in parts[start]])
+    if not len(keypoints):
+        raise ValueError(f"视频中没有可读取的帧 {vid_path}")
+    return keypoints
+
+
+# 缓存关键点格式的版本号，修改 extract_keypoints 时需递增以使缓存失效
+# （版本2起缓存绝对坐标，不再缓存标注视频；版本3起跨帧选人并屏蔽低置信度关节）
+NORMALIZATION_VERSION = 3
+
+KEYPOINT_CACHE_DIR = os.path.join("cache", "keypoints")
+KEYPOINT_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+_digest_memo = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """
+    计算文件内容的SHA-256（按路径、大小、修改时间在进程内缓存结果）
+
+    :param path: 文件路径
+    :return: 十六进制摘要
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if memo_key in _digest_memo:
+            return _digest_memo[memo_key]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _digest_lock:
+        _digest_memo[memo_key] = value
+    return value
+
+
+class KeypointCache:
+    """
+    按内容寻址的关键点磁盘缓存
+
+    缓存键由视频内容哈希、模型权重哈希和缓存格式版本共同决定，任一变化都不会
+    命中旧结果。每个条目保存原生长度的绝对坐标关键点序列，按最近使用时间
+    （文件mtime）做LRU淘汰，总大小不超过 max_bytes。
+    """
+
+    def __init__(self, cache_dir=KEYPOINT_CACHE_DIR, max_bytes=KEYPOINT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def key(self, video_path, model_path, variant=None):
+        """
+        根据视频、模型权重、推理后端和缓存格式版本生成缓存键
+
+        :param variant: 提取方式的标识（如自适应提取的参数），逐帧推理时为 None
+        """
+        if os.path.exists(model_path):
+            model_id = file_digest(model_path)
+        else:
+            model_id = os.path.basename(model_path)
+        # 导出/量化后的模型结果与 PyTorch 略有差异，分开缓存；torch 后端保持原有键
+        import backends
+
+        config = backends.configured()
+        if config["backend"] != "torch":
+            model_id += ":" + backends.describe(**config)
+        if variant:
+            model_id += ":" + variant
+        raw = f"{file_digest(video_path)}:{model_id}:{NORMALIZATION_VERSION}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".npy")
+
+    def get(self, key):
+        """
+        读取缓存条目
+
+        :return: 关键点数组，未命中返回 None
+        """
+        kps_path = self._path(key)
+        if not os.path.exists(kps_path):
+            return None
+        try:
+            keypoints = load_keypoints(kps_path)
+        except (OSError, ValueError):
+            return None
+        # 更新mtime作为最近使用时间
+        try:
+            os.utime(kps_path)
+        except OSError:
+            pass
+        return keypoints
+
+    def put(self, key, keypoints):
+        """写入缓存条目（原子替换），然后按大小淘汰"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        save_keypoints(self._path(key), keypoints)
+        self.evict()
+
+    def evict(self):
+        """按最近使用时间淘汰最旧的条目，直到总大小不超过上限"""
+        with self._lock:
+            entries = {}
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                key = os.path.splitext(name)[0]
+                size, mtime, paths = entries.get(key, (0, 0, []))
+                entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime), paths + [path])
+
+            total = sum(size for size, _, _ in entries.values())
+            for key, (size, _, paths) in sorted(entries.items(), key=lambda e: e[1][1]):
+                if total <= self.max_bytes:
+                    break
+                for path in paths:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+
+
+KEYPOINT_CACHE = KeypointCache()
+
 
 def process_pose_videos(
     video1_path: str,
@@ -14,184 +947,771 @@ def process_pose_videos(
     output_vid2_path: str,
     keypoints1_path: str,
     keypoints2_path: str,
+    batch_size: int = 8,
+    prefetch: int = 32,
+    cache: KeypointCache = KEYPOINT_CACHE,
+    progress=None,
+    model_path: str = DEFAULT_MODEL_PATH,
+    pool: ModelPool = MODEL_POOL,
+    workers: int = 1,
+    analysis_fps: float = None,
+    adaptive: bool = False,
+    roi: bool = False,
 ):
     """
     处理双视频的骨骼关键点提取与对齐
 
     :param video1_path: 第一个输入视频路径
     :param video2_path: 第二个输入视频路径
-    :param output_vid1_path: 第一个处理视频输出路径
-    :param output_vid2_path: 第二个处理视频输出路径
+    :param output_vid1_path: 第一个标注视频输出路径，为 None 时不生成
+    :param output_vid2_path: 第二个标注视频输出路径，为 None 时不生成
     :param keypoints1_path: 第一个视频关键点保存路径
     :param keypoints2_path: 第二个视频关键点保存路径
+    :param batch_size: 批量推理的帧数，1 即逐帧推理
+    :param prefetch: 解码预取队列容量（帧）
+    :param cache: 关键点缓存，为 None 时不使用缓存
+    :param progress: 进度回调 progress(阶段, 已完成帧数, 总帧数)，可选
+    :param model_path: 模型权重路径
+    :param pool: 模型池
+    :param workers: 大于1时用多进程分段提取（见 extract_keypoints_parallel），不使用模型池
+    :param analysis_fps: 保存的关键点序列的帧率上限，None 时两段都重采样到较低的原帧率
+        （见 common_analysis_fps）；对齐和评分都在该帧率上进行
+    :param adaptive: 为 True 时只在关键帧上推理、其余帧插值（见 extract_keypoints_adaptive，
+        参数取 KEYFRAME_* 默认值），优先于 workers 和 batch_size
+    :param roi: 为 True 时只在跟踪的人物区域上推理（见 RoiTracker，参数取 ROI_* 默认值），
+        逐帧顺序执行，可与 adaptive 同时使用，优先于 workers 和 batch_size
+    :return: 两个视频原生长度的绝对坐标关键点 (帧数, 17, 3)，供 render_overlay_video 绘制
     """
-    # 初始化YOLO模型
-    model = YOLO(r"models\yolo11n-pose.pt")
 
-    def get_video_info(vid_path):
-        """获取视频基本信息"""
-        cap = cv2.VideoCapture(vid_path)
-        if not cap.isOpened():
-            raise ValueError(f"无法打开视频 {vid_path}")
+    # 获取视频参数（仅读取元数据，不解码）
+    videos = []
+    for input_path, output_path, kps_path in (
+        (video1_path, output_vid1_path, keypoints1_path),
+        (video2_path, output_vid2_path, keypoints2_path),
+    ):
+        total, fps, size = get_video_info(input_path)
+        videos.append({
+            "input": input_path,
+            "output": output_path,
+            "kps": kps_path,
+            "total": total,
+            "fps": fps,
+            "size": size,
+            "keypoints": None,
+            "cache_key": None,
+        })
+
+    # 查询关键点缓存，命中的视频无需推理
+    pending = {}
+    for idx, video in enumerate(videos):
+        # 创建输出目录
+        if video["output"] is not None:
+            os.makedirs(os.path.dirname(video["output"]), exist_ok=True)
+        os.makedirs(os.path.dirname(video["kps"]), exist_ok=True)
+
+        if cache is not None:
+            video["cache_key"] = cache.key(video["input"], model_path, extraction_variant(adaptive, roi))
+            cached = cache.get(video["cache_key"])
+            metrics.inc("pose_keypoint_cache_total", result="hit" if cached is not None else "miss")
+            if cached is not None:
+                print(f"命中关键点缓存，跳过推理: {video['input']}")
+                video["keypoints"] = cached
+                if video["output"] is not None:
+                    render_pose_video(video["input"], cached, video["output"])
+                continue
+        pending[idx] = video
+
+    if adaptive or roi:
+        _extract_pending_sequential(pending, model_path, pool, progress, adaptive, roi)
+    elif workers > 1:
+        _extract_pending_parallel(pending, model_path, workers, batch_size, progress)
+    else:
+        _extract_pending_batched(pending, model_path, pool, batch_size, prefetch, progress)
 
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    for video in pending.values():
+        if cache is not None:
+            cache.put(video["cache_key"], video["keypoints"])
 
-        # 准确计算总帧数
-        total = 0
-        while cap.isOpened():
-            ret, _ = cap.read()
-            if not ret:
-                break
-            total += 1
-        cap.release()
-        return total, fps, (width, height)
-
-    # 获取视频参数
-    frames1, fps1, (w1, h1) = get_video_info(video1_path)
-    frames2, fps2, (w2, h2) = get_video_info(video2_path)
-    target_frames = max(frames1, frames2)
-
-    # 处理单个视频的闭包函数
-    def process_video(input_path, output_path, kps_path, fps, size):
-        """处理单个视频的通用流程"""
-        # 检查输出文件是否已存在
-        if os.path.exists(output_path) and os.path.exists(kps_path):
-            print(f"输出文件已存在，跳过处理: {output_path} 和 {kps_path}")
-            return
-        # 创建输出目录
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        os.makedirs(os.path.dirname(kps_path), exist_ok=True)
-
-        # 初始化视频读写器
-        cap = cv2.VideoCapture(input_path)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, size)
-
-        keypoints = []
-        frame_count = 0
-
-        # 使用tqdm显示进度条
-        with tqdm(
-            total=target_frames, desc=f"Processing {os.path.basename(input_path)}"
-        ) as pbar:
-            while frame_count < target_frames:
-                ret, frame = cap.read()
-                if not ret:  # 视频循环
-                    cap.release()
-                    cap = cv2.VideoCapture(input_path)
+    # 两段序列放到同一时间基准上，不再循环补齐到相同长度（长度差异交给DTW）
+    target_fps = common_analysis_fps(videos[0]["fps"], videos[1]["fps"], analysis_fps)
+
+    for video in videos:
+        with metrics.stage("resample", frames=len(video["keypoints"])):
+            keypoints = normalize_keypoint_sequence(video["keypoints"])
+            keypoints = resample_keypoints(keypoints, effective_fps(video["fps"]), target_fps)
+
+        # 保存关键点
+        with metrics.stage("keypoint_io", frames=len(keypoints)):
+            save_keypoints(video["kps"], keypoints)
+
+    return videos[0]["keypoints"], videos[1]["keypoints"]
+
+
+def _extract_pending_parallel(pending, model_path, workers, batch_size, progress):
+    """逐个视频做多进程分段提取，标注视频由关键点重新绘制"""
+    frames_before = 0
+    frames_total = sum(video["total"] for video in pending.values())
+    for video in pending.values():
+        def video_progress(stage, done, total, offset=frames_before):
+            if progress is not None:
+                progress(stage, offset + done, frames_total)
+
+        print(f"多进程提取关键点（{workers} 个进程）: {video['input']}")
+        video["keypoints"] = extract_keypoints_parallel(
+            video["input"], model_path, workers=workers, batch_size=batch_size,
+            progress=video_progress,
+        )
+        frames_before += video["total"]
+        if video["output"] is not None:
+            render_pose_video(video["input"], video["keypoints"], video["output"])
+
+
+def _extract_pending_sequential(pending, model_path, pool, progress, adaptive, roi):
+    """逐个视频逐帧顺序提取（关键帧提取和/或区域跟踪推理），标注视频由关键点重新绘制"""
+    model = pool.model(model_path)
+    frames_before = 0
+    frames_total = sum(video["total"] for video in pending.values())
+    for video in pending.values():
+        def video_progress(stage, done, total, offset=frames_before):
+            if progress is not None:
+                progress(stage, offset + done, frames_total)
+
+        tracker = RoiTracker() if roi else None
+        video["keypoints"], inferred = extract_keypoints_adaptive(
+            video["input"], model, max_gap=KEYFRAME_MAX_GAP if adaptive else 1,
+            progress=video_progress, tracker=tracker,
+        )
+        message = f"顺序提取 {video['input']}: {len(video['keypoints'])} 帧中推理 {inferred} 帧"
+        if tracker is not None:
+            message += f"，区域推理 {tracker.stats['crop']} 次、整帧 {tracker.stats['full'] + tracker.stats['fallback']} 次"
+        print(message)
+        frames_before += video["total"]
+        if video["output"] is not None:
+            render_pose_video(video["input"], video["keypoints"], video["output"])
+
+
+def _extract_pending_batched(pending, model_path, pool, batch_size, prefetch, progress):
+    """单进程中两个视频混合批量推理，同时写出标注视频"""
+    # 每批推理时才从模型池借出实例，不会长时间独占模型
+    model = pool.model(model_path)
+
+    # 初始化视频写入器与进度条
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    writers = {}
+    pbars = {}
+    selectors = {idx: PersonSelector() for idx in pending}
+    for idx, video in pending.items():
+        if video["output"] is not None:
+            writers[idx] = cv2.VideoWriter(video["output"], fourcc, video["fps"], video["size"])
+        pbars[idx] = tqdm(
+            total=video["total"], desc=f"Processing {os.path.basename(video['input'])}"
+        )
+        video["keypoints"] = []
+
+    # 两个视频的帧混合批量推理，每帧只解码一次
+    frames_done = 0
+    frames_total = sum(video["total"] for video in pending.values())
+    try:
+        for idx, frame, result in iter_pose_batches(
+            model,
+            {idx: video["input"] for idx, video in pending.items()},
+            batch_size=batch_size,
+            prefetch=prefetch,
+        ):
+            if idx in writers:
+                with metrics.stage("annotate", frames=1):
+                    writers[idx].write(result.plot())  # 写入标注视频
+            with metrics.stage("postprocess", frames=1):
+                pending[idx]["keypoints"].append(extract_keypoints(result, selectors[idx]))
+            pbars[idx].update(1)
+            frames_done += 1
+            if progress is not None:
+                progress("extract", frames_done, frames_total)
+    finally:
+        for idx in pending:
+            if idx in writers:
+                writers[idx].release()
+            pbars[idx].close()
+
+    for video in pending.values():
+        if not video["keypoints"]:
+            raise ValueError(f"视频中没有可读取的帧 {video['input']}")
+        video["keypoints"] = np.stack(video["keypoints"])
+
+
+def extract_video_keypoints(
+    video_path: str,
+    batch_size: int = 8,
+    prefetch: int = 32,
+    cache: KeypointCache = KEYPOINT_CACHE,
+    progress=None,
+    model_path: str = DEFAULT_MODEL_PATH,
+    pool: ModelPool = MODEL_POOL,
+    workers: int = 1,
+    adaptive: bool = False,
+    roi: bool = False,
+):
+    """
+    提取单个视频的绝对坐标关键点（经过关键点缓存，与 process_pose_videos 共用缓存条目）
+
+    参数含义同 process_pose_videos。
+
+    :return: (帧数, 17, 3) 绝对坐标关键点
+    """
+    total, fps, size = get_video_info(video_path)
+    video = {"input": video_path, "output": None, "total": total, "fps": fps, "size": size}
+    if cache is not None:
+        key = cache.key(video_path, model_path, extraction_variant(adaptive, roi))
+        cached = cache.get(key)
+        metrics.inc("pose_keypoint_cache_total", result="hit" if cached is not None else "miss")
+        if cached is not None:
+            return cached
+
+    if adaptive or roi:
+        _extract_pending_sequential({0: video}, model_path, pool, progress, adaptive, roi)
+    elif workers > 1:
+        _extract_pending_parallel({0: video}, model_path, workers, batch_size, progress)
+    else:
+        _extract_pending_batched({0: video}, model_path, pool, batch_size, prefetch, progress)
+    if cache is not None:
+        cache.put(key, video["keypoints"])
+    return video["keypoints"]
+
+
+# 自适应提取（只在关键帧上推理）的默认参数
+KEYFRAME_MAX_GAP = 6            # 相邻关键帧最多相隔的帧数，1 即逐帧推理
+KEYFRAME_MOTION = 0.03          # 与上一关键帧的缩略图平均像素差（0~1）超过该值时立即取关键帧
+KEYFRAME_ERROR_BUDGET = 0.005   # 插值误差上限：探测帧上关节的平均偏差（相对画面对角线）
+_MOTION_THUMB_WIDTH = 64
+
+
+def extraction_variant(adaptive=False, roi=False):
+    """非逐帧整帧推理的提取方式及其参数的标识，用于区分关键点缓存条目；逐帧整帧推理时为 None"""
+    parts = []
+    if adaptive:
+        parts.append(f"adaptive:{KEYFRAME_MAX_GAP}:{KEYFRAME_MOTION}:{KEYFRAME_ERROR_BUDGET}")
+    if roi:
+        parts.append(f"roi:{ROI_IMGSZ}:{ROI_PADDING}:{ROI_MIN_JOINTS}:{ROI_MIN_CONF}")
+    return "|".join(parts) or None
+
+
+def _motion_thumbnail(frame):
+    """运动检测用的小尺寸灰度图"""
+    height, width = frame.shape[:2]
+    size = (_MOTION_THUMB_WIDTH, max(1, round(height * _MOTION_THUMB_WIDTH / width)))
+    return cv2.cvtColor(cv2.resize(frame, size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+
+def interpolate_keypoints(start_kp, end_kp, count):
+    """
+    在两个关键帧之间线性插值 count 帧（不含两端）
+
+    任一端缺失（NaN）的关节插值结果也是NaN。
+
+    :param start_kp: (17, 3) 起始关键帧
+    :param end_kp: (17, 3) 结束关键帧
+    :return: (count, 17, 3) float32 数组
+    """
+    t = (np.arange(1, count + 1, dtype=np.float32) / (count + 1))[:, None, None]
+    return (start_kp[None] * (1 - t) + end_kp[None] * t).astype(np.float32)
+
+
+def _interpolation_error(actual, predicted, diagonal):
+    """探测帧上插值结果的误差；有没有检测到人不一致时为无穷大"""
+    actual_valid = ~np.isnan(actual[:, 0])
+    predicted_valid = ~np.isnan(predicted[:, 0])
+    if actual_valid.any() != predicted_valid.any():
+        return np.inf
+    both = actual_valid & predicted_valid
+    if not actual_valid.any():
+        return 0.0
+    if not both.any():
+        return np.inf
+    distances = np.linalg.norm(actual[both, :2] - predicted[both, :2], axis=-1)
+    return float(distances.mean() / diagonal)
+
+
+def extract_keypoints_adaptive(
+    video_path,
+    model,
+    max_gap=KEYFRAME_MAX_GAP,
+    motion_threshold=KEYFRAME_MOTION,
+    error_budget=KEYFRAME_ERROR_BUDGET,
+    progress=None,
+    tracker=None,
+):
+    """
+    只在关键帧上推理，其余帧的关键点由相邻关键帧插值得到
+
+    逐帧解码并计算与上一关键帧的缩略图差异，差异超过 motion_threshold 或距
+    上一关键帧达到 max_gap 帧时把当前帧作为关键帧推理。两个关键帧之间跳过的
+    帧（至少两帧时）先推理中点做探测：中点的插值误差在 error_budget 内时其余帧
+    直接插值，否则在两半上继续二分探测，直到误差满足预算或逐帧推理为止。
+    视频最后一帧总是关键帧。
+
+    探测发生在后一个关键帧之后、且不按时间顺序，因此每次探测都从前一个关键帧
+    的选人/区域状态开始，探测结束后恢复后一个关键帧的状态，不会用“未来”的帧
+    更新跨帧状态。
+
+    跳过的帧要保留到下一个关键帧，内存中最多缓存 max_gap 帧。
+
+    :param video_path: 视频路径
+    :param model: YOLO姿态模型
+    :param max_gap: 相邻关键帧最多相隔的帧数
+    :param motion_threshold: 触发关键帧的缩略图平均像素差（0~1）
+    :param error_budget: 插值误差上限（关节平均偏差 / 画面对角线）
+    :param progress: 进度回调 progress(阶段, 已完成帧数, 总帧数)，可选
+    :param tracker: 给出时每次推理只在跟踪的人物区域上进行（见 RoiTracker）
+    :return: ((帧数, 17, 3) 绝对坐标关键点, 推理的帧数)
+    """
+    if max_gap < 1:
+        raise ValueError("max_gap 必须至少为1")
+    total, _, (width, height) = get_video_info(video_path)
+    diagonal = float(np.hypot(width, height))
+    selector = PersonSelector()
+    state = tracker if tracker is not None else selector
+    anchor = state.snapshot()  # 最近一个关键帧推理后的跨帧状态
+    keypoints = []
+    inferred = 0
+
+    def infer(frame):
+        nonlocal inferred
+        inferred += 1
+        if tracker is not None:
+            with metrics.stage("inference", frames=1):
+                frame_kp = tracker.detect(frame, model)
+            if frame_kp is None:
+                frame_kp = np.zeros((NUM_KEYPOINTS, 3), dtype=np.float32)
+                frame_kp[:, :2] = np.nan
+            return frame_kp
+        with metrics.stage("inference", frames=1):
+            result = model(frame, verbose=False)[0]
+        return extract_keypoints(result, selector)
+
+    def fill(frames, start_kp, end_kp):
+        """两个关键帧之间的帧：推理中点，插值误差超出预算时在两半上继续细分"""
+        count = len(frames)
+        if count == 0:
+            return []
+        mid = count // 2
+        state.restore(anchor)
+        mid_kp = infer(frames[mid])
+        if count == 1:
+            return [mid_kp]
+        predicted = interpolate_keypoints(start_kp, end_kp, count)[mid]
+        if _interpolation_error(mid_kp, predicted, diagonal) > error_budget:
+            return fill(frames[:mid], start_kp, mid_kp) + [mid_kp] + fill(frames[mid + 1:], mid_kp, end_kp)
+        return (
+            list(interpolate_keypoints(start_kp, mid_kp, mid))
+            + [mid_kp]
+            + list(interpolate_keypoints(mid_kp, end_kp, count - mid - 1))
+        )
+
+    def close_gap(skipped, end_kp):
+        # 只跳过一帧时探测与推理代价相同，直接插值（运动检测已判定变化很小）
+        if len(skipped) == 1:
+            return list(interpolate_keypoints(keypoints[-1], end_kp, 1))
+        end_state = state.snapshot()
+        try:
+            return fill(skipped, keypoints[-1], end_kp)
+        finally:
+            state.restore(end_state)
+
+    skipped = []
+    key_thumb = None
+    progress_bar = tqdm(total=total, desc=f"Processing {os.path.basename(video_path)} (adaptive)")
+    try:
+        for frame in iter_video_frames(video_path):
+            thumb = _motion_thumbnail(frame)
+            if key_thumb is not None and len(skipped) + 1 < max_gap:
+                motion = float(cv2.absdiff(thumb, key_thumb).mean()) / 255.0
+                if motion <= motion_threshold:
+                    skipped.append(frame)
                     continue
 
-                # 姿态估计
-                results = model(frame, verbose=False)
-                out.write(results[0].plot())  # 写入标注视频
+            frame_kp = infer(frame)
+            if skipped:
+                keypoints.extend(close_gap(skipped, frame_kp))
+            keypoints.append(frame_kp)
+            anchor = state.snapshot()
+            key_thumb, skipped = thumb, []
+            progress_bar.n = len(keypoints)
+            progress_bar.refresh()
+            if progress is not None:
+                progress("extract", len(keypoints), total)
+
+        if skipped:
+            # 最后一帧作为关键帧，其余照常补齐
+            frame_kp = infer(skipped.pop())
+            if skipped:
+                keypoints.extend(close_gap(skipped, frame_kp))
+            keypoints.append(frame_kp)
+            if progress is not None:
+                progress("extract", len(keypoints), total)
+    finally:
+        progress_bar.close()
 
-                # 关键点处理
-                if results[0].keypoints.xy.shape[1] > 0:
-                    kps = results[0].keypoints.xy[0].cpu().numpy()
-                    # 基于肩膀中点归一化
-                    mid = (kps[5] + kps[6]) / 2
-                    norm_kps = (kps - mid).tolist()
-                else:
-                    norm_kps = [[np.nan, np.nan]] * 17
+    if not keypoints:
+        raise ValueError(f"视频中没有可读取的帧 {video_path}")
+    metrics.inc("pose_adaptive_frames_total", inferred, kind="inferred")
+    metrics.inc("pose_adaptive_frames_total", len(keypoints) - inferred, kind="interpolated")
+    return np.stack(keypoints), inferred
 
-                keypoints.append(norm_kps)
-                frame_count += 1
-                pbar.update(1)
 
-                if frame_count >= target_frames:
-                    break
+DTW_MODES = ("exact", "band", "multiscale")
+DTW_DISTANCES = ("euclidean", "sqeuclidean", "weighted")
 
-        cap.release()
-        out.release()
+# 分析流程默认的对齐方式：多尺度近似，内存与序列长度和 radius 成正比；
+# exact 的内存与两段序列长度之积成正比，只用于基准对比
+ALIGN_MODE = "multiscale"
+ALIGN_RADIUS = 10
 
-        # 关键点补全（循环填充）
-        if len(keypoints) < target_frames:
-            keypoints = (keypoints * (target_frames // len(keypoints) + 1))[
-                :target_frames
-            ]
+# 回溯方向编码
+_DTW_DIAG, _DTW_UP, _DTW_LEFT, _DTW_START = 0, 1, 2, 3
 
-        # 保存关键点
-        with open(kps_path, "w") as f:
-            json.dump(
-                keypoints,
-                f,
-                default=lambda x: x.tolist() if isinstance(x, np.ndarray) else x,
-            )
+# 单个代价块的元素数上限（控制逐关节距离计算的临时内存）
+_DTW_BLOCK_ELEMENTS = 4 * 1024 * 1024
+
+
+def _dtw_features(keypoints):
+    """取坐标通道转为连续的 float32 数组，缺失的关节按时间插值补全"""
+    xy = fill_missing_joints(keypoints[..., :2])
+    return np.ascontiguousarray(xy)
+
+
+def _dtw_cost_block(block1, block2, distance, weights):
+    """
+    计算两组帧之间的代价矩阵
+
+    :param block1: (m, 17, 2) 帧
+    :param block2: (n, 17, 2) 帧
+    :return: (m, n) float64 代价
+    """
+    if distance == "weighted":
+        diff = block1[:, None].astype(np.float64) - block2[None]
+        joint = np.sqrt((diff * diff).sum(axis=-1))
+        return joint @ weights
+
+    # ||a-b||^2 = ||a||^2 + ||b||^2 - 2a·b，矩阵乘法一次算完整块
+    flat1 = block1.reshape(len(block1), -1).astype(np.float64)
+    flat2 = block2.reshape(len(block2), -1).astype(np.float64)
+    sq = (
+        (flat1 * flat1).sum(axis=1)[:, None]
+        + (flat2 * flat2).sum(axis=1)[None, :]
+        - 2.0 * (flat1 @ flat2.T)
+    )
+    np.maximum(sq, 0.0, out=sq)
+    if distance == "sqeuclidean":
+        return sq
+    return np.sqrt(sq)
+
+
+def _dtw_fix_windows(lo, hi, n2):
+    """修正每行的列窗口，保证存在从 (0, 0) 到 (n1-1, n2-1) 的连通路径"""
+    lo = np.clip(lo, 0, n2 - 1).astype(np.int64)
+    hi = np.clip(hi, 1, n2).astype(np.int64)
+    lo[0] = 0
+    hi[-1] = n2
+    lo = np.maximum.accumulate(lo)
+    hi = np.maximum.accumulate(np.maximum(hi, lo + 1))
+    # 第 i 行的起点必须能由上一行斜向或竖直到达
+    lo[1:] = np.minimum(lo[1:], hi[:-1])
+    return lo, hi
+
+
+def dtw_row_step(best, costs):
+    """
+    DTW单行递推 D[j] = c[j] + min(best[j], D[j-1])
+
+    展开后 D[j] = min_{k<=j}(best[k] + sum(c[k..j]))，用前缀和加前缀最小值
+    一次完成，避免逐元素的Python循环。
+
+    :param best: 每列来自上一行（斜向或竖直）的最小累计代价
+    :param costs: 本行每列的代价
+    :return: 本行累计代价
+    """
+    csum = np.cumsum(costs)
+    return csum + np.minimum.accumulate(best - (csum - costs))
+
+
+def _dtw_windowed(seq1, seq2, lo, hi, distance, weights):
+    """
+    在给定的逐行列窗口内做DTW动态规划
+
+    第 i 行只计算 [lo[i], hi[i]) 列；回溯方向按窗口紧凑存储，内存与窗口
+    总面积成正比。
+
+    :return: (总代价, 路径行索引, 路径列索引)
+    """
+    n1, n2 = len(seq1), len(seq2)
+    widths = hi - lo
+    offsets = np.zeros(n1 + 1, dtype=np.int64)
+    np.cumsum(widths, out=offsets[1:])
+    moves = np.empty(offsets[-1], dtype=np.uint8)
+
+    # 上一行的累计代价，多留一列哨兵方便取左上；只重置被写过的区间
+    prev = np.full(n2 + 1, np.inf)
+    prev[0] = 0.0  # 起点 (0, 0) 的“左上”
+    cur = np.full(n2 + 1, np.inf)
+    prev_span = (0, 1)
+    cur_span = (0, 0)
+
+    # 按块计算代价矩阵，每块覆盖若干行的列窗口并集；窗口单调右移，并集为
+    # [lo[i0], hi[i1-1])，按并集面积限制块的行数，斜向的窄窗口不会退化成整列
+    i0 = 0
+    while i0 < n1:
+        col_lo = lo[i0]
+        area = np.arange(1, n1 - i0 + 1) * (hi[i0:] - col_lo) * seq1[0].size
+        i1 = i0 + max(1, int(np.searchsorted(area, _DTW_BLOCK_ELEMENTS, side="right")))
+        col_hi = hi[i1 - 1]
+        costs = _dtw_cost_block(seq1[i0:i1], seq2[col_lo:col_hi], distance, weights)
+
+        for i in range(i0, i1):
+            a, b = lo[i], hi[i]
+            c = costs[i - i0, a - col_lo:b - col_lo]
+            up = prev[a + 1:b + 1]
+            diag = prev[a:b]
+            from_diag = diag <= up
+            best = np.where(from_diag, diag, up)
+
+            row = dtw_row_step(best, c)
+
+            move = np.where(from_diag, _DTW_DIAG, _DTW_UP).astype(np.uint8)
+            left = np.empty_like(row)
+            left[0] = np.inf
+            left[1:] = row[:-1]
+            move[left < best] = _DTW_LEFT
+            if i == 0 and a == 0:
+                move[0] = _DTW_START
+            moves[offsets[i]:offsets[i + 1]] = move
+
+            cur[cur_span[0]:cur_span[1]] = np.inf
+            cur[a + 1:b + 1] = row
+            prev, cur = cur, prev
+            prev_span, cur_span = (a + 1, b + 1), prev_span
+        i0 = i1
+
+    total_cost = float(prev[n2])
+    if not np.isfinite(total_cost):
+        raise ValueError("DTW窗口内不存在可行路径")
+
+    # 从终点回溯
+    path_i = []
+    path_j = []
+    i, j = n1 - 1, n2 - 1
+    while True:
+        path_i.append(i)
+        path_j.append(j)
+        move = moves[offsets[i] + j - lo[i]]
+        if move == _DTW_START:
+            break
+        if move == _DTW_DIAG:
+            i, j = i - 1, j - 1
+        elif move == _DTW_UP:
+            i -= 1
+        else:
+            j -= 1
+    return total_cost, np.array(path_i[::-1]), np.array(path_j[::-1])
+
+
+def _dtw_coarsen(seq):
+    """相邻两帧取平均，把序列长度减半"""
+    n = len(seq) // 2 * 2
+    coarse = (seq[:n:2] + seq[1:n:2]) * 0.5
+    if len(seq) % 2:
+        coarse = np.concatenate([coarse, seq[-1:]])
+    return coarse
+
+
+def _dtw_multiscale(seq1, seq2, radius, distance, weights):
+    """多尺度DTW：在粗粒度上求路径，投影到细粒度并按半径扩展成搜索窗口"""
+    n1, n2 = len(seq1), len(seq2)
+    min_size = radius + 2
+    if n1 <= min_size or n2 <= min_size:
+        lo = np.zeros(n1, dtype=np.int64)
+        hi = np.full(n1, n2, dtype=np.int64)
+        return _dtw_windowed(seq1, seq2, lo, hi, distance, weights)
+
+    _, coarse_i, coarse_j = _dtw_multiscale(
+        _dtw_coarsen(seq1), _dtw_coarsen(seq2), radius, distance, weights
+    )
+
+    # 粗路径上每个格子对应细粒度的 2x2 区域
+    lo = np.full(n1, n2, dtype=np.int64)
+    hi = np.zeros(n1, dtype=np.int64)
+    for di in (0, 1):
+        rows = np.minimum(coarse_i * 2 + di, n1 - 1)
+        np.minimum.at(lo, rows, coarse_j * 2)
+        np.maximum.at(hi, rows, coarse_j * 2 + 2)
+
+    # 行方向和列方向各扩展 radius
+    expanded_lo = lo.copy()
+    expanded_hi = hi.copy()
+    for shift in range(1, radius + 1):
+        expanded_lo[shift:] = np.minimum(expanded_lo[shift:], lo[:-shift])
+        expanded_lo[:-shift] = np.minimum(expanded_lo[:-shift], lo[shift:])
+        expanded_hi[shift:] = np.maximum(expanded_hi[shift:], hi[:-shift])
+        expanded_hi[:-shift] = np.maximum(expanded_hi[:-shift], hi[shift:])
+    lo, hi = _dtw_fix_windows(expanded_lo - radius, expanded_hi + radius, n2)
+    return _dtw_windowed(seq1, seq2, lo, hi, distance, weights)
+
+
+def dtw_align(keypoints1, keypoints2, mode="exact", band=None, radius=2,
+              distance="euclidean", weights=None):
+    """
+    对两段关键点序列做DTW对齐
 
-    # 处理两个视频
-    process_video(video1_path, output_vid1_path, keypoints1_path, fps1, (w1, h1))
-    process_video(video2_path, output_vid2_path, keypoints2_path, fps2, (w2, h2))
+    参数：
+        keypoints1 (ndarray): (帧数, 17, 2|3) 关键点，NaN 按0处理。
+        keypoints2 (ndarray): (帧数, 17, 2|3) 关键点。
+        mode (str): "exact" 完整DTW；"band" Sakoe-Chiba 带约束；
+            "multiscale" 多尺度近似（与 fastdtw 同思路）。
+        band (int): band 模式下的带宽半径（帧），默认取较长序列的10%。
+        radius (int): multiscale 模式下每层的搜索半径（帧）。
+        distance (str): "euclidean" 34维欧氏距离；"sqeuclidean" 平方欧氏距离；
+            "weighted" 逐关节欧氏距离按 weights 加权求和。
+        weights (list): weighted 距离的关节权重，长度为17。
+
+    返回：
+        float: 路径总代价。
+        ndarray: 路径在第一个序列上的帧索引。
+        ndarray: 路径在第二个序列上的帧索引。
+    """
+    if mode not in DTW_MODES:
+        raise ValueError(f"未知的DTW模式 {mode}，可选 {DTW_MODES}")
+    if distance not in DTW_DISTANCES:
+        raise ValueError(f"未知的距离 {distance}，可选 {DTW_DISTANCES}")
+    if distance == "weighted":
+        if weights is None:
+            raise ValueError("weighted 距离需要提供关节权重")
+        weights = np.asarray(weights, dtype=np.float64)
+
+    seq1 = _dtw_features(keypoints1)
+    seq2 = _dtw_features(keypoints2)
+    n1, n2 = len(seq1), len(seq2)
+    if n1 == 0 or n2 == 0:
+        raise ValueError("关键点序列为空")
+
+    if mode == "multiscale":
+        return _dtw_multiscale(seq1, seq2, radius, distance, weights)
+
+    if mode == "band":
+        if band is None:
+            band = max(1, int(0.1 * max(n1, n2)))
+        # 沿对角线（按长度比例）取中心，上下各扩展 band 列
+        centers = np.arange(n1) * ((n2 - 1) / max(n1 - 1, 1))
+        lo, hi = _dtw_fix_windows(
+            np.floor(centers - band), np.ceil(centers + band) + 1, n2
+        )
+    else:
+        lo = np.zeros(n1, dtype=np.int64)
+        hi = np.full(n1, n2, dtype=np.int64)
+    return _dtw_windowed(seq1, seq2, lo, hi, distance, weights)
 
 
-def align_keypoints(json_path1, json_path2, output_path1, output_path2):
+def align_keypoints(json_path1, json_path2, output_path1, output_path2,
+                    mode="exact", band=None, radius=2, distance="euclidean", weights=None):
     """
     对齐两个关键点序列并保存结果
 
     参数：
-    json_path1: 第一个视频的JSON文件路径
-    json_path2: 第二个视频的JSON文件路径
+    json_path1: 第一个视频的关键点文件路径（.npy/.npz/.json）
+    json_path2: 第二个视频的关键点文件路径（.npy/.npz/.json）
     output_path1: 对齐后的第一个序列输出路径
     output_path2: 对齐后的第二个序列输出路径
+    mode, band, radius, distance, weights: 见 dtw_align
+
+    返回：
+    (路径在第一个序列上的帧索引, 路径在第二个序列上的帧索引)
     """
 
-    # 加载JSON数据
-    with open(json_path1, "r") as f:
-        keypoints1 = json.load(f)
-    with open(json_path2, "r") as f:
-        keypoints2 = json.load(f)
-
-    # 填充关键点到每帧17个（确保每帧17个关键点）
-    def pad_frames(frames):
-        return [frame + [[0.0, 0.0]] * (17 - len(frame)) if len(frame) <17 else frame[:17] for frame in frames]
-
-    padded1 = pad_frames(keypoints1)
-    padded2 = pad_frames(keypoints2)
-
-    # 展平为34维向量序列，替换NaN为0
-    def flatten(frames):
-        flattened = []
-        for frame in frames:
-            # 替换NaN坐标并限制为17个关键点
-            processed = []
-            for kp in frame[:17]:  # 确保只取前17个关键点
-                if isinstance(kp, list) and len(kp) == 2:
-                    processed.append([
-                        kp[0] if not np.isnan(kp[0]) else 0.0,
-                        kp[1] if not np.isnan(kp[1]) else 0.0
-                    ])
-                else:
-                    processed.append([0.0, 0.0])  # 无效关键点处理
-            # 展平为34维向量
-            flattened.append(np.array([coord for kp in processed for coord in kp]))
-        return flattened
-
-    flat1 = flatten(padded1)
-    flat2 = flatten(padded2)
+    # 加载关键点（内存映射，不整体解析）
+    keypoints1 = load_keypoints(json_path1)
+    keypoints2 = load_keypoints(json_path2)
 
     # 执行DTW对齐
-    _, path = fastdtw(flat1, flat2, dist=2)
+    with metrics.stage("dtw", frames=len(keypoints1) + len(keypoints2)):
+        _, path_i, path_j = dtw_align(
+            keypoints1, keypoints2, mode=mode, band=band, radius=radius,
+            distance=distance, weights=weights,
+        )
+
+    # 按路径索引取出对齐后的序列并保存
+    with metrics.stage("keypoint_io", frames=2 * len(path_i)):
+        save_keypoints(output_path1, keypoints1[path_i])
+        save_keypoints(output_path2, keypoints2[path_j])
+    return path_i, path_j
+
+
+def score_keypoint_sequences(
+    keypoints1, keypoints2, resolution, weights, max_distance_threshold=1250, per_joint=False,
+    min_valid_weight=0.5,
+):
+    """
+    向量化计算两段关键点序列逐帧的相似度
+
+    任一序列中缺失（NaN）的关节不参与计算，相似度按有效关节的权重归一化；
+    有效关节的权重不足总权重的 min_valid_weight 时该帧判为0分。关节齐全时
+    结果与逐帧循环的实现逐位一致：关节距离按 np.linalg.norm 的点积方式计算，
+    加权距离按关节顺序依次累加。
+
+    参数：
+        keypoints1 (ndarray): (帧数, 17, 2) 或 (帧数, 17, 3) 关键点数组。
+        keypoints2 (ndarray): 与 keypoints1 帧数相同的关键点数组。
+        resolution (tuple): 视频分辨率 (宽度, 高度)。
+        weights (list): 每个关键点的权重，长度为17。
+        max_distance_threshold (float): 标记低相似度帧的加权距离阈值，默认1250
+            （按有效关节的权重折算到全部关节）。
+        per_joint (bool): 是否同时返回逐关节的加权距离。
+        min_valid_weight (float): 有效关节权重占总权重的最小比例。
+
+    返回：
+        ndarray: 每帧的相似度百分比，有效关节不足的帧为0。
+        ndarray: 低相似度帧的索引。
+        ndarray: per_joint 为真时额外返回 (帧数, 17) 加权距离，缺失的关节和无效帧为NaN。
+    """
+    kps1 = np.asarray(keypoints1[..., :2], dtype=np.float64)
+    kps2 = np.asarray(keypoints2[..., :2], dtype=np.float64)
+    if len(kps1) != len(kps2):
+        raise ValueError("两个关键点序列的帧数不一致")
+
+    # 计算视频分辨率的最大可能距离（对角线）
+    max_distance = np.sqrt(resolution[0] ** 2 + resolution[1] ** 2)
+    weight_array = np.asarray(weights, dtype=np.float64)
 
-    # 重建对齐后的序列
-    aligned1 = [padded1[i] for i, _ in path]
-    aligned2 = [padded2[j] for _, j in path]
+    # 任一序列中缺失的关节跳过
+    valid = ~(np.isnan(kps1).any(axis=-1) | np.isnan(kps2).any(axis=-1))
 
-    # 保存结果时确保数据格式正确
-    def format_output(sequence):
-        """确保每帧包含17个关键点，每个关键点有2个坐标"""
-        formatted = []
-        for frame in sequence:
-            # 截断或填充到17个关键点
-            adjusted = frame[:17] + [[0.0, 0.0]] * (17 - len(frame[:17]))
-            formatted.append([[float(coord) for coord in kp] for kp in adjusted[:17]])
-        return formatted
+    # 逐关节欧氏距离：与 np.linalg.norm 对一维向量的点积实现一致
+    diff = kps1 - kps2
+    joint_distances = np.sqrt(np.matmul(diff[..., None, :], diff[..., :, None])[..., 0, 0])
+    weighted = np.where(valid, joint_distances * weight_array, 0.0)
 
-    # 保存对齐后的结果
-    with open(output_path1, "w") as f:
-        json.dump(format_output(aligned1), f)
-    with open(output_path2, "w") as f:
-        json.dump(format_output(aligned2), f)
+    # 按关节顺序累加，保持与 sum() 相同的求和顺序
+    total_distance = np.zeros(len(kps1))
+    valid_weight = np.zeros(len(kps1))
+    for i in range(weighted.shape[1]):
+        total_distance += weighted[:, i]
+        valid_weight += np.where(valid[:, i], weight_array[i], 0.0)
+
+    # 有效关节太少的帧无法可靠评分，直接判为低相似度
+    total_weight = sum(weights)
+    invalid_frames = valid_weight < min_valid_weight * total_weight
+    scale = np.divide(total_weight, valid_weight, out=np.zeros(len(kps1)), where=~invalid_frames)
+    total_distance *= scale
+
+    # 转换为相似度百分比
+    similarity = np.maximum(0, (1 - total_distance / (max_distance * total_weight)) * 100)
+    similarity[invalid_frames] = 0
+
+    # 检测低相似度帧
+    low_similarity_frames = np.flatnonzero(invalid_frames | (total_distance > max_distance_threshold))
+
+    if per_joint:
+        weighted[~valid] = np.nan
+        weighted[invalid_frames] = np.nan
+        return similarity, low_similarity_frames, weighted
+    return similarity, low_similarity_frames
 
 
 def calculate_similarity_and_low_similarity_frames(
@@ -201,8 +1721,8 @@ def calculate_similarity_and_low_similarity_frames(
     计算两个关键点序列之间的相似度，并标记低相似度帧。
 
     参数：
-        json_path1 (str): 第一个关键点 JSON 文件路径。
-        json_path2 (str): 第二个关键点 JSON 文件路径。
+        json_path1 (str): 第一个关键点文件路径（.npy/.npz/.json）。
+        json_path2 (str): 第二个关键点文件路径（.npy/.npz/.json）。
         resolution (tuple): 视频分辨率 (宽度, 高度)。
         weights (list): 每个关键点的权重，长度为17。
         max_distance_threshold (float): 标记低相似度帧的加权距离阈值，默认1250。
@@ -211,270 +1731,638 @@ def calculate_similarity_and_low_similarity_frames(
         list: 每帧的相似度百分比。
         list: 低相似度帧的索引。
     """
-    # 加载两个 JSON 文件
-    with open(json_path1, "r") as f1:
-        keypoints1 = json.load(f1)
-    with open(json_path2, "r") as f2:
-        keypoints2 = json.load(f2)
+    keypoints1 = load_keypoints(json_path1)
+    keypoints2 = load_keypoints(json_path2)
+    with metrics.stage("score", frames=len(keypoints1)):
+        similarity_scores, low_similarity_frames = score_keypoint_sequences(
+            keypoints1,
+            keypoints2,
+            resolution,
+            weights,
+            max_distance_threshold,
+        )
+    return similarity_scores.tolist(), low_similarity_frames.tolist()
 
-    # 检查帧数是否一致
-    if len(keypoints1) != len(keypoints2):
-        raise ValueError("两个关键点序列的帧数不一致")
 
-    # 计算视频分辨率的最大可能距离（对角线）
-    max_distance = np.sqrt(resolution[0] ** 2 + resolution[1] ** 2)
+def annotate_similarity(frame, similarity):
+    """在帧右上角原地标注相似度，按分数着色"""
+    if similarity >= 90:
+        color = (0, 255, 0)  # 绿色
+    elif similarity >= 75:
+        color = (0, 255, 255)  # 黄色
+    else:
+        color = (0, 0, 255)  # 红色
+
+    text = f"Similarity: {similarity:.2f}%"
+    cv2.putText(
+        frame,
+        text,
+        (frame.shape[1] - 300, 50),
+        cv2.FONT_HERSHEY_SIMPLEX,
+        1,
+        color,
+        2,
+    )
+    return frame
 
-    similarity_scores = []
-    low_similarity_frames = []
 
-    # 遍历每帧关键点
-    for frame_idx, (frame1, frame2) in enumerate(zip(keypoints1, keypoints2)):
-        # 跳过包含 NaN 值的帧
-        if any(np.isnan(kp).any() for kp in frame1) or any(
-            np.isnan(kp).any() for kp in frame2
-        ):
-            similarity_scores.append(0)
-            low_similarity_frames.append(frame_idx)
-            continue
+_SKELETON_ARRAY = np.array(SKELETON, dtype=np.int64)
 
-        # 计算两帧之间的加权欧氏距离
-        distances = [
-            weights[i] * np.linalg.norm(np.array(kp1) - np.array(kp2))
-            for i, (kp1, kp2) in enumerate(zip(frame1, frame2))
-        ]
-        total_distance = sum(distances)
 
-        # 转换为相似度百分比
-        similarity = max(0, (1 - total_distance / (max_distance * sum(weights))) * 100)
-        similarity_scores.append(similarity)
+def draw_skeleton(frame, keypoints, color=(0, 255, 0), scale=(1.0, 1.0), min_conf=0.5):
+    """
+    在帧上原地绘制骨骼
+
+    :param frame: BGR帧
+    :param keypoints: (17, 2|3) 绝对坐标关键点，NaN 或置信度低于 min_conf 的点不画
+    :param color: 骨骼颜色
+    :param scale: 坐标缩放 (x, y)，用于帧已缩放的情况
+    :param min_conf: 最低置信度
+    :return: frame
+    """
+    points = keypoints[:, :2] * np.asarray(scale, dtype=np.float32)
+    visible = np.isfinite(points).all(axis=1)
+    if keypoints.shape[1] > 2:
+        visible &= keypoints[:, 2] >= min_conf
+    points = np.nan_to_num(points).astype(np.int32)
+
+    # 所有可见的骨骼连线一次调用画完
+    edges = _SKELETON_ARRAY[visible[_SKELETON_ARRAY[:, 0]] & visible[_SKELETON_ARRAY[:, 1]]]
+    if len(edges):
+        cv2.polylines(frame, list(points[edges]), False, color, 2, cv2.LINE_AA)
+    for idx in np.flatnonzero(visible):
+        cv2.circle(frame, tuple(points[idx]), 4, color, -1, cv2.LINE_AA)
+    return frame
+
+
+class _FrameSeeker:
+    """
+    按帧序号读取视频帧，适用于序号基本单调递增的访问（如DTW路径）
 
-        # 检测低相似度帧
-        if total_distance > max_distance_threshold:
-            low_similarity_frames.append(frame_idx)
+    前进时只 grab 跳过中间帧，序号回退（循环补齐的序列）时重新打开视频。
+    """
 
-    return similarity_scores, low_similarity_frames
+    def __init__(self, vid_path):
+        self.vid_path = vid_path
+        self.cap = None
+        self.index = -1
+        self.frame = None
+
+    def _open(self):
+        if self.cap is not None:
+            self.cap.release()
+        self.cap = cv2.VideoCapture(self.vid_path)
+        if not self.cap.isOpened():
+            raise ValueError(f"无法打开视频 {self.vid_path}")
+        self.index = -1
+        self.frame = None
+
+    def read(self, index):
+        """返回第 index 帧（BGR），不可修改；读取失败抛出 ValueError"""
+        if self.cap is None or index < self.index:
+            self._open()
+        if index == self.index:
+            return self.frame
+        with metrics.stage("decode", frames=index - self.index):
+            while self.index < index - 1:
+                if not self.cap.grab():
+                    raise ValueError(f"视频帧数不足 {self.vid_path}: {index}")
+                self.index += 1
+            ok, frame = self.cap.read()
+        if not ok:
+            raise ValueError(f"视频帧数不足 {self.vid_path}: {index}")
+        self.index = index
+        self.frame = frame
+        return frame
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+
+def render_pose_video(video_path, keypoints, output_path, color=(0, 255, 0)):
+    """
+    用已有关键点在原视频上绘制骨骼并输出标注视频（无需推理）
+
+    :param video_path: 原视频路径
+    :param keypoints: (帧数, 17, 3) 绝对坐标关键点
+    :param output_path: 输出视频路径
+    :param color: 骨骼颜色
+    """
+    _, fps, size = get_video_info(video_path)
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    try:
+        for frame_idx, frame in enumerate(iter_video_frames(video_path)):
+            if frame_idx >= len(keypoints):
+                break
+            with metrics.stage("draw", frames=1):
+                draw_skeleton(frame, keypoints[frame_idx], color)
+            with metrics.stage("encode", frames=1):
+                out.write(frame)
+    finally:
+        out.release()
+    with metrics.stage("faststart"):
+        mp4.faststart(output_path)
+
+
+def expand_alignment(path_i, path_j, similarity_scores, analysis_fps, fps1, fps2,
+                     frames1=None, frames2=None):
+    """
+    把分析帧率上的DTW路径和逐步相似度映射回原帧率，供叠加视频逐帧渲染
 
+    输出帧率为 fps1：沿路径按时间均匀取点，两个序列上的位置在相邻路径步之间
+    线性插值后换算为各自原视频的帧序号，相似度取最近的路径步。
 
-def generate_overlay_video(
+    参数：
+        path_i, path_j (ndarray): 分析帧率上的DTW路径。
+        similarity_scores (list): 沿路径每一步的相似度。
+        analysis_fps (float): 路径所在的帧率。
+        fps1, fps2 (float): 两个原视频的帧率。
+        frames1, frames2 (int): 两个原视频的帧数，给出时帧序号不超过该范围。
+
+    返回：
+        (标准视频帧序号, 用户视频帧序号, 每帧相似度) 三个等长数组。
+    """
+    fps1, fps2 = effective_fps(fps1), effective_fps(fps2)
+    steps = len(path_i)
+    if steps == 0:
+        raise ValueError("对齐路径为空")
+    count = max(1, int(round(steps * fps1 / analysis_fps)))
+    position = np.minimum(np.arange(count) * (analysis_fps / fps1), steps - 1)
+    step_index = np.arange(steps)
+
+    frame_i = np.round(np.interp(position, step_index, path_i) * (fps1 / analysis_fps)).astype(np.int64)
+    frame_j = np.round(np.interp(position, step_index, path_j) * (fps2 / analysis_fps)).astype(np.int64)
+    if frames1 is not None:
+        np.minimum(frame_i, frames1 - 1, out=frame_i)
+    if frames2 is not None:
+        np.minimum(frame_j, frames2 - 1, out=frame_j)
+    scores = np.asarray(similarity_scores)[np.round(position).astype(np.int64)]
+    return frame_i, frame_j, scores
+
+
+def render_overlay_video(
     video1_path,
     video2_path,
+    keypoints1,
+    keypoints2,
+    path_i,
+    path_j,
     similarity_scores,
     output_path,
+    progress=None,
+    colors=((255, 128, 0), (0, 255, 0)),
 ):
     """
-    生成叠加显示视频，带进度条。
+    按DTW路径生成叠加视频：原始帧融合、绘制骨骼、标注相似度一次完成
+
+    直接解码原视频并用关键点绘制骨骼，不依赖中间标注视频，只有一个编码器。
+    输出第 k 帧由标准视频第 path_i[k] 帧与用户视频第 path_j[k] 帧融合而成；
+    路径在分析帧率上时先用 expand_alignment 映射回原帧率。输出文件经过
+    faststart 处理（moov 在前），可以通过 Range 请求边下边播。
 
     参数：
-        video1_path (str): 第一个处理后的视频路径。
-        video2_path (str): 第二个处理后的视频路径。
-        similarity_scores (list): 每帧相似度百分比。
+        video1_path (str): 标准视频（原视频）路径，决定输出分辨率和帧率。
+        video2_path (str): 用户视频（原视频）路径。
+        keypoints1 (ndarray): 标准视频原生长度的绝对坐标关键点 (帧数, 17, 3)。
+        keypoints2 (ndarray): 用户视频原生长度的绝对坐标关键点 (帧数, 17, 3)。
+        path_i (ndarray): 每个输出帧对应的标准视频帧序号，超出原生长度时按循环取模。
+        path_j (ndarray): 每个输出帧对应的用户视频帧序号。
+        similarity_scores (list): 每个输出帧的相似度百分比。
         output_path (str): 输出叠加视频路径。
+        progress (callable): 进度回调 progress(阶段, 已完成帧数, 总帧数)，可选。
+        colors (tuple): 标准骨骼与用户骨骼的颜色。
     """
+    _, fps, (width, height) = get_video_info(video1_path)
+    _, _, (width2, height2) = get_video_info(video2_path)
+    scale2 = (width / width2, height / height2)
 
-    # 打开视频
-    cap1 = cv2.VideoCapture(video1_path)
-    cap2 = cv2.VideoCapture(video2_path)
-
-    if not cap1.isOpened() or not cap2.isOpened():
-        raise ValueError("无法打开视频")
+    total_frames = min(len(path_i), len(path_j), len(similarity_scores))
+    n1, n2 = len(keypoints1), len(keypoints2)
 
-    # 获取视频参数
-    fps = cap1.get(cv2.CAP_PROP_FPS)
-    width = int(cap1.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap1.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    size = (width, height)
+    reader1 = _FrameSeeker(video1_path)
+    reader2 = _FrameSeeker(video2_path)
+    out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    progress_bar = tqdm(total=total_frames, desc="Rendering overlay", unit="frame")
 
-    # 获取视频总帧数
-    total_frames = int(cap1.get(cv2.CAP_PROP_FRAME_COUNT))
+    try:
+        last_j, resized2 = None, None
+        for k in range(total_frames):
+            i = int(path_i[k]) % n1
+            j = int(path_j[k]) % n2
+            frame1 = reader1.read(i)
+            if j != last_j:
+                # 路径竖直段会重复同一用户帧，缩放结果复用
+                frame2 = reader2.read(j)
+                with metrics.stage("resize", frames=1):
+                    resized2 = cv2.resize(frame2, (width, height))
+                last_j = j
+
+            with metrics.stage("draw", frames=1):
+                overlay_frame = cv2.addWeighted(frame1, 0.5, resized2, 0.5, 0)
+                draw_skeleton(overlay_frame, keypoints1[i], colors[0])
+                draw_skeleton(overlay_frame, keypoints2[j], colors[1], scale=scale2)
+                annotate_similarity(overlay_frame, similarity_scores[k])
+            with metrics.stage("encode", frames=1):
+                out.write(overlay_frame)
+
+            progress_bar.update(1)
+            if progress is not None:
+                progress("render", k + 1, total_frames)
+    finally:
+        progress_bar.close()
+        reader1.release()
+        reader2.release()
+        out.release()
+    # 索引前移，浏览器可以边下载边播放
+    with metrics.stage("faststart"):
+        mp4.faststart(output_path)
 
-    # 初始化输出视频
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    out = cv2.VideoWriter(output_path, fourcc, fps, size)
 
-    # 初始化进度条
-    progress_bar = tqdm(total=total_frames, desc="Processing frames", unit="frame")
+# 裁剪区域跟踪推理的默认参数
+ROI_IMGSZ = 320         # 裁剪区域推理的输入尺寸（整帧推理为模型默认的640）
+ROI_PADDING = 0.25      # 关键点外接框每侧向外扩展的比例
+ROI_MIN_JOINTS = 5      # 裁剪区域内有效关节少于该数时改做整帧检测
+ROI_MIN_CONF = 0.5      # 有效关节的平均置信度低于该值时改做整帧检测
+ROI_EDGE_MARGIN = 0.02  # 关节距裁剪边缘小于区域边长的该比例时视为人物移出区域
 
-    frame_idx = 0
 
-    while True:
-        ret1, frame1 = cap1.read()
-        ret2, frame2 = cap2.read()
+class RoiTracker:
+    """
+    跟踪单个人物、只在其周围区域上推理的姿态估计
 
-        if not ret1 or not ret2:
-            break
+    由上一帧关键点的外接框向外扩展 padding 得到正方形区域，在较小的输入尺寸
+    imgsz 上推理，关键点再映射回整帧坐标。区域内没有检测到人、有效关节太少或
+    平均置信度不足、或者关节贴近区域边缘（人物可能已移出区域）时，对同一帧改做
+    整帧检测并重新确定区域。
 
-        # 调整第二个视频的分辨率与第一个一致
-        frame2 = cv2.resize(frame2, (width, height))
+    按固定输入尺寸导出的模型（见 backends.py）会忽略 imgsz，此时只省去整帧的缩放。
 
-        # 帧融合
-        overlay_frame = cv2.addWeighted(frame1, 0.5, frame2, 0.5, 0)
+    :param selector: 跨帧选人的 PersonSelector，默认新建
+    :param imgsz: 区域推理的输入尺寸
+    :param padding: 外接框每侧向外扩展的比例
+    :param min_joints: 接受区域推理结果所需的有效关节数
+    :param min_conf: 接受区域推理结果所需的有效关节平均置信度
+    """
 
-        # 添加相似度标注
-        similarity = similarity_scores[frame_idx]
-        if similarity >= 90:
-            color = (0, 255, 0)  # 绿色
-        elif similarity >= 75:
-            color = (0, 255, 255)  # 黄色
-        else:
-            color = (0, 0, 255)  # 红色
-
-        text = f"Similarity: {similarity:.2f}%"
-        cv2.putText(
-            overlay_frame,
-            text,
-            (width - 300, 50),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            1,
-            color,
-            2,
+    def __init__(self, selector=None, imgsz=ROI_IMGSZ, padding=ROI_PADDING,
+                 min_joints=ROI_MIN_JOINTS, min_conf=ROI_MIN_CONF):
+        self.selector = selector or PersonSelector()
+        self.imgsz = imgsz
+        self.padding = padding
+        self.min_joints = min_joints
+        self.min_conf = min_conf
+        self.roi = None  # (左, 上, 右, 下)，None 时下一帧做整帧检测
+        self.stats = {"crop": 0, "full": 0, "fallback": 0}
+
+    def _region(self, keypoints, width, height):
+        """由关键点确定下一帧的正方形区域（贴边时整体平移到画面内）"""
+        valid = ~np.isnan(keypoints[:, 0])
+        if valid.sum() < self.min_joints:
+            return None
+        xy = keypoints[valid, :2]
+        (x1, y1), (x2, y2) = xy.min(axis=0), xy.max(axis=0)
+        side = max(x2 - x1, y2 - y1) * (1 + 2 * self.padding)
+        side = int(min(max(side, self.imgsz / 2), max(width, height)))
+        left = int(np.clip((x1 + x2 - side) / 2, 0, max(width - side, 0)))
+        top = int(np.clip((y1 + y2 - side) / 2, 0, max(height - side, 0)))
+        return left, top, min(left + side, width), min(top + side, height)
+
+    def _acceptable(self, keypoints, roi, width, height):
+        """区域推理结果是否可信，且人物仍完整地在区域内"""
+        valid = ~np.isnan(keypoints[:, 0])
+        if valid.sum() < self.min_joints or keypoints[valid, 2].mean() < self.min_conf:
+            return False
+        left, top, right, bottom = roi
+        margin = ROI_EDGE_MARGIN * max(right - left, bottom - top)
+        xy = keypoints[valid, :2]
+        # 画面边缘处的区域边不算（人物不会从那里移出区域）
+        return not (
+            (left > 0 and xy[:, 0].min() < left + margin)
+            or (top > 0 and xy[:, 1].min() < top + margin)
+            or (right < width and xy[:, 0].max() > right - margin)
+            or (bottom < height and xy[:, 1].max() > bottom - margin)
         )
 
-        # 写入输出视频
-        out.write(overlay_frame)
-
-        # 更新进度条
-        progress_bar.update(1)
+    def _infer_region(self, frame, model, roi):
+        left, top, right, bottom = roi
+        result = model(frame[top:bottom, left:right], imgsz=self.imgsz, verbose=False)[0]
+        # 选人器记录的上一帧目标框换算到区域坐标，选完再换算回整帧坐标
+        offset = np.array([left, top, left, top], dtype=np.float32)
+        if self.selector.box is not None:
+            self.selector.box = self.selector.box - offset
+        try:
+            keypoints = extract_keypoints(result, self.selector)
+        finally:
+            if self.selector.box is not None:
+                self.selector.box = self.selector.box + offset
+        keypoints[:, 0] += left
+        keypoints[:, 1] += top
+        return keypoints
+
+    def snapshot(self):
+        """当前的跨帧状态（区域和选人器状态），可用 restore 恢复；统计不在其中"""
+        return self.roi, self.selector.snapshot()
+
+    def restore(self, state):
+        self.roi, selector_state = state
+        self.selector.restore(selector_state)
+
+    def detect(self, frame, model):
+        """
+        估计一帧的姿态（与 detect_single_pose 的返回值相同）
+
+        :param frame: BGR帧
+        :param model: YOLO姿态模型
+        :return: (17, 3) 整帧坐标+置信度，低置信度关节坐标为NaN；未检测到人时为 None
+        """
+        height, width = frame.shape[:2]
+        mode = "full"
+        if self.roi is not None:
+            keypoints = self._infer_region(frame, model, self.roi)
+            if self._acceptable(keypoints, self.roi, width, height):
+                self.stats["crop"] += 1
+                metrics.inc("pose_roi_frames_total", mode="crop")
+                self.roi = self._region(keypoints, width, height)
+                return keypoints
+            mode = "fallback"
+
+        self.stats[mode] += 1
+        metrics.inc("pose_roi_frames_total", mode=mode)
+        result = model(frame, verbose=False)[0]
+        if result.keypoints is None or len(result.keypoints.xy) == 0:
+            self.roi = None
+            return None
+        keypoints = extract_keypoints(result, self.selector)
+        self.roi = self._region(keypoints, width, height)
+        return keypoints
+
+
+def detect_single_pose(frame: np.ndarray, model: YOLO, selector: PersonSelector = None,
+                       tracker: RoiTracker = None):
+    """
+    单帧姿态估计
 
-        frame_idx += 1
+    :param frame: BGR帧
+    :param model: YOLO姿态模型
+    :param selector: 跨帧选人的 PersonSelector（如实时会话持有的），为 None 时选最大的人
+    :param tracker: 给出时只在跟踪的人物区域上推理（见 RoiTracker，selector 不再使用）
+    :return: (17, 3) 绝对坐标+置信度，低置信度关节坐标为NaN；未检测到人时为 None
+    """
+    if tracker is not None:
+        return tracker.detect(frame, model)
+    results = model(frame, verbose=False)[0]
+    if results.keypoints is None or len(results.keypoints.xy) == 0:
+        return None
+    return extract_keypoints(results, selector)
 
-    cap1.release()
-    cap2.release()
-    out.release()
 
-def process_single_frame(
-    frame: np.ndarray,
+def score_single_pose(
+    current_kp: np.ndarray,
     standard_kp_json: list,
-    model: YOLO,
     frame_index: int,
     weights: list,
     resolution: tuple,
-    skeleton_conn: list = [
-        (0, 1), (0, 2), (1, 3), (2, 4),       # 头部
-        (5, 6), (5, 7), (7, 9), (6, 8),      # 躯干和手臂
-        (8, 10), (11, 12), (5, 11), (6, 12), # 髋部连接
-        (11, 13), (13, 15), (12, 14), (14, 16) # 腿部
-    ]
-) -> np.ndarray:
+    min_valid_weight: float = 0.5,
+):
     """
-    修改版：仅显示用户骨骼（绿色），不显示标准参考骨骼
+    把一帧绝对坐标关键点与指定的标准帧比较
+
+    :param current_kp: (17, 2|3) 绝对坐标关键点
+    :param standard_kp_json: 标准关键点序列
+    :param frame_index: 对比的标准帧序号（按序列长度取模）
+    :param weights: 每个关键点的权重，长度为17
+    :param resolution: 用于归一化距离的分辨率 (宽度, 高度)
+    :param min_valid_weight: 有效关节权重占总权重的最小比例，不足时判为无效姿态
+    :return: (相似度百分比, 是否为有效姿态)
     """
     # 获取标准关键点（仅用于计算，不显示）
-    standard_norm_kp = np.array(standard_kp_json[frame_index % len(standard_kp_json)]).astype(float)
-    
-    # 姿态估计
-    results = model(frame, verbose=False)[0]
-    vis_frame = frame.copy()
-    
-    if results.keypoints is None or len(results.keypoints.xy) == 0:
-        cv2.putText(vis_frame, "No pose detected", (50, 50), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
-        return vis_frame
+    standard_norm_kp = np.array(standard_kp_json[frame_index % len(standard_kp_json)]).astype(float)[:, :2]
 
-    # 当前帧关键点
-    current_abs_kp = results.keypoints.xy[0].cpu().numpy()
+    current_abs_kp = current_kp[:, :2]
     mid_shoulder = (current_abs_kp[5] + current_abs_kp[6]) / 2
-    
-    # ========= 关键修改：移除标准骨骼绘制 =========
+
     # 仅保留相似度计算所需的标准关键点处理（不显示）
     current_norm_kp = current_abs_kp - mid_shoulder
     total_distance = 0.0
-    valid = True
-    
+    valid_weight = 0.0
+
+    # 缺失的关节跳过，按有效关节的权重归一化（与 score_keypoint_sequences 一致）
     for i in range(17):
         if np.isnan(current_norm_kp[i]).any() or np.isnan(standard_norm_kp[i]).any():
-            valid = False
-            break
+            continue
         distance = np.linalg.norm(current_norm_kp[i] - standard_norm_kp[i])
         total_distance += weights[i] * distance
+        valid_weight += weights[i]
 
     # 相似度计算
     max_distance = np.sqrt(resolution[0]**2 + resolution[1]**2)
+    valid = valid_weight >= min_valid_weight * sum(weights)
     if valid:
-        similarity = max(0.0, min(100.0, (1 - total_distance/(max_distance*sum(weights)))*100))
-        color = (0, 255, 0)  # 仅用绿色显示
+        similarity = max(0.0, min(100.0, (1 - total_distance/(max_distance*valid_weight))*100))
     else:
         similarity = 0.0
-        color = (0, 0, 255)
-    
-    # ========= 仅绘制用户骨骼 =========
-    # 绘制关键点
-    for idx, (x, y) in enumerate(current_abs_kp):
-        cv2.circle(vis_frame, (int(x), int(y)), 5, (0, 255, 0), -1)
-    
-    # 修改骨骼连接绘制逻辑，跳过无效关键点
-    # 绘制骨骼连接的修改部分
-    for (start, end) in skeleton_conn:
-        # 1. 检查索引是否越界
-        if start >= len(current_abs_kp) or end >= len(current_abs_kp):
-            continue
-        
-        # 2. 获取坐标并检查有效性（非NaN、非零点、在图像范围内）
-        kp_start = current_abs_kp[start]
-        kp_end = current_abs_kp[end]
-        
-        # 定义无效坐标条件
-        is_invalid_start = np.isnan(kp_start).any() or np.allclose(kp_start, [0, 0], atol=1e-3)
-        is_invalid_end = np.isnan(kp_end).any() or np.allclose(kp_end, [0, 0], atol=1e-3)
-        
-        if is_invalid_start or is_invalid_end:
-            continue
-        
-        # 3. 转换为整数坐标并检查边界
-        x1, y1 = int(kp_start[0]), int(kp_start[1])
-        x2, y2 = int(kp_end[0]), int(kp_end[1])
-        
-        if (0 <= x1 < resolution[0] and 0 <= y1 < resolution[1] and
-            0 <= x2 < resolution[0] and 0 <= y2 < resolution[1]):
-            cv2.line(vis_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-        
-        x1, y1 = map(int, current_abs_kp[start])
-        x2, y2 = map(int, current_abs_kp[end])
-        cv2.line(vis_frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-    
-    # 显示相似度
-    text = f"Similarity: {similarity:.1f}%" if valid else "Invalid Pose"
-    text_size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)[0]
-    text_x = vis_frame.shape[1] - text_size[0] - 20
-    text_y = 50
-    cv2.rectangle(vis_frame, 
-                (text_x - 10, text_y - text_size[1] - 10), 
-                (text_x + text_size[0] + 10, text_y + 10), 
-                (0,0,0), -1)
-    cv2.putText(vis_frame, text, (text_x, text_y),
-        cv2.FONT_HERSHEY_DUPLEX, 1, (0,255,0), 2, cv2.LINE_AA)
-    
+    return float(similarity), valid
+
+
+def compare_single_frame(
+    frame: np.ndarray,
+    standard_kp_json: list,
+    model: YOLO,
+    frame_index: int,
+    weights: list,
+    resolution: tuple,
+) -> dict:
+    """
+    单帧姿态估计并与标准关键点比较，不做任何绘制
+
+    :param frame: BGR帧
+    :param standard_kp_json: 标准关键点序列
+    :param model: YOLO姿态模型
+    :param frame_index: 对比的标准帧序号
+    :param weights: 每个关键点的权重，长度为17
+    :param resolution: 用于归一化距离的分辨率 (宽度, 高度)
+    :return: {"keypoints": (17, 3) 绝对坐标+置信度，未检测到人时为 None,
+              "similarity": 相似度百分比, "valid": 是否为有效姿态}
+    """
+    current_kp = detect_single_pose(frame, model)
+    if current_kp is None:
+        return {"keypoints": None, "similarity": 0.0, "valid": False}
+
+    similarity, valid = score_single_pose(
+        current_kp, standard_kp_json, frame_index, weights, resolution
+    )
+    return {"keypoints": current_kp, "similarity": similarity, "valid": valid}
+
+
+class PoseComparator:
+    """
+    实时单帧比较器
+
+    标准序列、关节权重和归一化常数只在构造时准备一次；每帧的评分是向量化的
+    NaN 屏蔽计算（规则与 score_single_pose 相同），绘制直接写入复用的缓冲区
+    或原帧，也可以只返回关键点和分数、完全不绘制。复用的缓冲区每个线程一份，
+    同一个比较器可以被多个请求线程共用。
+
+    :param standard_kp: (帧数, 17, 2|3) 归一化标准关键点
+    :param weights: 每个关键点的权重，长度为17
+    :param resolution: 用于归一化距离的分辨率 (宽度, 高度)
+    :param min_valid_weight: 有效关节权重占总权重的最小比例，不足时判为无效姿态
+    """
+
+    def __init__(self, standard_kp, weights, resolution, min_valid_weight=0.5):
+        self.reference = np.ascontiguousarray(np.asarray(standard_kp)[..., :2], dtype=np.float64)
+        if len(self.reference) == 0:
+            raise ValueError("标准关键点序列为空")
+        self.weights = np.asarray(weights, dtype=np.float64)
+        total_weight = float(sum(weights))
+        self.min_weight = min_valid_weight * total_weight
+        self.max_distance = float(np.sqrt(resolution[0] ** 2 + resolution[1] ** 2))
+        self._local = threading.local()
+
+    def score(self, current_kp, frame_index):
+        """
+        :param current_kp: (17, 2|3) 绝对坐标关键点，缺失的关节为NaN
+        :param frame_index: 对比的标准帧序号（按序列长度取模）
+        :return: (相似度百分比, 是否为有效姿态)
+        """
+        xy = current_kp[:, :2]
+        diff = (xy - (xy[5] + xy[6]) / 2) - self.reference[frame_index % len(self.reference)]
+        distances = np.sqrt((diff * diff).sum(axis=1))
+        valid = ~np.isnan(distances)
+        valid_weight = self.weights @ valid
+        if valid_weight < self.min_weight or valid_weight == 0:
+            return 0.0, False
+        total_distance = distances[valid] @ self.weights[valid]
+        similarity = (1 - total_distance / (self.max_distance * valid_weight)) * 100
+        return float(min(100.0, max(0.0, similarity))), True
+
+    def compare(self, frame, model, frame_index, selector=None, tracker=None):
+        """
+        只做姿态估计和评分，不绘制
+
+        :param tracker: 给出时只在跟踪的人物区域上推理（见 RoiTracker）
+        :return: 与 compare_single_frame 相同的字典
+        """
+        current_kp = detect_single_pose(frame, model, selector, tracker)
+        if current_kp is None:
+            return {"keypoints": None, "similarity": 0.0, "valid": False}
+        similarity, valid = self.score(current_kp, frame_index)
+        return {"keypoints": current_kp, "similarity": similarity, "valid": valid}
+
+    def render(self, frame, comparison, in_place=False):
+        """
+        绘制用户骨骼和相似度
+
+        :param frame: BGR帧
+        :param comparison: compare 的返回值
+        :param in_place: 为真时直接画在 frame 上；否则画在当前线程复用的缓冲区中，
+            返回的数组在本线程下一次 render 前有效
+        :return: 绘制后的帧
+        """
+        if in_place:
+            canvas = frame
+        else:
+            buffer = getattr(self._local, "buffer", None)
+            if buffer is None or buffer.shape != frame.shape:
+                buffer = self._local.buffer = np.empty_like(frame)
+            np.copyto(buffer, frame)
+            canvas = buffer
+
+        if comparison["keypoints"] is None:
+            cv2.putText(canvas, "No pose detected", (50, 50),
+                        cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            return canvas
+
+        draw_skeleton(canvas, comparison["keypoints"])
+        text = f"Similarity: {comparison['similarity']:.1f}%" if comparison["valid"] else "Invalid Pose"
+        text_size = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 1, 2)[0]
+        text_x = canvas.shape[1] - text_size[0] - 20
+        text_y = 50
+        cv2.rectangle(canvas,
+                      (text_x - 10, text_y - text_size[1] - 10),
+                      (text_x + text_size[0] + 10, text_y + 10),
+                      (0, 0, 0), -1)
+        cv2.putText(canvas, text, (text_x, text_y),
+                    cv2.FONT_HERSHEY_DUPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
+        return canvas
+
+    def process(self, frame, model, frame_index, selector=None, draw=True, in_place=False, tracker=None):
+        """
+        估计、评分并（可选）绘制一帧
+
+        :param draw: 为假时只返回关键点和分数（绘制结果为 None）
+        :param in_place: 见 render
+        :param tracker: 见 compare
+        :return: (compare 的返回值, 绘制后的帧或 None)
+        """
+        comparison = self.compare(frame, model, frame_index, selector, tracker)
+        if not draw:
+            return comparison, None
+        return comparison, self.render(frame, comparison, in_place=in_place)
+
+
+def process_single_frame(
+    frame: np.ndarray,
+    standard_kp_json: list,
+    model: YOLO,
+    frame_index: int,
+    weights: list,
+    resolution: tuple,
+) -> np.ndarray:
+    """
+    仅显示用户骨骼（绿色），不显示标准参考骨骼
+
+    兼容旧接口，每次调用都重新准备标准序列；逐帧调用时请复用 PoseComparator。
+
+    :return: 绘制后的新帧（不修改输入帧）
+    """
+    comparator = PoseComparator(standard_kp_json, weights, resolution)
+    comparison, vis_frame = comparator.process(frame, model, frame_index)
     return vis_frame
 
 if __name__ == "__main__":
-    # 原始的处理流程
-    process_pose_videos(
+    # 原始的处理流程（不生成中间标注视频）
+    raw_keypoints1, raw_keypoints2 = process_pose_videos(
         video1_path=r"movies/1.mp4",
         video2_path=r"movies/2.mp4",
-        output_vid1_path=r"movies/process_1.mp4",
-        output_vid2_path=r"movies/process_2.mp4",
-        keypoints1_path=r"keypoints/kp1.json",
-        keypoints2_path=r"keypoints/kp2.json",
+        output_vid1_path=None,
+        output_vid2_path=None,
+        keypoints1_path=r"keypoints/kp1.npy",
+        keypoints2_path=r"keypoints/kp2.npy",
+        analysis_fps=10,
     )
-    align_keypoints(
-        r"keypoints/kp1.json",
-        r"keypoints/kp2.json",
-        r"keypoints/aligned1.json",
-        r"keypoints/aligned2.json",
+    path_i, path_j = align_keypoints(
+        r"keypoints/kp1.npy",
+        r"keypoints/kp2.npy",
+        r"keypoints/aligned1.npy",
+        r"keypoints/aligned2.npy",
     )
     
     # 相似度计算和视频生成
-    json_path1 = r"keypoints/aligned1.json"
-    json_path2 = r"keypoints/aligned2.json"
+    json_path1 = r"keypoints/aligned1.npy"
+    json_path2 = r"keypoints/aligned2.npy"
     resolution = (640, 360)
     weights = [0.2, 0.5, 0.5, 0.7, 0.7, 0.6, 0.6, 0.7, 0.7, 0.6, 0.6, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
 
     similarity_scores, low_similarity_frames = calculate_similarity_and_low_similarity_frames(
         json_path1, json_path2, resolution, weights
     )
-    generate_overlay_video(
-        video1_path=r"movies/process_1.mp4",
-        video2_path=r"movies/process_2.mp4",
-        similarity_scores=similarity_scores,
+    _, fps1, _ = get_video_info(r"movies/1.mp4")
+    _, fps2, _ = get_video_info(r"movies/2.mp4")
+    frames_i, frames_j, frame_scores = expand_alignment(
+        path_i, path_j, similarity_scores, common_analysis_fps(fps1, fps2, 10),
+        fps1, fps2, len(raw_keypoints1), len(raw_keypoints2)
+    )
+    render_overlay_video(
+        r"movies/1.mp4",
+        r"movies/2.mp4",
+        raw_keypoints1,
+        raw_keypoints2,
+        frames_i,
+        frames_j,
+        frame_scores,
         output_path=r"movies/Overlay.mp4",
     )
 
@@ -482,11 +2370,13 @@ if __name__ == "__main__":
     print("\n启动实时姿态对比测试（按 Q 退出）...")
     
     # 加载标准关键点
-    with open(r"keypoints/aligned1.json", "r") as f:
-        standard_kp = json.load(f)
+    standard_kp = load_keypoints(r"keypoints/aligned1.npy")
     
-    # 初始化模型
-    model = YOLO(r"models\yolo11n-pose.pt")
+    # 初始化模型和比较器
+    model = MODEL_POOL.model()
+    comparator = PoseComparator(standard_kp, weights, resolution)
+    # 只在跟踪的人物区域上推理，降低每帧延迟
+    tracker = RoiTracker(PersonSelector())
     
     # 打开摄像头
     cap = cv2.VideoCapture(0)
@@ -501,14 +2391,9 @@ if __name__ == "__main__":
                 print("无法获取视频帧")
                 break
 
-            # 处理当前帧
-            processed_frame = process_single_frame(
-                frame=frame,
-                standard_kp_json=standard_kp,
-                model=model,
-                frame_index=frame_index,
-                weights=weights,
-                resolution=resolution
+            # 处理当前帧（直接画在摄像头帧上）
+            _, processed_frame = comparator.process(
+                frame, model, frame_index, in_place=True, tracker=tracker
             )
             
             # 显示处理结果
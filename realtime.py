@@ -0,0 +1,371 @@
+"""
+实时对比会话
+
+每个实时分析客户端对应一个服务端会话：保存用户最近的关键点窗口，并维护
+一个随时间或动作进度前进的标准序列游标，使每一帧都与“当前应做到的”标准
+动作比较，而不是总与第一帧比较。会话空闲超时后自动清理。
+
+多个客户端同时实时分析时，各请求的单帧推理由 InferenceBatcher 合并为批量推理。
+"""
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+import metrics
+import process
+
+
+class OnlineAligner:
+    """
+    在线DTW：把实时动作逐帧对齐到标准关键点序列（序列按循环处理）
+
+    只在标准序列上维护一个长度为 window 的搜索窗口及其累计代价，每来一帧
+    计算窗口内的代价并做一次DTW行递推，单帧开销为 O(window)。
+
+    :param reference: (帧数, 17, 2|3) 归一化标准关键点
+    :param window: 搜索窗口长度（标准帧）
+    :param weights: 关节权重，长度为17
+    """
+
+    def __init__(self, reference, window=30, weights=None):
+        self.reference = np.ascontiguousarray(process.fill_missing_joints(reference[..., :2]))
+        self.window = min(window, len(self.reference))
+        if weights is None:
+            weights = np.ones(process.NUM_KEYPOINTS)
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        """丢弃对齐状态，下一帧在整个标准序列上重新定位"""
+        self.start = 0
+        self.cost = None
+        self.position = 0
+        self.last_cost = None
+
+    def _costs(self, norm_kp, indices):
+        # 当前帧缺失的关节不参与比较
+        valid = ~np.isnan(norm_kp[:, :2]).any(axis=-1)
+        diff = self.reference[indices][:, valid] - norm_kp[valid, :2]
+        return np.sqrt((diff * diff).sum(axis=-1)) @ self.weights[valid]
+
+    def relocalize(self, frames):
+        """
+        用最近若干帧在整个标准序列上做子序列DTW（起止点不限），重新确定位置
+
+        :param frames: 归一化关键点序列，按时间顺序
+        :return: 对齐到的标准帧序号
+        """
+        n = len(self.reference)
+        indices = np.arange(n)
+        row = None
+        for norm_kp in frames:
+            costs = self._costs(norm_kp, indices)
+            if row is None:
+                row = costs
+                continue
+            best = row.copy()
+            best[1:] = np.minimum(best[1:], row[:-1])
+            row = process.dtw_row_step(best, costs)
+
+        self.position = int(np.argmin(row))
+        self.last_cost = float(costs[self.position])
+        self.start = max(self.position - self.window // 4, 0)
+        window_row = np.full(self.window, np.inf)
+        end = min(self.start + self.window, n)
+        window_row[:end - self.start] = row[self.start:end]
+        self.cost = window_row - row[self.position]
+        return self.position
+
+    def step(self, norm_kp):
+        """
+        输入一帧归一化关键点，返回对齐到的标准帧绝对序号（未取模）
+
+        :param norm_kp: (17, 2|3) 以肩膀中点归一化的关键点
+        """
+        n = len(self.reference)
+        if self.cost is None:
+            # 首帧：在整个标准序列上定位
+            costs = self._costs(norm_kp, np.arange(n))
+            self.position = int(np.argmin(costs))
+            self.last_cost = float(costs[self.position])
+            new_start = max(self.position - self.window // 4, 0)
+            window_row = costs[(new_start + np.arange(self.window)) % n]
+        else:
+            indices = (self.start + np.arange(self.window)) % n
+            costs = self._costs(norm_kp, indices)
+            # 竖直：用户前进、标准不动；斜向：两者同时前进
+            best = self.cost.copy()
+            best[1:] = np.minimum(best[1:], self.cost[:-1])
+            row = process.dtw_row_step(best, costs)
+            offset = int(np.argmin(row))
+            self.position = self.start + offset
+            self.last_cost = float(costs[offset])
+
+            # 窗口起点跟随当前位置，保留少量回退余地；移出窗口的格子丢弃
+            new_start = max(self.position - self.window // 4, 0)
+            shift = new_start - self.start
+            window_row = np.full(self.window, np.inf)
+            if shift >= 0:
+                window_row[:self.window - shift] = row[shift:]
+            else:
+                window_row[-shift:] = row[:self.window + shift]
+
+        # 累计代价减去最小值，避免数值无限增长
+        finite = np.isfinite(window_row)
+        if finite.any():
+            window_row[finite] -= window_row[finite].min()
+        self.cost = window_row
+        self.start = new_start
+        return self.position
+
+
+class RealtimeSession:
+    """
+    单个实时分析客户端的状态
+
+    :param reference: 归一化标准关键点序列
+    :param ref_fps: 标准序列帧率，用于按时间推进游标
+    :param mode: "dtw" 按动作进度对齐；"time" 按墙钟时间推进
+    :param window: 用户关键点滚动窗口和在线DTW搜索窗口的长度
+    :param weights: 关节权重
+    :param max_missed: 连续多少帧未检测到人后重新定位
+    :param drift_ratio: 匹配代价超过近期中位数的该倍数时视为对齐跑偏
+    :param drift_frames: 连续跑偏多少帧后用这几帧重新定位
+    """
+
+    def __init__(self, reference, ref_fps=30.0, mode="dtw", window=30, weights=None,
+                 max_missed=15, drift_ratio=3.0, drift_frames=3):
+        self.id = uuid.uuid4().hex
+        self.reference = reference
+        self.ref_fps = ref_fps or 30.0
+        self.mode = mode
+        self.history = deque(maxlen=window)
+        self.recent_costs = deque(maxlen=window)
+        self.aligner = OnlineAligner(reference, window=window, weights=weights)
+        self.max_missed = max_missed
+        self.drift_ratio = drift_ratio
+        self.drift_frames = drift_frames
+        self.drifting = 0
+        self.missed = 0
+        self.selector = process.PersonSelector()
+        self.tracker = process.RoiTracker(self.selector)
+        self.started = time.monotonic()
+        self.last_seen = self.started
+        self.last_detected = self.started
+        # 可重入：detect 持锁期间调用 advance
+        self.lock = threading.RLock()
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+
+    def relocalize(self, frames):
+        """丢弃对齐状态，用滚动窗口中最近 frames 帧重新对齐到标准序列"""
+        self.drifting = 0
+        return self.aligner.relocalize(list(self.history)[-frames:])
+
+    def detect(self, frame, model, roi_tracking=True):
+        """
+        检测当前帧中的目标人物并推进游标
+
+        同一会话的帧（如 HTTP 回退接口的并发请求）在会话锁内串行处理，选人和
+        ROI跟踪的状态不会被并发修改。
+
+        :param frame: BGR帧
+        :param model: YOLO姿态模型（或 InferenceBatcher）
+        :param roi_tracking: 是否只在跟踪的人物区域上推理
+        :return: (关键点或 None, 标准帧序号)，见 process.detect_single_pose 和 advance
+        """
+        with self.lock:
+            keypoints = process.detect_single_pose(
+                frame, model, self.selector, self.tracker if roi_tracking else None)
+            return keypoints, self.advance(keypoints)
+
+    def advance(self, current_kp):
+        """
+        输入当前帧的绝对坐标关键点（未检测到人时为 None），返回应对比的标准帧序号
+
+        肩膀缺失（无法归一化）的帧与未检测到人同样处理。
+
+        :return: 标准序列上的帧序号（已取模）
+        """
+        with self.lock:
+            self.touch()
+            now = self.last_seen
+            n = len(self.reference)
+            if self.mode == "time":
+                return int((now - self.started) * self.ref_fps) % n
+
+            if current_kp is None or np.isnan(current_kp[[5, 6], :2]).any():
+                self.missed += 1
+                if self.missed >= self.max_missed:
+                    # 长时间丢失目标，历史窗口已失效
+                    self.aligner.reset()
+                    self.history.clear()
+                    self.recent_costs.clear()
+                    self.drifting = 0
+                # 丢失目标期间游标按墙钟时间外推
+                return int(self.aligner.position + (now - self.last_detected) * self.ref_fps) % n
+
+            self.missed = 0
+            self.last_detected = now
+            norm_kp = current_kp[:, :2] - (current_kp[5, :2] + current_kp[6, :2]) / 2
+            self.history.append(norm_kp)
+            position = self.aligner.step(norm_kp)
+
+            # 匹配代价连续几帧明显变差说明对齐跑偏（如用户跳过了一段动作），
+            # 只用跑偏后的这几帧重新定位，避免旧动作把游标拉回原处
+            if len(self.recent_costs) == self.recent_costs.maxlen:
+                threshold = self.drift_ratio * max(np.median(self.recent_costs), 1.0)
+                if self.aligner.last_cost > threshold:
+                    self.drifting += 1
+                    if self.drifting >= self.drift_frames:
+                        position = self.relocalize(self.drifting)
+                else:
+                    self.drifting = 0
+            self.recent_costs.append(self.aligner.last_cost)
+            return position % n
+
+
+class SessionStore:
+    """
+    会话表：按ID查找会话，空闲超过 idle_timeout 秒的会话自动清理
+
+    :param factory: 无参函数，创建新的 RealtimeSession
+    :param idle_timeout: 空闲超时（秒）
+    :param max_sessions: 会话数上限，超过时清理最久未活动的会话
+    """
+
+    def __init__(self, factory, idle_timeout=60, max_sessions=64):
+        self.factory = factory
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id=None):
+        with self._lock:
+            self._prune()
+            session = self._sessions.get(session_id) if session_id else None
+            if session is None:
+                session = self.factory()
+                self._sessions[session.id] = session
+            session.touch()
+            return session
+
+    def remove(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def _prune(self):
+        """清理空闲会话并限制总数（调用方持有锁）"""
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_seen > self.idle_timeout:
+                del self._sessions[session_id]
+        if len(self._sessions) >= self.max_sessions:
+            oldest = sorted(self._sessions.values(), key=lambda s: s.last_seen)
+            for session in oldest[: len(self._sessions) - self.max_sessions + 1]:
+                del self._sessions[session.id]
+
+
+class _PendingFrame:
+    """等待批量推理的一帧"""
+
+    def __init__(self, frame, kwargs):
+        self.frame = frame
+        self.kwargs = kwargs
+        self.arrived = time.monotonic()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceBatcher:
+    """
+    把并发实时请求的单帧推理合并为批量推理
+
+    调用方式与 YOLO 实例相同（每次一帧，返回单元素结果列表），调用线程阻塞到
+    本帧结果返回。后台线程在最早的一帧到达后最多等待 max_wait 秒或凑满
+    max_batch 帧，再按预处理方式分组、每组一次模型调用；执行期间到达的帧进入
+    下一批，已经等够 max_wait 的帧不再额外等待。
+
+    会话经 RealtimeSession.detect 调用时持有会话锁直到本帧结果返回，同一会话的
+    帧不会进入同一批，也不会并发修改该会话的选人和ROI跟踪状态。
+
+    :param model: YOLO姿态模型（或模型池代理）
+    :param max_batch: 每批最多帧数，1 即不合并、直接调用模型
+    :param max_wait: 最早一帧到达后等待凑批的最长时间（秒）
+    """
+
+    def __init__(self, model, max_batch=8, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def __call__(self, frame, verbose=False, **kwargs):
+        if self.max_batch <= 1:
+            return self.model(frame, verbose=False, **kwargs)
+        request = _PendingFrame(frame, kwargs)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="inference-batcher", daemon=True)
+                self._thread.start()
+            self._pending.append(request)
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return [request.result]
+
+    @staticmethod
+    def _group_key(request):
+        # 正方形输入在 letterbox 后尺寸相同（与单独推理一致），不同边长的裁剪区域可以同批
+        height, width = request.frame.shape[:2]
+        shape = ("square",) + request.frame.shape[2:] if height == width else request.frame.shape
+        return shape, tuple(sorted(request.kwargs.items()))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                deadline = self._pending[0].arrived + self.max_wait
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+
+            groups = {}
+            for request in batch:
+                groups.setdefault(self._group_key(request), []).append(request)
+            for requests in groups.values():
+                self._execute(requests)
+
+    def _execute(self, requests):
+        try:
+            with metrics.stage("inference", frames=len(requests)):
+                results = self.model(
+                    [request.frame for request in requests], verbose=False, **requests[0].kwargs)
+            for request, result in zip(requests, results):
+                request.result = result
+        except Exception as e:  # 模型出错时本组的每个调用方都收到异常
+            for request in requests:
+                request.error = e
+        finally:
+            metrics.inc("pose_realtime_batches_total")
+            metrics.inc("pose_realtime_batched_frames_total", len(requests))
+            for request in requests:
+                request.done.set()
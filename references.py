@@ -0,0 +1,340 @@
+"""
+参考动作库
+
+每个参考动作保存为 <目录>/<名称>.npy（肩膀中点归一化的关键点，(帧数, 17, 3)）
+和 <名称>.json（帧率、对应视频等元数据）。条目只在 add 时写入一次、不会被覆盖，
+读出的数组是只读的，分析流程的中间结果写在各自的任务文件中。
+
+为了在多个参考动作中快速找到用户片段对应的动作和起点，库把每个参考动作按固定
+帧率切成重叠的时间窗口，每个窗口压缩成一个低维姿态嵌入（PCA），组成平面最近邻
+索引；查询时对用户片段同样切窗嵌入，按各参考动作上的最近邻距离排序，再只对选中
+的参考动作做完整的DTW。
+
+用法：
+    python references.py list
+    python references.py add 名称 视频路径 [--title 标题]
+    python references.py add 名称 视频路径 --keypoints 归一化关键点.json
+    python references.py match 用户视频路径
+"""
+import argparse
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+import process
+
+REFERENCE_DIR = "references"
+
+# 嵌入只使用头部和上肢（与评分权重非零的关节一致），髋部只用于估计身体尺度
+EMBED_JOINTS = list(range(11))
+EMBED_FPS = 10.0        # 切窗前统一重采样到的帧率
+EMBED_WINDOW = 16       # 窗口长度（帧，EMBED_FPS 下）
+EMBED_STRIDE = 4        # 查询窗口的步长（帧）
+EMBED_SAMPLES = 8       # 每个窗口均匀取样的帧数
+EMBED_DIMS = 32         # PCA 降维后的维数
+
+# 窗口内的取样帧（相对窗口起点，EMBED_FPS 下）
+_SAMPLE_OFFSETS = np.round(np.linspace(0, EMBED_WINDOW - 1, EMBED_SAMPLES)).astype(np.int64)
+
+_NAME_PATTERN = re.compile(r"^[\w\-]+$")
+
+
+class Reference:
+    """单个参考动作（只读）"""
+
+    def __init__(self, name, keypoints, meta):
+        self.name = name
+        self.keypoints = keypoints
+        self.fps = meta["fps"]
+        self.video = meta.get("video")
+        self.title = meta.get("title") or name
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "title": self.title,
+            "frames": len(self.keypoints),
+            "fps": self.fps,
+            "duration": round(len(self.keypoints) / self.fps, 2),
+            "video": self.video,
+        }
+
+
+def window_embeddings(keypoints, fps, stride=EMBED_STRIDE, phases=1, pad=False):
+    """
+    把归一化关键点序列切成重叠窗口，每个窗口展平为一个姿态特征向量
+
+    坐标先按整段序列的躯干长度缩放，使不同体型、不同分辨率的视频可比；
+    缺失的关节按时间插值补全。窗口内的取样帧固定为 _SAMPLE_OFFSETS，序列短于
+    一个窗口时只有一个窗口：pad 为 True 时重复最后一帧补足，否则只取落在序列
+    内的取样帧（不把短片段拉伸成一个窗口的时长）。
+
+    :param keypoints: (帧数, 17, 2|3) 归一化关键点
+    :param fps: 序列帧率
+    :param stride: 窗口步长（帧，EMBED_FPS * phases 下）
+    :param phases: 窗口起点细分：序列重采样到 EMBED_FPS * phases，窗口内仍按 EMBED_FPS 取样
+    :param pad: 短序列是否补足到一个窗口
+    :return: (窗口特征 (窗口数, 维数) float32, 窗口起点（秒）, 用到的取样帧掩码 (EMBED_SAMPLES,))
+    """
+    grid_fps = EMBED_FPS * phases
+    xy = process.resample_keypoints(keypoints[..., :2], process.effective_fps(fps), grid_fps)
+    xy = process.fill_missing_joints(xy)
+
+    # 归一化后肩膀中点在原点，髋部中点到原点的距离即躯干长度
+    torso = np.linalg.norm((xy[:, 11] + xy[:, 12]) / 2, axis=-1)
+    torso = torso[torso > 0]
+    scale = float(np.median(torso)) if len(torso) else 1.0
+    xy = xy[:, EMBED_JOINTS] / scale
+
+    n = len(xy)
+    window = (EMBED_WINDOW - 1) * phases + 1
+    if n < window and pad:
+        xy = np.concatenate([xy, np.repeat(xy[-1:], window - n, axis=0)])
+        n = window
+    mask = _SAMPLE_OFFSETS * phases < n
+    offsets = _SAMPLE_OFFSETS[mask] * phases
+    last = max(n - window, 0)
+    starts = np.arange(0, last + 1, stride)
+    if starts[-1] != last:
+        starts = np.append(starts, last)
+    features = xy[starts[:, None] + offsets[None, :]].reshape(len(starts), -1)
+    return features.astype(np.float32), starts / grid_fps, mask
+
+
+def _pairwise_distances(queries, items, item_sq_norms=None):
+    """(查询数, 条目数) 欧氏距离：||q-e||^2 = ||q||^2 + ||e||^2 - 2q·e，一次矩阵乘法得到全部距离"""
+    if item_sq_norms is None:
+        item_sq_norms = (items * items).sum(axis=1)
+    sq = (queries * queries).sum(axis=1)[:, None] + item_sq_norms[None, :] - 2.0 * (queries @ items.T)
+    return np.sqrt(np.maximum(sq, 0.0))
+
+
+class PoseIndex:
+    """
+    参考动作窗口嵌入的平面最近邻索引
+
+    :param references: Reference 列表
+    :param dims: PCA 维数上限
+    """
+
+    def __init__(self, references, dims=EMBED_DIMS):
+        if not references:
+            raise ValueError("参考动作库为空")
+        self.names = [ref.name for ref in references]
+        features, owners, starts = [], [], []
+        for idx, ref in enumerate(references):
+            # 参考窗口以参考视频的每一帧为起点：用户片段从任何一帧开始都有同相位的参考窗口
+            phases = max(1, int(round(process.effective_fps(ref.fps) / EMBED_FPS)))
+            window_features, window_starts, _ = window_embeddings(
+                ref.keypoints, ref.fps, stride=1, phases=phases, pad=True)
+            features.append(window_features)
+            owners.append(np.full(len(window_features), idx))
+            starts.append(window_starts)
+        self.features = features = np.concatenate(features)
+        self.owners = np.concatenate(owners)
+        self.starts = np.concatenate(starts)
+
+        # PCA：主成分由所有参考窗口求得
+        self.mean = features.mean(axis=0)
+        _, _, vt = np.linalg.svd(features - self.mean, full_matrices=False)
+        self.components = np.ascontiguousarray(vt[:dims].T)
+        self.embeddings = self.embed(features)
+        self._sq_norms = (self.embeddings * self.embeddings).sum(axis=1)
+
+    def embed(self, features):
+        return ((features - self.mean) @ self.components).astype(np.float32)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def match(self, keypoints, fps, top=3):
+        """
+        查找用户片段最接近的参考动作及其在参考动作中的起点
+
+        每个用户窗口在每个参考动作上取最近的窗口，参考动作的得分为这些最近
+        距离的均值；起点取各用户窗口最近匹配的时间偏移的中位数。用户片段短于
+        一个窗口时只能用部分取样帧，不经过 PCA，直接与参考窗口的对应取样帧比较。
+
+        :param keypoints: (帧数, 17, 2|3) 用户的归一化关键点
+        :param fps: 用户序列帧率
+        :param top: 返回的候选数
+        :return: 按距离升序的 [{"name", "distance", "offset"（秒，参考动作中对应用户片段开头的时间）}]
+        """
+        queries, query_starts, mask = window_embeddings(keypoints, fps)
+        if mask.all():
+            distances = _pairwise_distances(self.embed(queries), self.embeddings, self._sq_norms)
+        else:
+            items = self.features.reshape(len(self.features), EMBED_SAMPLES, -1)[:, mask]
+            distances = _pairwise_distances(queries, items.reshape(len(items), -1))
+
+        candidates = []
+        for idx, name in enumerate(self.names):
+            columns = np.flatnonzero(self.owners == idx)
+            nearest = columns[np.argmin(distances[:, columns], axis=1)]
+            best = distances[np.arange(len(queries)), nearest]
+            offset = float(np.median(self.starts[nearest] - query_starts))
+            candidates.append({
+                "name": name,
+                "distance": float(best.mean()),
+                "offset": round(max(offset, 0.0), 2),
+            })
+        candidates.sort(key=lambda c: c["distance"])
+        return candidates[:top]
+
+
+class ReferenceLibrary:
+    """
+    参考动作库：目录中的只读条目，以及按需构建的最近邻索引
+
+    :param root: 库目录
+    """
+
+    def __init__(self, root=REFERENCE_DIR):
+        self.root = root
+        self._references = {}
+        self._index = None
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, name):
+        return os.path.join(self.root, f"{name}.npy"), os.path.join(self.root, f"{name}.json")
+
+    def names(self):
+        return sorted(
+            os.path.splitext(filename)[0]
+            for filename in os.listdir(self.root)
+            if filename.endswith(".json") and not filename.startswith(".")
+        )
+
+    def __contains__(self, name):
+        return bool(_NAME_PATTERN.match(name)) and os.path.exists(self._paths(name)[1])
+
+    def get(self, name):
+        """
+        :param name: 参考动作名称
+        :return: Reference，关键点为只读内存映射
+        """
+        with self._lock:
+            ref = self._references.get(name)
+            if ref is not None:
+                return ref
+        kps_path, meta_path = self._paths(name)
+        if not _NAME_PATTERN.match(name) or not os.path.exists(meta_path):
+            raise KeyError(name)
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        ref = Reference(name, process.load_keypoints(kps_path, mmap=True), meta)
+        with self._lock:
+            self._references[name] = ref
+        return ref
+
+    def references(self):
+        return [self.get(name) for name in self.names()]
+
+    def add(self, name, keypoints, fps, video=None, title=None):
+        """
+        添加参考动作；同名条目已存在时报错，不覆盖
+
+        :param name: 名称（字母、数字、下划线、连字符）
+        :param keypoints: (帧数, 17, 2|3) 归一化关键点
+        :param fps: 关键点序列的帧率
+        :param video: 对应的参考视频路径（用于渲染叠加视频），可选
+        :param title: 显示名称，可选
+        :return: Reference
+        """
+        if not _NAME_PATTERN.match(name):
+            raise ValueError(f"参考动作名称只能包含字母、数字、下划线和连字符: {name}")
+        keypoints = np.asarray(keypoints, dtype=np.float32)
+        if keypoints.ndim != 3 or keypoints.shape[1] != process.NUM_KEYPOINTS or not len(keypoints):
+            raise ValueError("参考关键点必须是 (帧数, 17, 2|3) 的非空数组")
+        if keypoints.shape[2] == 2:
+            confidence = np.isfinite(keypoints).all(axis=-1, keepdims=True).astype(np.float32)
+            keypoints = np.concatenate([keypoints, confidence], axis=-1)
+
+        kps_path, meta_path = self._paths(name)
+        with self._lock:
+            if os.path.exists(meta_path):
+                raise ValueError(f"参考动作已存在: {name}")
+            process.save_keypoints(kps_path, keypoints)
+            meta = {"fps": float(fps), "video": video, "title": title or name}
+            tmp_path = f"{meta_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            # 元数据最后写入，它出现即表示条目完整
+            os.replace(tmp_path, meta_path)
+            self._index = None
+        return self.get(name)
+
+    def add_video(self, name, video_path, title=None, **extract_kwargs):
+        """
+        从视频提取关键点并添加为参考动作
+
+        :param extract_kwargs: 传给 process.extract_video_keypoints 的参数
+        :return: Reference
+        """
+        _, fps, _ = process.get_video_info(video_path)
+        raw = process.extract_video_keypoints(video_path, **extract_kwargs)
+        return self.add(
+            name, process.normalize_keypoint_sequence(raw), process.effective_fps(fps),
+            video=video_path, title=title,
+        )
+
+    def index(self):
+        """最近邻索引（首次调用或库变化后构建）"""
+        with self._lock:
+            index = self._index
+        if index is not None and index.names == self.names():
+            return index
+        index = PoseIndex(self.references())
+        with self._lock:
+            self._index = index
+        return index
+
+    def match(self, keypoints, fps, top=3):
+        """见 PoseIndex.match"""
+        return self.index().match(keypoints, fps, top)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="参考动作库")
+    parser.add_argument("--root", default=REFERENCE_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("list", help="列出参考动作")
+
+    add_parser = subparsers.add_parser("add", help="添加参考动作")
+    add_parser.add_argument("name")
+    add_parser.add_argument("video", help="参考视频路径")
+    add_parser.add_argument("--title")
+    add_parser.add_argument("--keypoints", help="已有的归一化关键点文件，不重新提取")
+    add_parser.add_argument("--model", default=process.DEFAULT_MODEL_PATH)
+
+    match_parser = subparsers.add_parser("match", help="查找用户视频最接近的参考动作")
+    match_parser.add_argument("video")
+    match_parser.add_argument("--model", default=process.DEFAULT_MODEL_PATH)
+    match_parser.add_argument("--top", type=int, default=3)
+
+    args = parser.parse_args()
+    library = ReferenceLibrary(args.root)
+    if args.command == "list":
+        for ref in library.references():
+            info = ref.to_dict()
+            print(f"{info['name']:<20s} {info['frames']:6d} 帧 {info['fps']:6.2f} fps  {info['title']}")
+    elif args.command == "add":
+        if args.keypoints:
+            _, fps, _ = process.get_video_info(args.video)
+            ref = library.add(
+                args.name, process.load_keypoints(args.keypoints), process.effective_fps(fps),
+                video=args.video, title=args.title,
+            )
+        else:
+            ref = library.add_video(args.name, args.video, title=args.title, model_path=args.model)
+        print(f"已添加 {ref.name}: {len(ref.keypoints)} 帧")
+    elif args.command == "match":
+        _, fps, _ = process.get_video_info(args.video)
+        raw = process.extract_video_keypoints(args.video, model_path=args.model)
+        for candidate in library.match(process.normalize_keypoint_sequence(raw), fps, args.top):
+            print(f"{candidate['name']:<20s} 距离 {candidate['distance']:8.3f}  起点 {candidate['offset']:6.2f} s")
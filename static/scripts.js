@@ -2,6 +2,8 @@
 let mediaStream = null;
 let mediaRecorder;
 let recordedChunks = [];
+let recordedBytes = 0;
+let recordingUploader = null;
 let isRecording = false;
 let selectedFileName = null;
 let realtimeAnalyzer = null;
@@ -9,6 +11,8 @@ let standardKeypoints = null;
 let isRealtimeAnalyzing = false;
 let processingInterval = null;
 const TARGET_FPS = 17; // 修改为 17 FPS 以减少延迟
+const UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024; // 分块上传的块大小
+const RECORDING_FLUSH_SIZE = 1024 * 1024; // 录制中累积到该大小就先上传
 
 // 元素引用
 const videoPreview = document.getElementById('videoPreview');
@@ -35,6 +39,7 @@ async function openCamera() {
         height: { ideal: 480 },
       },
     });
+    videoPreview.controls = false;
     videoPreview.srcObject = mediaStream;
     videoPreview.play();
   } catch (error) {
@@ -67,17 +72,34 @@ async function startRecording() {
     }
 
     mediaRecorder = new MediaRecorder(mediaStream, { mimeType });
+    // 边录边传：录制结束时大部分数据已在服务端
+    recordingUploader = new ChunkedUploader(`${Date.now()}.mp4`);
+    recordedChunks = [];
+    recordedBytes = 0;
 
     mediaRecorder.ondataavailable = (event) => {
       if (event.data.size > 0) {
         recordedChunks.push(event.data);
+        recordedBytes += event.data.size;
+      }
+      if (recordedBytes >= RECORDING_FLUSH_SIZE && mediaRecorder.state === 'recording') {
+        recordingUploader.append(new Blob(recordedChunks, { type: mimeType })).catch(() => {});
+        recordedChunks = [];
+        recordedBytes = 0;
       }
     };
 
     mediaRecorder.onstop = async () => {
+      const uploader = recordingUploader;
       const blob = new Blob(recordedChunks, { type: mimeType });
-      await sendVideoToServer(blob);
       recordedChunks = [];
+      recordedBytes = 0;
+      try {
+        const result = await uploader.append(blob, true);
+        await finishUpload(result, '视频已成功保存！');
+      } catch (error) {
+        alert(error.message);
+      }
     };
 
     mediaRecorder.start(200);
@@ -96,27 +118,64 @@ function stopRecording() {
   }
 }
 
-async function sendVideoToServer(blob) {
-  try {
-    const filename = `${Date.now()}.mp4`;
-    const file = new File([blob], filename, { type: 'video/mp4' });
+// 分块上传：按顺序发送，每块带上在文件中的偏移量，服务端边收边写盘
+class ChunkedUploader {
+  constructor(filename) {
+    this.filename = filename;
+    this.uploadId = null; // 服务端在第一块的响应中分配
+    this.offset = 0;
+    this.queue = Promise.resolve();
+  }
 
-    const formData = new FormData();
-    formData.append('video', file);
+  append(blob, final = false) {
+    this.queue = this.queue.then(() => this.send(blob, final));
+    return this.queue;
+  }
 
-    const response = await fetch('/upload', {
+  async send(blob, final) {
+    const params = new URLSearchParams({
+      filename: this.filename,
+      offset: this.offset,
+      final: final ? '1' : '0',
+    });
+    if (this.uploadId) {
+      params.set('upload_id', this.uploadId);
+    }
+    const response = await fetch(`/upload_stream?${params}`, {
       method: 'POST',
-      body: formData,
+      headers: { 'Content-Type': 'application/octet-stream' },
+      body: blob,
     });
+    const result = await response.json();
+    if (!response.ok) {
+      throw new Error(result.error || '上传失败');
+    }
+    this.uploadId = result.upload_id || this.uploadId;
+    this.offset += blob.size;
+    return result;
+  }
+}
 
-    if (response.ok) {
-      alert('视频已成功保存！');
-      loadFileList();
-    } else {
-      throw new Error(`上传失败：${response.statusText}`);
+// 上传完成后等待服务端转码，再刷新文件列表
+async function finishUpload(result, message) {
+  const processingAlert = document.getElementById('processingAlert');
+  try {
+    // 服务端可能改名（重名时加序号、转码为 .mp4），以返回的文件名为准
+    let filename = result.filename;
+    if (result.transcode_job) {
+      processingAlert.textContent = '正在转码视频...';
+      processingAlert.style.display = 'block';
+      const job = await waitForJob(result.transcode_job, processingAlert);
+      if (job.status === 'error') {
+        throw new Error(job.error || '转码失败');
+      }
+      filename = job.result.filename;
     }
-  } catch (error) {
-    alert(error.message);
+    selectedFileName = filename;
+    alert(message);
+    loadFileList();
+  } finally {
+    processingAlert.style.display = 'none';
   }
 }
 
@@ -129,22 +188,16 @@ function uploadVideo() {
     const file = e.target.files[0];
     if (!file) return;
 
-    const formData = new FormData();
-    formData.append('video', file);
-
     try {
-      const response = await fetch('/upload', {
-        method: 'POST',
-        body: formData,
-      });
-
-      if (response.ok) {
-        alert('上传成功！');
-        loadFileList();
-      } else {
-        const error = await response.json();
-        throw new Error(error.error || '上传失败');
-      }
+      const uploader = new ChunkedUploader(file.name);
+      let result = null;
+      let start = 0;
+      do {
+        const end = Math.min(start + UPLOAD_CHUNK_SIZE, file.size);
+        result = await uploader.append(file.slice(start, end), end >= file.size);
+        start = end;
+      } while (start < file.size);
+      await finishUpload(result, '上传成功！');
     } catch (error) {
       alert(error.message);
     }
@@ -166,12 +219,16 @@ function loadFileList() {
       uploadList.innerHTML = files
         .map(
           (file) =>
-            `<div class="file-item" onclick="selectFile('${file.name.replace(/'/g, "\\'")}')">
+            `<div class="file-item${file.name === selectedFileName ? ' selected' : ''}" onclick="selectFile('${file.name.replace(/'/g, "\\'")}')">
                     ${file.name}
                     <button onclick="downloadFile('${file.name.replace(
                       /'/g,
                       "\\'",
                     )}')">下载</button>
+                    <button onclick="event.stopPropagation(); playResult('${file.name.replace(
+                      /'/g,
+                      "\\'",
+                    )}')">播放</button>
                 </div>`,
         )
         .join('');
@@ -182,6 +239,15 @@ function downloadFile(filename) {
   window.open(`/download/${filename}`, '_blank');
 }
 
+// 在预览区直接播放结果视频（服务端支持 Range 请求，无需下载完整文件）
+function playResult(filename) {
+  closeCamera();
+  videoPreview.srcObject = null;
+  videoPreview.src = `/results/${encodeURIComponent(filename)}`;
+  videoPreview.controls = true;
+  videoPreview.play();
+}
+
 function selectFile(filename) {
   selectedFileName = filename;
   document.querySelectorAll('.file-item').forEach((item) => {
@@ -190,6 +256,16 @@ function selectFile(filename) {
   event.currentTarget.classList.add('selected');
 }
 
+const JOB_POLL_INTERVAL = 1000; // 分析任务轮询间隔（毫秒）
+const STAGE_NAMES = {
+  extract: '提取骨骼关键点',
+  align: '动作对齐',
+  score: '计算相似度',
+  render: '生成叠加视频',
+  transcode: '转码视频',
+  match: '匹配参考动作',
+};
+
 async function analyzeVideo() {
   if (!selectedFileName) {
     alert('请先选择要分析的视频');
@@ -198,11 +274,11 @@ async function analyzeVideo() {
 
   const processingAlert = document.getElementById('processingAlert');
   try {
-    processingAlert.textContent = '正在分析视频...';
+    processingAlert.textContent = '正在提交分析任务...';
     processingAlert.style.display = 'block';
     document.getElementById('analyzeVideo').disabled = true;
 
-    const response = await fetch('/analyze', {
+    let response = await fetch('/analyze', {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
@@ -212,12 +288,34 @@ async function analyzeVideo() {
       }),
     });
 
-    const result = await response.json();
-    if (response.ok) {
+    let submitted = await response.json();
+    if (response.status === 409 && submitted.transcode_job) {
+      // 视频仍在转码：等待完成后用转码后的文件重新提交
+      const transcode = await waitForJob(submitted.transcode_job, processingAlert);
+      if (transcode.status !== 'done') {
+        throw new Error(transcode.error || '转码失败');
+      }
+      selectedFileName = transcode.result.filename;
+      response = await fetch('/analyze', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: selectedFileName }),
+      });
+      submitted = await response.json();
+    }
+    if (!response.ok) {
+      throw new Error(submitted.error || '分析失败');
+    }
+
+    const job = await waitForJob(submitted.job_id, processingAlert);
+    if (job.status === 'done') {
       alert('分析完成！结果视频已生成');
       loadFileList();
+      if (job.result && job.result.overlay) {
+        playResult(job.result.overlay);
+      }
     } else {
-      throw new Error(result.error || '分析失败');
+      throw new Error(job.error || '分析失败');
     }
   } catch (error) {
     alert(error.message);
@@ -227,17 +325,170 @@ async function analyzeVideo() {
   }
 }
 
+// 轮询任务状态直到结束，同时刷新进度提示
+async function waitForJob(jobId, processingAlert) {
+  while (true) {
+    const response = await fetch(`/jobs/${jobId}`);
+    const job = await response.json();
+    if (!response.ok) {
+      throw new Error(job.error || '任务查询失败');
+    }
+    if (job.status === 'done' || job.status === 'error') {
+      return job;
+    }
+
+    let text = job.status === 'queued' ? '排队中...' : '正在分析视频...';
+    if (job.stage) {
+      text = `正在${STAGE_NAMES[job.stage] || job.stage}`;
+      if (job.total) {
+        text += ` ${job.done}/${job.total}`;
+      }
+      if (job.eta !== null) {
+        text += `，预计剩余 ${Math.ceil(job.eta)} 秒`;
+      }
+    }
+    processingAlert.textContent = text;
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+  }
+}
+
+// COCO 17点骨骼连接
+const SKELETON = [
+  [0, 1], [0, 2], [1, 3], [2, 4],
+  [5, 6], [5, 7], [7, 9], [6, 8],
+  [8, 10], [11, 12], [5, 11], [6, 12],
+  [11, 13], [13, 15], [12, 14], [14, 16],
+];
+const MIN_KEYPOINT_CONF = 0.3; // 低于该置信度的关键点不绘制
+
+let realtimeSocket = null;
+let frameInFlight = false;
+let realtimeSessionId = null; // HTTP 回退时的服务端会话ID
+
+// 在叠加画布上绘制服务端返回的骨骼和相似度
+function drawRealtimeResult(result) {
+  const overlayCanvas = document.getElementById('overlayCanvas');
+  const ctx = overlayCanvas.getContext('2d');
+  if (overlayCanvas.width !== result.w || overlayCanvas.height !== result.h) {
+    overlayCanvas.width = result.w;
+    overlayCanvas.height = result.h;
+  }
+  ctx.clearRect(0, 0, overlayCanvas.width, overlayCanvas.height);
+
+  if (result.kp) {
+    const visible = result.kp.map(([x, y, c]) => c >= MIN_KEYPOINT_CONF && (x !== 0 || y !== 0));
+    ctx.strokeStyle = '#00ff00';
+    ctx.fillStyle = '#00ff00';
+    ctx.lineWidth = 2;
+    for (const [start, end] of SKELETON) {
+      if (!visible[start] || !visible[end]) continue;
+      ctx.beginPath();
+      ctx.moveTo(result.kp[start][0], result.kp[start][1]);
+      ctx.lineTo(result.kp[end][0], result.kp[end][1]);
+      ctx.stroke();
+    }
+    result.kp.forEach(([x, y], idx) => {
+      if (!visible[idx]) return;
+      ctx.beginPath();
+      ctx.arc(x, y, 5, 0, 2 * Math.PI);
+      ctx.fill();
+    });
+  }
+
+  const text = !result.kp
+    ? 'No pose detected'
+    : result.valid
+      ? `Similarity: ${result.score.toFixed(1)}%`
+      : 'Invalid Pose';
+  ctx.font = '24px sans-serif';
+  const textWidth = ctx.measureText(text).width;
+  const textX = overlayCanvas.width - textWidth - 20;
+  ctx.fillStyle = '#000';
+  ctx.fillRect(textX - 10, 18, textWidth + 20, 42);
+  ctx.fillStyle = result.kp ? '#00ff00' : '#ff0000';
+  ctx.fillText(text, textX, 48);
+}
+
+function handleRealtimeResult(result) {
+  frameInFlight = false;
+  if (result.error) {
+    console.error('Frame processing error:', result.error);
+    return;
+  }
+  if (result.session) realtimeSessionId = result.session;
+  document.getElementById('loadingIndicator').style.display = 'none';
+  drawRealtimeResult(result);
+}
+
+// 建立 WebSocket 连接，失败时返回 null 由调用方回退到 HTTP
+function openRealtimeSocket() {
+  return new Promise((resolve) => {
+    if (!('WebSocket' in window)) {
+      resolve(null);
+      return;
+    }
+    const protocol = location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${location.host}/ws/realtime`);
+    socket.binaryType = 'arraybuffer';
+    socket.onopen = () => resolve(socket);
+    socket.onerror = () => resolve(null);
+    socket.onmessage = (event) => handleRealtimeResult(JSON.parse(event.data));
+    socket.onclose = () => {
+      frameInFlight = false;
+      if (realtimeSocket === socket) realtimeSocket = null;
+    };
+  });
+}
+
+// 发送一帧原始JPEG；上一帧结果未返回时直接跳过，避免积压过期帧
+function sendRealtimeFrame(canvas, ctx) {
+  if (frameInFlight) return;
+  frameInFlight = true;
+  ctx.drawImage(videoPreview, 0, 0);
+  canvas.toBlob(
+    async (blob) => {
+      try {
+        if (!blob || !isRealtimeAnalyzing) {
+          frameInFlight = false;
+          return;
+        }
+        if (realtimeSocket && realtimeSocket.readyState === WebSocket.OPEN) {
+          realtimeSocket.send(await blob.arrayBuffer());
+          return;
+        }
+        const headers = { 'Content-Type': 'image/jpeg' };
+        if (realtimeSessionId) headers['X-Session-Id'] = realtimeSessionId;
+        const response = await fetch('/process_frame_bin', {
+          method: 'POST',
+          headers,
+          body: blob,
+        });
+        handleRealtimeResult(await response.json());
+      } catch (error) {
+        frameInFlight = false;
+        console.error('Frame processing error:', error);
+      }
+    },
+    'image/jpeg',
+    0.5, // 降低质量到 0.5 以减少数据量
+  );
+}
+
 // 修改后的实时分析函数
 async function realtimeAnalyze() {
   const analyzeBtn = document.getElementById('realtimeAnalyze');
   const videoPreview = document.getElementById('videoPreview');
-  const processedFeed = document.getElementById('processedFeed');
+  const overlayCanvas = document.getElementById('overlayCanvas');
   const loadingIndicator = document.getElementById('loadingIndicator');
 
   if (isRealtimeAnalyzing) {
     clearInterval(processingInterval);
     loadingIndicator.style.display = 'none';
-    processedFeed.style.display = 'none';
+    overlayCanvas.getContext('2d').clearRect(0, 0, overlayCanvas.width, overlayCanvas.height);
+    if (realtimeSocket) {
+      realtimeSocket.close();
+      realtimeSocket = null;
+    }
     closeCamera();
     analyzeBtn.textContent = '实时分析';
     isRealtimeAnalyzing = false;
@@ -258,33 +509,15 @@ async function realtimeAnalyze() {
 
   // 显示弹出式加载提示
   loadingIndicator.style.display = 'block';
-  processedFeed.style.display = 'none';
-
-  // 设置处理帧率（15 FPS）
-  const intervalTime = 1000 / TARGET_FPS;
 
-  processingInterval = setInterval(async () => {
-    try {
-      ctx.drawImage(videoPreview, 0, 0);
-      const imageData = canvas.toDataURL('image/jpeg', 0.5); // 降低质量到 0.5 以减少数据量
-      const response = await fetch('/process_frame', {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ image: imageData }),
-      });
+  realtimeSocket = await openRealtimeSocket();
+  frameInFlight = false;
+  realtimeSessionId = null;
+  isRealtimeAnalyzing = true;
 
-      if (response.ok) {
-        const result = await response.json();
-        processedFeed.src = `data:image/jpeg;base64,${result.processed}`;
-        // 隐藏加载提示，显示处理后的画面
-        loadingIndicator.style.display = 'none';
-        processedFeed.style.display = 'block';
-      }
-    } catch (error) {
-      console.error('Frame processing error:', error);
-    }
-  }, intervalTime);
+  // 按目标帧率采样，结果未返回的帧会被跳过
+  const intervalTime = 1000 / TARGET_FPS;
+  processingInterval = setInterval(() => sendRealtimeFrame(canvas, ctx), intervalTime);
 
   analyzeBtn.textContent = '停止分析';
-  isRealtimeAnalyzing = true;
 }
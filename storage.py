@@ -0,0 +1,230 @@
+"""
+分析产物的存储管理
+
+每个分析任务在 work 目录下有自己的工作目录，任务先在以 . 开头的临时目录中
+生成全部产物，完成后整体重命名为按输入内容寻址的最终目录；多个进程同时完成
+同一任务时只保留先完成的一份。
+
+后台清理线程按最近使用时间（mtime）清理超过保留期限的上传文件和任务目录，
+总大小超过配额时从最旧的开始淘汰。
+"""
+import itertools
+import os
+import shutil
+import threading
+import time
+
+import metrics
+
+
+def publish(src_path, dst_path):
+    """
+    把已完成的文件原子地发布到 dst_path（优先硬链接，跨文件系统时复制）
+
+    读者只会看到旧文件或完整的新文件。
+    """
+    tmp_path = os.path.join(
+        os.path.dirname(dst_path) or ".",
+        f".{os.path.basename(dst_path)}.{os.getpid()}.{threading.get_ident()}.tmp",
+    )
+    try:
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def move_unique(src_path, directory, filename):
+    """
+    把文件移动到 directory 下，不覆盖已有文件
+
+    同名文件已存在时在主干后加 _1、_2 等序号。先以独占方式创建空文件占住名字再
+    替换，并发移动同名文件时各自得到不同的名字。
+
+    :return: 最终文件名
+    """
+    stem, ext = os.path.splitext(filename)
+    for i in itertools.count():
+        name = f"{stem}_{i}{ext}" if i else filename
+        path = os.path.join(directory, name)
+        try:
+            with open(path, "xb"):
+                pass
+        except FileExistsError:
+            continue
+        try:
+            os.replace(src_path, path)
+        except OSError:
+            os.remove(path)
+            raise
+        return name
+
+
+def finalize_dir(staging_dir, final_dir):
+    """
+    把临时工作目录重命名为最终目录
+
+    :return: 是否由本次调用完成；最终目录已存在（其他任务已完成）时丢弃临时目录并返回 False
+    """
+    try:
+        os.rename(staging_dir, final_dir)
+        return True
+    except OSError:
+        if not os.path.isdir(final_dir):
+            raise
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        return False
+
+
+def touch(path):
+    """更新最近使用时间，使条目在淘汰顺序中靠后"""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _entry_files(path):
+    """
+    条目（文件或目录）包含的文件
+
+    :return: {(st_dev, st_ino): 大小}，同一文件的多个硬链接只出现一次
+    """
+    if not os.path.isdir(path):
+        st = os.stat(path)
+        return {(st.st_dev, st.st_ino): st.st_size}
+    files = {}
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                st = os.stat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            files[(st.st_dev, st.st_ino)] = st.st_size
+    return files
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class Janitor:
+    """
+    按保留期限和磁盘配额清理若干目录中的顶层条目（文件或目录）
+
+    以 . 开头的条目和 ttl_only 目录中的条目（如未完成的分块上传）只在超过保留
+    期限后清理，不参与配额淘汰。本身也是清理根目录的子目录会被跳过（由其自己的
+    规则处理）。大小按 inode 统计：publish 产生的硬链接只计一次，删除仍被其他
+    条目引用的文件不计入释放的空间。
+
+    :param roots: 要管理的目录列表
+    :param max_bytes: 所有目录的总大小上限
+    :param ttl: 条目最后修改后的保留时间（秒）
+    :param interval: 后台清理的间隔（秒）
+    :param protect: 无参函数，返回当前不能删除的路径集合（如正在分析的上传文件）
+    :param ttl_only: roots 中只按保留期限清理的目录
+    """
+
+    def __init__(self, roots, max_bytes, ttl, interval=600, protect=None, ttl_only=()):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.ttl_only = {os.path.abspath(root) for root in ttl_only}
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.interval = interval
+        self.protect = protect
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _entries(self):
+        entries = []
+        for root in self.roots:
+            if not os.path.isdir(root):
+                continue
+            for name in os.listdir(root):
+                path = os.path.join(root, name)
+                if path in self.roots:
+                    continue
+                try:
+                    mtime = os.stat(path).st_mtime
+                    files = _entry_files(path)
+                except OSError:
+                    continue
+                evictable = not name.startswith(".") and root not in self.ttl_only
+                entries.append((mtime, path, files, evictable))
+        return entries
+
+    def sweep(self):
+        """
+        执行一次清理
+
+        :return: {"removed": 删除的条目数, "bytes": 释放的字节数, "total": 清理后的总大小}
+        """
+        protected = {os.path.abspath(path) for path in (self.protect() if self.protect else ())}
+        now = time.time()
+        entries = sorted(self._entries(), key=lambda entry: (entry[0], entry[1]))
+
+        # 每个 inode 被多少个条目引用，删除条目时只有引用数归零的文件才真正释放空间
+        refs = {}
+        sizes = {}
+        for _, _, files, _ in entries:
+            for inode, size in files.items():
+                refs[inode] = refs.get(inode, 0) + 1
+                sizes[inode] = size
+        total = sum(sizes.values())
+        removed = 0
+        freed = 0
+
+        def evict(path, files, reason):
+            nonlocal removed, freed, total
+            _remove(path)
+            removed += 1
+            for inode in files:
+                refs[inode] -= 1
+                if refs[inode] == 0:
+                    freed += sizes[inode]
+                    total -= sizes[inode]
+            metrics.inc("pose_storage_evictions_total", reason=reason)
+
+        kept = []
+        for mtime, path, files, evictable in entries:
+            if path not in protected and now - mtime > self.ttl:
+                evict(path, files, "ttl")
+            else:
+                kept.append((path, files, evictable))
+
+        for path, files, evictable in kept:
+            if total <= self.max_bytes:
+                break
+            if evictable and path not in protected:
+                evict(path, files, "quota")
+        metrics.set_gauge("pose_storage_bytes", total)
+        return {"removed": removed, "bytes": freed, "total": total}
+
+    def start(self):
+        """启动后台清理线程（启动时先清理一次）"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:  # 清理失败不影响服务，下个周期重试
+                print(f"存储清理失败: {e}")
+            if self._stop.wait(self.interval):
+                return
@@ -0,0 +1,170 @@
+import cv2
+import numpy as np
+import pytest
+
+import process
+
+FRAMES = 40
+
+
+def frame_index(frame):
+    """测试视频左上角色块的亮度编码帧序号"""
+    return int(round(frame[4:28, 4:28].mean() / 4))
+
+
+@pytest.fixture
+def video(tmp_path):
+    """背景不变、只有角落小色块变化的视频：运动量低于关键帧阈值"""
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30, (160, 160))
+    for i in range(FRAMES):
+        frame = np.full((160, 160, 3), 100, np.uint8)
+        frame[:32, :32] = i * 4
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def pose(index):
+    """非线性运动：中点插值误差总是超出预算，跳过的帧都要二分探测"""
+    kps = np.zeros((process.NUM_KEYPOINTS, 3), dtype=np.float32)
+    kps[:, 0] = 80 + 40 * np.sin(index) + np.arange(process.NUM_KEYPOINTS)
+    kps[:, 1] = 80 + 40 * np.cos(index)
+    kps[:, 2] = 1.0
+    return kps
+
+
+class Tensor:
+    """只实现姿态结果解析用到的 torch.Tensor 接口"""
+
+    def __init__(self, array):
+        self.array = np.asarray(array, dtype=np.float32)
+        self.shape = self.array.shape
+
+    def __getitem__(self, index):
+        return Tensor(self.array[index])
+
+    def __len__(self):
+        return len(self.array)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+
+class Result:
+    def __init__(self, people):
+        kps = np.stack(people)
+        self.keypoints = type("Keypoints", (), {"xy": Tensor(kps[..., :2]), "conf": Tensor(kps[..., 2])})()
+        xy = kps[..., :2]
+        self.boxes = Tensor(np.concatenate([xy.min(axis=1), xy.max(axis=1)], axis=1))
+        self.boxes.xyxy = self.boxes
+        self.boxes.id = None
+
+
+class StubModel:
+    """两个人：走动的人（按帧序号线性移动、框更大）和静止的人"""
+
+    def __init__(self):
+        self.frames = 0
+
+    def __call__(self, frames, verbose=False, **kwargs):
+        batch = frames if isinstance(frames, list) else [frames]
+        self.frames += len(batch)
+        return [Result([linear_pose(frame_index(f)), still_pose()]) for f in batch]
+
+
+def linear_pose(index):
+    kps = np.zeros((process.NUM_KEYPOINTS, 3), dtype=np.float32)
+    kps[:, 0] = 20 + 1.5 * index + 4 * np.arange(process.NUM_KEYPOINTS)
+    kps[:, 1] = 30 + 0.5 * index + 6 * np.arange(process.NUM_KEYPOINTS)
+    kps[:, 2] = 0.9
+    return kps
+
+
+def still_pose():
+    kps = np.zeros((process.NUM_KEYPOINTS, 3), dtype=np.float32)
+    kps[:, 0] = 120 + np.arange(process.NUM_KEYPOINTS)
+    kps[:, 1] = 20 + np.arange(process.NUM_KEYPOINTS)
+    kps[:, 2] = 0.8
+    return kps
+
+
+def dense_keypoints(video, model):
+    """逐帧（按批）推理的常规提取"""
+    selector = process.PersonSelector()
+    return np.stack([
+        process.extract_keypoints(result, selector)
+        for _, _, result in process.iter_pose_batches(model, {"video": video}, batch_size=4)
+    ])
+
+
+def test_max_gap_one_equals_dense_extraction(video):
+    model = StubModel()
+    kps, inferred = process.extract_keypoints_adaptive(video, model, max_gap=1)
+    assert inferred == model.frames == FRAMES
+    np.testing.assert_array_equal(kps, dense_keypoints(video, StubModel()))
+
+
+def test_linear_motion_is_interpolated(video):
+    model = StubModel()
+    kps, inferred = process.extract_keypoints_adaptive(video, model, max_gap=6)
+    assert inferred == model.frames < FRAMES
+    np.testing.assert_allclose(kps, dense_keypoints(video, StubModel()), atol=1e-3)
+
+
+class SpyTracker(process.RoiTracker):
+    """记录每次推理时的跨帧状态；区域字段保存上一次推理的帧序号"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def detect(self, frame, model):
+        index = frame_index(frame)
+        self.calls.append((index, self.roi))
+        self.roi = index
+        return pose(index)
+
+
+def test_probes_start_from_previous_keyframe_state(video):
+    tracker = SpyTracker()
+    kps, inferred = process.extract_keypoints_adaptive(video, None, max_gap=6, tracker=tracker)
+    assert inferred == FRAMES == len(kps)
+    order = [index for index, _ in tracker.calls]
+    assert order != sorted(order)  # 探测不按时间顺序
+    # 每次推理看到的状态都来自更早的帧
+    for index, previous in tracker.calls:
+        assert previous is None or previous < index
+    # 探测结束后恢复为最后一个关键帧的状态
+    assert tracker.roi == FRAMES - 1
+    np.testing.assert_allclose(kps, np.stack([pose(i) for i in range(FRAMES)]))
+
+
+def square_pose(center, size):
+    kps = np.zeros((process.NUM_KEYPOINTS, 3), dtype=np.float32)
+    kps[:, :2] = center + size * np.linspace(-0.5, 0.5, process.NUM_KEYPOINTS)[:, None]
+    kps[:, 2] = 0.9
+    return kps
+
+
+class ShrinkingModel(StubModel):
+    """走远的人（框逐渐变小，后半段比静止的人小）和静止的人"""
+
+    def __call__(self, frames, verbose=False, **kwargs):
+        batch = frames if isinstance(frames, list) else [frames]
+        return [
+            Result([square_pose(50, 60 - 1.2 * frame_index(f)), square_pose(120, 40)]) for f in batch
+        ]
+
+
+def test_chunked_extraction_keeps_person_across_chunks(video, monkeypatch):
+    monkeypatch.setattr(process, "_worker_model", ShrinkingModel())
+    ranges = process.split_frame_ranges(FRAMES, 2)
+    people = [frame for start, stop in ranges for frame in process._extract_chunk(video, start, stop, 4)[1]]
+    kps = process.select_people(people)
+    np.testing.assert_array_equal(kps, dense_keypoints(video, ShrinkingModel()))
+    # 第二个区间开头静止的人更大，但仍跟着同一个人
+    assert kps[-1, 0, 0] < 100
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+import process
+
+
+def brute_force_dtw(seq1, seq2, cost):
+    """逐格递推的完整DTW，返回最小总代价"""
+    n1, n2 = len(seq1), len(seq2)
+    acc = np.full((n1 + 1, n2 + 1), np.inf)
+    acc[0, 0] = 0.0
+    for i in range(n1):
+        for j in range(n2):
+            acc[i + 1, j + 1] = cost(seq1[i], seq2[j]) + min(acc[i, j], acc[i, j + 1], acc[i + 1, j])
+    return acc[n1, n2]
+
+
+WEIGHTS = np.linspace(0.1, 1.0, process.NUM_KEYPOINTS)
+COSTS = {
+    "euclidean": lambda a, b: np.sqrt(((a.astype(np.float64) - b) ** 2).sum()),
+    "sqeuclidean": lambda a, b: ((a.astype(np.float64) - b) ** 2).sum(),
+    "weighted": lambda a, b: np.sqrt(((a.astype(np.float64) - b) ** 2).sum(axis=-1)) @ WEIGHTS,
+}
+
+
+def sequences(n1, n2, seed=0):
+    rng = np.random.default_rng(seed)
+    walk = lambda n: np.cumsum(rng.normal(0, 5, (n, process.NUM_KEYPOINTS, 2)), axis=0).astype(np.float32)
+    return walk(n1), walk(n2)
+
+
+def path_cost(seq1, seq2, path_i, path_j, cost):
+    return sum(cost(seq1[i], seq2[j]) for i, j in zip(path_i, path_j))
+
+
+def check_path(path_i, path_j, n1, n2):
+    assert (path_i[0], path_j[0]) == (0, 0)
+    assert (path_i[-1], path_j[-1]) == (n1 - 1, n2 - 1)
+    steps = np.stack([np.diff(path_i), np.diff(path_j)], axis=1)
+    assert {tuple(step) for step in steps} <= {(1, 1), (1, 0), (0, 1)}
+
+
+@pytest.mark.parametrize("distance", process.DTW_DISTANCES)
+@pytest.mark.parametrize("n1, n2", [(1, 1), (1, 7), (9, 1), (13, 21), (24, 17)])
+def test_exact_matches_brute_force(distance, n1, n2):
+    seq1, seq2 = sequences(n1, n2)
+    cost = COSTS[distance]
+    total, path_i, path_j = process.dtw_align(seq1, seq2, mode="exact", distance=distance, weights=WEIGHTS)
+    assert total == pytest.approx(brute_force_dtw(seq1, seq2, cost), rel=1e-7)
+    check_path(path_i, path_j, n1, n2)
+    assert path_cost(seq1, seq2, path_i, path_j, cost) == pytest.approx(total, rel=1e-7)
+
+
+@pytest.mark.parametrize("mode, kwargs", [("band", {"band": 3}), ("multiscale", {"radius": 1})])
+def test_windowed_modes_are_feasible_upper_bounds(mode, kwargs):
+    seq1, seq2 = sequences(40, 55, seed=1)
+    exact = brute_force_dtw(seq1, seq2, COSTS["euclidean"])
+    total, path_i, path_j = process.dtw_align(seq1, seq2, mode=mode, **kwargs)
+    check_path(path_i, path_j, len(seq1), len(seq2))
+    assert path_cost(seq1, seq2, path_i, path_j, COSTS["euclidean"]) == pytest.approx(total, rel=1e-7)
+    assert total >= exact - 1e-6
+    if mode == "band":
+        centers = path_i * (len(seq2) - 1) / (len(seq1) - 1)
+        assert (np.abs(path_j - centers) <= kwargs["band"] + 1).all()
+
+
+@pytest.mark.parametrize("mode, kwargs", [("band", {"band": 60}), ("multiscale", {"radius": 60})])
+def test_unconstrained_windows_are_exact(mode, kwargs):
+    seq1, seq2 = sequences(30, 45, seed=2)
+    total, _, _ = process.dtw_align(seq1, seq2, mode=mode, **kwargs)
+    assert total == pytest.approx(brute_force_dtw(seq1, seq2, COSTS["euclidean"]), rel=1e-7)
+
+
+@pytest.mark.parametrize("mode", process.DTW_MODES)
+def test_small_cost_blocks_give_same_path(monkeypatch, mode):
+    seq1, seq2 = sequences(50, 64, seed=3)
+    expected = process.dtw_align(seq1, seq2, mode=mode, radius=2)
+    # 每块只容纳很少的格子，强制逐行分块
+    monkeypatch.setattr(process, "_DTW_BLOCK_ELEMENTS", 64)
+    total, path_i, path_j = process.dtw_align(seq1, seq2, mode=mode, radius=2)
+    assert total == pytest.approx(expected[0], rel=1e-12)
+    np.testing.assert_array_equal(path_i, expected[1])
+    np.testing.assert_array_equal(path_j, expected[2])
+
+
+def test_row_step_matches_loop():
+    rng = np.random.default_rng(4)
+    best = rng.uniform(0, 10, 30)
+    costs = rng.uniform(0, 3, 30)
+    expected = np.empty(30)
+    left = np.inf
+    for j in range(30):
+        left = expected[j] = costs[j] + min(best[j], left)
+    np.testing.assert_allclose(process.dtw_row_step(best, costs), expected)
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+
+import process
+
+STANDARD_KEYPOINTS = os.path.join(os.path.dirname(__file__), "..", "keypoints", "aligned1.json")
+
+
+def frame(**joints):
+    """17个关节排成一列，坐标都在第一象限附近；joints 覆盖指定关节"""
+    points = [[float(i), float(i) + 1.0] for i in range(process.NUM_KEYPOINTS)]
+    for index, point in joints.items():
+        points[int(index[1:])] = point
+    return points
+
+
+def test_repeated_corner_artefacts_are_missing():
+    kps = process.load_keypoints(STANDARD_KEYPOINTS)
+    # aligned1.json 每帧有5个未检出的关节落在 (0,0) 减肩膀中点处
+    assert (np.isnan(kps[..., 0]).sum(axis=1) == 5).all()
+    assert (kps[..., 2] == np.isfinite(kps[..., 0])).all()
+
+
+def test_single_corner_joint_is_kept():
+    # 左手（9号）举过头顶、在画面最左侧：唯一的左上角极值
+    frames = [frame(j9=[-40.0, -80.0]), frame(j9=[-42.0, -81.0])]
+    kps = process._keypoints_from_json(frames)
+    assert np.isfinite(kps).all()
+    assert (kps[..., 2] == 1).all()
+
+
+def test_corner_repeated_across_frames_is_missing():
+    frames = [frame(j3=[-50.0, -90.0]), frame(j4=[-50.0, -90.0]), frame(j9=[-10.0, -20.0])]
+    kps = process._keypoints_from_json(frames)
+    assert np.isnan(kps[0, 3, :2]).all() and kps[0, 3, 2] == 0
+    assert np.isnan(kps[1, 4, :2]).all()
+    assert np.isfinite(kps[2]).all()
+
+
+def test_corner_repeated_within_frame_is_missing():
+    kps = process._keypoints_from_json([frame(j1=[-5.0, -6.0], j2=[-5.0, -6.0])])
+    assert np.isnan(kps[0, [1, 2], :2]).all()
+    assert np.isfinite(kps[0, 3:]).all()
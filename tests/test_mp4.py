@@ -0,0 +1,104 @@
+import struct
+
+import cv2
+import numpy as np
+import pytest
+
+import mp4
+
+
+def box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def top_level(path):
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        size = f.tell()
+        return [b[0] for b in mp4._read_boxes(f, 0, size)]
+
+
+def decode(path):
+    frames = []
+    cap = cv2.VideoCapture(path)
+    while True:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / "clip.mp4")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (96, 64))
+    rng = np.random.default_rng(0)
+    for _ in range(30):
+        writer.write(rng.integers(0, 255, (64, 96, 3), dtype=np.uint8))
+    writer.release()
+    return path
+
+
+def test_faststart_keeps_frames_and_is_idempotent(video):
+    # OpenCV 把 moov 写在文件末尾
+    assert top_level(video).index(b"moov") > top_level(video).index(b"mdat")
+    before = decode(video)
+
+    assert mp4.faststart(video)
+    assert top_level(video).index(b"moov") < top_level(video).index(b"mdat")
+    after = decode(video)
+    assert len(after) == len(before) == 30
+    for a, b in zip(before, after):
+        np.testing.assert_array_equal(a, b)
+
+    with open(video, "rb") as f:
+        data = f.read()
+    assert not mp4.faststart(video)
+    with open(video, "rb") as f:
+        assert f.read() == data
+
+
+def synthetic(path, table):
+    """ftyp + mdat（三个块）+ moov，moov 中的块偏移表指向 mdat 中的各块"""
+    chunks = [b"first-chunk", b"second", b"third-chunk-data"]
+    ftyp = box(b"ftyp", b"isom\0\0\0\0isom")
+    offsets, position = [], len(ftyp) + 8
+    for chunk in chunks:
+        offsets.append(position)
+        position += len(chunk)
+    mdat = box(b"mdat", b"".join(chunks))
+    fmt = ">I" if table == b"stco" else ">Q"
+    table_box = box(table, struct.pack(">II", 0, len(offsets)) + b"".join(struct.pack(fmt, o) for o in offsets))
+    stbl = box(b"stbl", table_box)
+    moov = box(b"moov", box(b"trak", box(b"mdia", box(b"minf", stbl))))
+    with open(path, "wb") as f:
+        f.write(ftyp + mdat + moov)
+    return chunks, fmt
+
+
+def read_offsets(path, table, fmt):
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = data.index(table) + 4
+    count = struct.unpack_from(">I", data, pos + 4)[0]
+    width = struct.calcsize(fmt)
+    return data, [struct.unpack_from(fmt, data, pos + 8 + i * width)[0] for i in range(count)]
+
+
+@pytest.mark.parametrize("table", [b"stco", b"co64"])
+def test_chunk_offsets_are_patched(tmp_path, table):
+    path = str(tmp_path / "synthetic.mp4")
+    chunks, fmt = synthetic(path, table)
+    assert mp4.faststart(path)
+    assert top_level(path) == [b"ftyp", b"moov", b"mdat"]
+    data, offsets = read_offsets(path, table, fmt)
+    assert [data[o:o + len(c)] for o, c in zip(offsets, chunks)] == chunks
+
+
+def test_files_without_moov_are_left_alone(tmp_path):
+    path = str(tmp_path / "raw.mp4")
+    with open(path, "wb") as f:
+        f.write(box(b"ftyp", b"isom\0\0\0\0") + box(b"mdat", b"data"))
+    assert not mp4.faststart(path)
@@ -0,0 +1,73 @@
+import threading
+import time
+
+import numpy as np
+
+import realtime
+
+
+class SlowModel:
+    """记录同时进行中的推理数；推理期间让出CPU，放大并发重叠"""
+
+    def __init__(self):
+        self.active = 0
+        self.overlaps = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, frame, verbose=False, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.overlaps += self.active > 1
+        time.sleep(0.01)
+        with self.lock:
+            self.active -= 1
+        return [type("Result", (), {"keypoints": None})()]
+
+
+def run_concurrently(target, threads=4):
+    workers = [threading.Thread(target=target) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def test_frames_of_one_session_are_serialized():
+    session = realtime.RealtimeSession(np.zeros((10, 17, 2)))
+    model = SlowModel()
+    frame = np.zeros((32, 32, 3), np.uint8)
+    run_concurrently(lambda: [session.detect(frame, model, roi_tracking=False) for _ in range(5)])
+    assert model.overlaps == 0
+    assert session.missed == 20
+
+
+class BatchRecorder:
+    """记录每批中各帧的会话编号（写在帧的像素值里）"""
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, frames, verbose=False, **kwargs):
+        self.batches.append([int(frame[0, 0, 0]) for frame in frames])
+        time.sleep(0.01)
+        return [type("Result", (), {"keypoints": None})() for _ in frames]
+
+
+def test_batched_frames_of_one_session_are_serialized():
+    sessions = [realtime.RealtimeSession(np.zeros((10, 17, 2))) for _ in range(2)]
+    recorder = BatchRecorder()
+    batcher = realtime.InferenceBatcher(recorder, max_batch=8, max_wait=0.005)
+
+    def client(index):
+        frame = np.full((32, 32, 3), index, np.uint8)
+        return lambda: [sessions[index].detect(frame, batcher, roi_tracking=False) for _ in range(5)]
+
+    workers = [threading.Thread(target=client(i % 2)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    # 同一会话的帧不会进入同一批
+    assert all(len(batch) == len(set(batch)) for batch in recorder.batches)
+    assert sum(map(len, recorder.batches)) == 20
+    assert max(map(len, recorder.batches)) <= 2
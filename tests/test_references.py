@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import process
+import references
+
+STANDARD_KEYPOINTS = os.path.join(os.path.dirname(__file__), "..", "keypoints", "aligned1.json")
+
+
+@pytest.fixture
+def library(tmp_path):
+    """默认参考动作及其时间倒放版本：姿态相同、顺序不同"""
+    kps = process.load_keypoints(STANDARD_KEYPOINTS)
+    library = references.ReferenceLibrary(str(tmp_path))
+    library.add("default", kps, 30.0)
+    library.add("rev", kps[::-1].copy(), 30.0)
+    return library, kps
+
+
+@pytest.mark.parametrize("start, stop", [(30, 98), (20, 60), (50, 95), (0, 40)])
+def test_subclip_matches_its_reference(library, start, stop):
+    library, kps = library
+    candidates = library.match(kps[start:stop], 30.0)
+    assert candidates[0]["name"] == "default"
+    assert candidates[0]["distance"] < 0.05
+    assert candidates[0]["offset"] == pytest.approx(start / 30.0, abs=0.05)
+
+
+@pytest.mark.parametrize("start", [0, 40])
+def test_clip_shorter_than_window_matches_its_reference(library, start):
+    library, kps = library
+    # 13帧（30 fps）重采样后不足一个窗口
+    candidates = library.match(kps[start:start + 13], 30.0)
+    assert candidates[0]["name"] == "default"
+    assert candidates[0]["offset"] == pytest.approx(start / 30.0, abs=0.05)
+
+
+def test_short_clip_is_not_stretched_to_a_window():
+    kps = process.load_keypoints(STANDARD_KEYPOINTS)[:13]
+    features, starts, mask = references.window_embeddings(kps, 30.0)
+    assert len(starts) == 1
+    # 5帧（10 fps）只覆盖窗口开头的取样帧
+    assert mask.sum() < references.EMBED_SAMPLES
+    assert features.shape[1] == mask.sum() * len(references.EMBED_JOINTS) * 2
@@ -0,0 +1,74 @@
+import os
+import time
+
+import storage
+
+
+def write(path, size, age=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+
+
+def make_tree(tmp_path):
+    uploads = tmp_path / "uploads"
+    partial = uploads / ".partial"
+    work = tmp_path / "work"
+    # 结果视频在工作目录中生成，再硬链接发布到上传目录
+    write(str(partial / "upload-id"), 500, age=60)
+    write(str(uploads / "old.mp4"), 100, age=90)
+    write(str(work / "key" / "overlay.mp4"), 1000, age=30)
+    os.utime(str(work / "key"), (time.time() - 30,) * 2)
+    storage.publish(str(work / "key" / "overlay.mp4"), str(uploads / "user_叠加.mp4"))
+    janitor = storage.Janitor(
+        [str(uploads), str(partial), str(work)], max_bytes=1200, ttl=3600, ttl_only=[str(partial)])
+    return janitor, uploads, partial, work
+
+
+def test_hard_links_are_counted_once(tmp_path):
+    janitor, uploads, partial, work = make_tree(tmp_path)
+    janitor.max_bytes = 1600
+    assert janitor.sweep() == {"removed": 0, "bytes": 0, "total": 1600}
+
+
+def test_partial_uploads_are_not_evicted_by_quota(tmp_path):
+    janitor, uploads, partial, work = make_tree(tmp_path)
+    result = janitor.sweep()
+    assert (partial / "upload-id").exists()
+    assert not (uploads / "old.mp4").exists()
+    # 结果视频的两个硬链接都删除后才真正释放空间
+    assert not (work / "key").exists() and not (uploads / "user_叠加.mp4").exists()
+    assert result == {"removed": 3, "bytes": 1100, "total": 500}
+
+
+def test_removing_one_link_frees_nothing(tmp_path):
+    janitor, uploads, partial, work = make_tree(tmp_path)
+    janitor.max_bytes = 1500
+    janitor.protect = lambda: [str(work / "key")]
+    result = janitor.sweep()
+    assert result["bytes"] == 100 and result["total"] == 1500
+    assert (work / "key" / "overlay.mp4").exists()
+
+
+def test_partial_uploads_expire_by_ttl(tmp_path):
+    janitor, uploads, partial, work = make_tree(tmp_path)
+    janitor.max_bytes = 10 ** 6
+    janitor.ttl = 45
+    janitor.sweep()
+    assert not (partial / "upload-id").exists()
+    assert not (uploads / "old.mp4").exists()
+    assert (work / "key" / "overlay.mp4").exists()
+
+
+def test_move_unique_does_not_overwrite(tmp_path):
+    uploads = tmp_path / "uploads"
+    write(str(uploads / "a.mp4"), 1)
+    names = []
+    for size in (2, 3):
+        write(str(tmp_path / "src"), size)
+        names.append(storage.move_unique(str(tmp_path / "src"), str(uploads), "a.mp4"))
+    assert names == ["a_1.mp4", "a_2.mp4"]
+    assert [os.path.getsize(str(uploads / name)) for name in ["a.mp4"] + names] == [1, 2, 3]
+    assert not (tmp_path / "src").exists()
@@ -0,0 +1,116 @@
+import os
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # app 在导入时按相对路径创建目录并加载模型
+    monkeypatch.chdir(ROOT)
+    import app as app_module
+
+    # 等后台预加载结束，否则解释器退出时推理线程仍在运行
+    for thread in threading.enumerate():
+        if thread.name == "preload":
+            thread.join()
+
+    uploads = tmp_path / "uploads"
+    partial = uploads / ".partial"
+    partial.mkdir(parents=True)
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(uploads))
+    monkeypatch.setattr(app_module, "PARTIAL_FOLDER", str(partial))
+    monkeypatch.setattr(app_module, "start_transcode", lambda filename: None)
+    return app_module.app.test_client(), uploads
+
+
+@pytest.fixture
+def app_module(client):
+    import app as app_module
+    return app_module
+
+
+@pytest.mark.parametrize("name, ext", [("视频.mp4", ".mp4"), ("舞蹈 练习.WEBM", ".webm")])
+def test_stream_upload_accepts_cjk_filename(client, name, ext):
+    client, uploads = client
+    response = client.post("/upload_stream", query_string={"filename": name}, data=b"video")
+    assert response.status_code == 200
+    filename = response.get_json()["filename"]
+    assert filename.endswith(ext) and len(filename) > len(ext)
+    assert (uploads / filename).read_bytes() == b"video"
+
+
+def test_chunked_cjk_upload_uses_one_name(client):
+    client, uploads = client
+    first = client.post("/upload_stream", query_string={"filename": "视频.mp4", "offset": 0, "final": 0},
+                        data=b"abc")
+    assert first.status_code == 200
+    upload_id = first.get_json()["upload_id"]
+    last = client.post("/upload_stream", query_string={"filename": "视频.mp4", "offset": 3, "final": 1,
+                                                       "upload_id": upload_id}, data=b"def")
+    assert last.status_code == 200
+    assert (uploads / last.get_json()["filename"]).read_bytes() == b"abcdef"
+
+
+def test_rejects_disallowed_extension(client):
+    client, _ = client
+    response = client.post("/upload_stream", query_string={"filename": "视频.exe"}, data=b"x")
+    assert response.status_code == 400
+
+
+def test_same_name_uploads_keep_both_files(client):
+    client, uploads = client
+    names = []
+    for data in (b"first", b"second"):
+        response = client.post("/upload_stream", query_string={"filename": "a.mp4"}, data=data)
+        names.append(response.get_json()["filename"])
+    assert names == ["a.mp4", "a_1.mp4"]
+    assert (uploads / "a.mp4").read_bytes() == b"first"
+
+
+def test_transcode_does_not_overwrite_existing_mp4(client, app_module, monkeypatch):
+    _, uploads = client
+
+    def transcode(src_path, dst_path, width, max_fps, progress=None):
+        with open(dst_path, "wb") as f:
+            f.write(b"transcoded")
+        return {"fps": 30.0, "size": (width, width)}
+
+    monkeypatch.setattr(app_module.process, "needs_transcode", lambda *args: True)
+    monkeypatch.setattr(app_module.process, "transcode_for_analysis", transcode)
+    (uploads / "a.mp4").write_bytes(b"existing")
+    (uploads / "a.webm").write_bytes(b"webm")
+    result = app_module.run_transcode("a.webm")
+    assert result["filename"] == "a_1.mp4"
+    assert (uploads / "a.mp4").read_bytes() == b"existing"
+    assert (uploads / "a_1.mp4").read_bytes() == b"transcoded"
+    assert not (uploads / "a.webm").exists()
+
+
+def test_interleaved_same_name_uploads_do_not_mix(client):
+    client, uploads = client
+    ids = []
+    for data in (b"aaa", b"bbb"):
+        response = client.post("/upload_stream", query_string={"filename": "a.mp4", "offset": 0, "final": 0},
+                               data=data)
+        ids.append(response.get_json()["upload_id"])
+    assert ids[0] != ids[1]
+    contents = []
+    for upload_id, data in zip(ids, (b"AAA", b"BBB")):
+        response = client.post("/upload_stream", query_string={"filename": "a.mp4", "offset": 3, "final": 1,
+                                                               "upload_id": upload_id}, data=data)
+        assert response.status_code == 200
+        contents.append((uploads / response.get_json()["filename"]).read_bytes())
+    assert contents == [b"aaaAAA", b"bbbBBB"]
+
+
+@pytest.mark.parametrize("upload_id", [None, "../a.mp4"])
+def test_later_chunks_need_a_valid_upload_id(client, upload_id):
+    client, _ = client
+    query = {"filename": "a.mp4", "offset": 3, "final": 1}
+    if upload_id is not None:
+        query["upload_id"] = upload_id
+    response = client.post("/upload_stream", query_string=query, data=b"x")
+    assert response.status_code == 400